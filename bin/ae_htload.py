@@ -20,6 +20,9 @@ import json
 import db
 import loadlib
 import accessionlib
+import pgCopy
+import bcpWriter
+import loadBcp
 
 TAB = '\t'
 CRT = '\n'
@@ -108,9 +111,8 @@ fpExpParsingFile = None
 # For bcp
 #
 
-bcpin = '%s/bin/bcpin.csh' % os.environ['PG_DBUTILS']
-server = os.environ['MGD_DBSERVER']
-database = os.environ['MGD_DBNAME']
+# number of bcp files loaded at the same time
+loadJobs = int(os.getenv('LOAD_JOBS', '4'))
 
 expt_table = 'GXD_HTExperiment'
 acc_table = 'ACC_Accession'
@@ -141,6 +143,15 @@ fpVariableBcp =  None
 propertyFileName = os.getenv('PROPERTY_FILENAME')
 fpPropertyBcp = None
 
+#
+# bcp: write the bcp files, loaded by doBCP() with bcpin.csh
+# copy: load the tables with COPY as they are written, see pgCopy.py;
+#       the bcp files are still written if COPY_TEE_BCP is 'true'
+#
+loadBackend = os.getenv('LOAD_BACKEND', 'bcp')
+copyTeeBcp = os.getenv('COPY_TEE_BCP', 'true')
+copyLoader = None
+
 # for MGI_Propertay (experiments)
 expTypePropKey = 20475425
 expFactorPropKey = 20475423
@@ -252,35 +263,39 @@ def initialize():
     except:
          print('Cannot create %s' % expParsingFileName)
 
-    try:
-        fpExperimentBcp = open('%s/%s' % (outputDir, experimentFileName), 'w')
-    except:
-        print('Cannot create %s' % experimentFileName)
+    if loadBackend == 'copy':
+        if openCopyLoader() != 0:
+            return 1
+    else:
+        try:
+            fpExperimentBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, experimentFileName), 'w'), expt_table, userKey, loadDate)
+        except:
+            print('Cannot create %s' % experimentFileName)
 
-    try:
-        fpSampleBcp = open('%s/%s' % (outputDir, sampleFileName), 'w')
-    except:
-        print('Cannot create %s' % sampleFileName)
+        try:
+            fpSampleBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, sampleFileName), 'w'), sample_table, userKey, loadDate)
+        except:
+            print('Cannot create %s' % sampleFileName)
 
-    try:
-        fpAccBcp = open('%s/%s' % (outputDir, accFileName), 'w')
-    except:
-        print('Cannot create %s' % accFileName)
+        try:
+            fpAccBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, accFileName), 'w'), acc_table, userKey, loadDate)
+        except:
+            print('Cannot create %s' % accFileName)
 
-    try:
-        fpVariableBcp = open('%s/%s' % (outputDir, variableFileName), 'w')
-    except:
-        print('Cannot create %s' % variableFileName) 
+        try:
+            fpVariableBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, variableFileName), 'w'), exptvar_table, userKey, loadDate)
+        except:
+            print('Cannot create %s' % variableFileName) 
 
-    try:
-        fpPropertyBcp = open('%s/%s' % (outputDir, propertyFileName), 'w')
-    except:
-        print('Cannot create %s' % propertyFileName)
+        try:
+            fpPropertyBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, propertyFileName), 'w'), property_table, userKey, loadDate)
+        except:
+            print('Cannot create %s' % propertyFileName)
 
-    try:
-        fpKeyValueBcp = open('%s/%s' % (outputDir, keyValueFileName), 'w')
-    except:
-        print('Cannot create %s' % keyValueFileName)
+        try:
+            fpKeyValueBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, keyValueFileName), 'w'), keyvalue_table, userKey, loadDate)
+        except:
+            print('Cannot create %s' % keyValueFileName)
 
     db.useOneConnection(1)
 
@@ -548,21 +563,19 @@ def processExperiment(expJFile):
     # GXD_HTExperiment BCP
     #
 
-    line = '%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (currentExptKey, TAB, sourceKey, TAB, title, TAB, description, TAB, relDate, TAB, updateDate, TAB, evalDate, TAB, defaultEvalStateTermKey, TAB, curStateTermKey, TAB, studyTypeTermKey, TAB, exptTypeKey, TAB, evalByKey, TAB, initCurByKey, TAB, lastCurByKey, TAB, initCurDate, TAB, lastCurDate, TAB, confidence, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT)
-    #print('line: %s' % line)
-    fpExperimentBcp.write(line)
+    fpExperimentBcp.write(currentExptKey, sourceKey, title, description, relDate, updateDate, evalDate, defaultEvalStateTermKey, curStateTermKey, studyTypeTermKey, exptTypeKey, evalByKey, initCurByKey, lastCurByKey, initCurDate, lastCurDate, confidence)
 
     #
     # GXD_HTVariable BCP
     #
-    fpVariableBcp.write('%s%s%s%s%s%s' % (nextExptVarKey, TAB, currentExptKey, TAB, exptVariableTermKey, CRT))
+    fpVariableBcp.write(nextExptVarKey, currentExptKey, exptVariableTermKey)
     nextExptVarKey += 1
 
     #
     # ACC_Accession BCP
     #
     prefixPart, numericPart = accessionlib.split_accnum(exptID)
-    fpAccBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextAccKey, TAB, exptID, TAB, prefixPart, TAB, numericPart, TAB, aeLdbKey, TAB, currentExptKey, TAB, mgiTypeKey, TAB, private, TAB, isPreferred, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT ))
+    fpAccBcp.write(nextAccKey, exptID, prefixPart, numericPart, aeLdbKey, currentExptKey, mgiTypeKey, private, isPreferred)
     nextAccKey += 1
 
     #
@@ -579,29 +592,23 @@ def processExperiment(expJFile):
     #   
     # description (1) sample overalldesign + expt summary
     #   
-    # the template for properties:
-    propertyTemplate = "#====#%s%s%s#=#%s%s%s%s%s#==#%s#===#%s%s%s%s%s%s%s%s%s" % (TAB, propTypeKey, TAB, TAB, currentExptKey, TAB, mgiTypeKey, TAB, TAB, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT )
 
     if title != '':
-        toLoad = propertyTemplate.replace('#=#', str(namePropKey)).replace('#==#', title).replace('#===#', '1').replace('#====#', str(nextPropKey))
-        fpPropertyBcp.write(toLoad)
+        fpPropertyBcp.write(nextPropKey, propTypeKey, namePropKey, currentExptKey, mgiTypeKey, title, 1)
         nextPropKey += 1
 
     if sampleCount != '':
-        toLoad = propertyTemplate.replace('#=#', str(sampleCountPropKey)).replace('#==#', sampleCount).replace('#===#', '1').replace('#====#', str(nextPropKey))
-        fpPropertyBcp.write(toLoad)
+        fpPropertyBcp.write(nextPropKey, propTypeKey, sampleCountPropKey, currentExptKey, mgiTypeKey, sampleCount, 1)
         nextPropKey += 1
 
     seqNumCt = 1
     for e in exptTypeList:
-        toLoad = propertyTemplate.replace('#=#', str(expTypePropKey)).replace('#==#', e).replace('#===#', str(seqNumCt)).replace('#====#', str(nextPropKey))
-        fpPropertyBcp.write(toLoad)
+        fpPropertyBcp.write(nextPropKey, propTypeKey, expTypePropKey, currentExptKey, mgiTypeKey, e, seqNumCt)
         seqNumCt += 1
         nextPropKey += 1
 
     for b in pubMedIdList:
-        toLoad = propertyTemplate.replace('#=#', str(pubmedPropKey)).replace('#==#', str(b)).replace('#===#', str(seqNumCt)).replace('#====#', str(nextPropKey))
-        fpPropertyBcp.write(toLoad)
+        fpPropertyBcp.write(nextPropKey, propTypeKey, pubmedPropKey, currentExptKey, mgiTypeKey, b, seqNumCt)
         seqNumCt += 1
         nextPropKey += 1
 
@@ -750,7 +757,7 @@ def processSample(fpSampFile, experiment):
         unitCharFactorAttrList = samplesToWriteList[4:]
 
         # write to fpSampleBcp 
-        fpSampleBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextRawSampleKey, TAB, exptKey, TAB, sampleID, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+        fpSampleBcp.write(nextRawSampleKey, exptKey, sampleID)
         if existing == 0:
             newExptSamplesLoadedCount += 1
         else:
@@ -770,22 +777,22 @@ def processSample(fpSampFile, experiment):
         # write to parsing report and bcp
         if source_name:
             fpExpParsingFile.write('source_name: "%s"%s' % (source_name, CRT))
-            fpKeyValueBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextKeyValueKey, TAB, nextRawSampleKey, TAB, rawSampleMgiTypeKey, TAB, rawSourceKey, TAB, source_name, TAB, '1', TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+            fpKeyValueBcp.write(nextKeyValueKey, nextRawSampleKey, rawSampleMgiTypeKey, rawSourceKey, source_name, 1)
             nextKeyValueKey += 1
 
         if ena_sample:
             fpExpParsingFile.write('ena_sample: "%s"%s' % (ena_sample, CRT))
-            fpKeyValueBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextKeyValueKey, TAB, nextRawSampleKey, TAB, rawSampleMgiTypeKey, TAB, rawEnaSampleKey, TAB, ena_sample, TAB, '1', TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+            fpKeyValueBcp.write(nextKeyValueKey, nextRawSampleKey, rawSampleMgiTypeKey, rawEnaSampleKey, ena_sample, 1)
             nextKeyValueKey += 1
 
         if biosd_sample:
             fpExpParsingFile.write('biosd_sample: "%s"%s' % (biosd_sample, CRT))
-            fpKeyValueBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextKeyValueKey, TAB, nextRawSampleKey, TAB, rawSampleMgiTypeKey, TAB, rawBioSdSampleKey, TAB, biosd_sample, TAB, '1', TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+            fpKeyValueBcp.write(nextKeyValueKey, nextRawSampleKey, rawSampleMgiTypeKey, rawBioSdSampleKey, biosd_sample, 1)
             nextKeyValueKey += 1
 
         if extract_name:
             fpExpParsingFile.write('extract_name: "%s"%s' % (extract_name, CRT))
-            fpKeyValueBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextKeyValueKey, TAB, nextRawSampleKey, TAB, rawSampleMgiTypeKey, TAB, rawExtractNameKey, TAB, extract_name, TAB, '1', TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+            fpKeyValueBcp.write(nextKeyValueKey, nextRawSampleKey, rawSampleMgiTypeKey, rawExtractNameKey, extract_name, 1)
             nextKeyValueKey += 1
 
         #
@@ -795,7 +802,7 @@ def processSample(fpSampFile, experiment):
         for uca in unitCharFactorAttrList:
             (key, value) = str.split(uca, '|')
             fpExpParsingFile.write('%s: "%s"%s' % (key, value, CRT))
-            fpKeyValueBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextKeyValueKey, TAB, nextRawSampleKey, TAB, rawSampleMgiTypeKey, TAB, key, TAB, value, TAB, '1', TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+            fpKeyValueBcp.write(nextKeyValueKey, nextRawSampleKey, rawSampleMgiTypeKey, key, value, 1)
             nextKeyValueKey += 1
                 
         nextRawSampleKey += 1
@@ -890,6 +897,68 @@ def writeQC():
 
 # end writeQC() -----------------------------------------
 
+#
+# Purpose: opens the COPY load, the bcp file descriptors become the table
+#       streams of the load
+# Returns: 1 if the database connection fails, else 0
+# Assumes: Nothing
+# Effects: connects to the database, starts the COPY of MGI_KeyValue,
+#       creates the bcp files if COPY_TEE_BCP is 'true'
+# Throws: Nothing
+#
+
+def openCopyLoader():
+    global fpExperimentBcp, fpSampleBcp, fpAccBcp, fpVariableBcp 
+    global fpPropertyBcp, fpKeyValueBcp, copyLoader
+
+    try:
+        copyLoader = pgCopy.CopyLoader(pgCopy.connect(), keyvalue_table)
+    except Exception as e:
+        print('Cannot connect for COPY load: %s' % e)
+        return 1
+
+    # the tables in the order of doBCP()
+    fpKeyValueBcp = openCopyTable(keyvalue_table, keyValueFileName)
+    fpExperimentBcp = openCopyTable(expt_table, experimentFileName)
+    fpAccBcp = openCopyTable(acc_table, accFileName)
+    fpVariableBcp = openCopyTable(exptvar_table, variableFileName)
+    fpPropertyBcp = openCopyTable(property_table, propertyFileName)
+    fpSampleBcp = openCopyTable(sample_table, sampleFileName)
+
+    return 0
+
+# end openCopyLoader() -----------------------------------------
+
+#
+# Purpose: gets the bcp file a COPY table stream is teed to
+# Returns: full path of 'fileName', None if COPY_TEE_BCP is not 'true'
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
+
+def copyTeeFile(fileName):
+
+    if copyTeeBcp == 'true':
+        return '%s/%s' % (outputDir, fileName)
+    return None
+
+# end copyTeeFile() -----------------------------------------
+
+#
+# Purpose: opens the COPY table stream of 'table' for its BcpWriter
+# Returns: bcpWriter.BcpWriter
+# Assumes: copyLoader is open
+# Effects: starts the COPY of 'table'
+# Throws: psycopg2.Error
+#
+
+def openCopyTable(table, fileName):
+
+    return bcpWriter.BcpWriter(copyLoader.open(table, copyTeeFile(fileName)), table, userKey, loadDate)
+
+# end openCopyTable() -----------------------------------------
+
 #
 # Purpose: executes bcp
 # Returns: non-zero if bcp error, else 0
@@ -902,47 +971,25 @@ def doBCP():
 
     rc = 0
 
-    if os.path.getsize(outputDir + "/" + experimentFileName) > 0:
-        bcpCmd = '%s %s %s %s %s %s "\\t" "\\n" mgd' % (bcpin, server, database, expt_table, outputDir, experimentFileName)
-        print('bcpCmd: %s' % bcpCmd)
-        rc = os.system(bcpCmd)
-        if rc:
-            return rc
-
-    if os.path.getsize(outputDir + "/" + accFileName) > 0:
-        bcpCmd = '%s %s %s %s %s %s "\\t" "\\n" mgd' % (bcpin, server, database, acc_table, outputDir, accFileName)
-        print('bcpCmd: %s' % bcpCmd)
-        rc = os.system(bcpCmd)
-        if rc:
-            return rc
-
-    if os.path.getsize(outputDir + "/" + variableFileName) > 0:
-        bcpCmd = '%s %s %s %s %s %s "\\t" "\\n" mgd' % (bcpin, server, database, exptvar_table, outputDir, variableFileName)
-        print('bcpCmd: %s' % bcpCmd)
-        rc = os.system(bcpCmd)
-        if rc:
-            return rc
-
-    if os.path.getsize(outputDir + "/" + propertyFileName) > 0:
-        bcpCmd = '%s %s %s %s %s %s "\\t" "\\n" mgd' % (bcpin, server, database, property_table, outputDir, propertyFileName)
-        print('bcpCmd: %s' % bcpCmd)
-        rc = os.system(bcpCmd)
-        if rc:
-            return rc
-
-    if os.path.getsize(outputDir + "/" + sampleFileName) > 0:
-        bcpCmd = '%s %s %s %s %s %s "\\t" "\\n" mgd' % (bcpin, server, database, sample_table, outputDir, sampleFileName)
-        print('bcpCmd: %s' % bcpCmd)
-        rc = os.system(bcpCmd)
-        if rc:
-            return rc
-
-    if os.path.getsize(outputDir + "/" + keyValueFileName) > 0:
-        bcpCmd = '%s %s %s %s %s %s "\\t" "\\n" mgd' % (bcpin, server, database, keyvalue_table, outputDir, keyValueFileName)
-        print('bcpCmd: %s' % bcpCmd)
-        rc = os.system(bcpCmd)
-        if rc:
-            return rc
+    # commit the COPY load
+    if copyLoader:
+        try:
+            copyLoader.close(pgCopy.SETVAL_SQL)
+        except Exception as e:
+            print('COPY load failed: %s' % e)
+            return 1
+        return rc
+
+    # tables that do not depend on each other are loaded in parallel
+    rc = loadBcp.loadTables(outputDir, {
+        expt_table:experimentFileName,
+        acc_table:accFileName,
+        exptvar_table:variableFileName,
+        property_table:propertyFileName,
+        sample_table:sampleFileName,
+        keyvalue_table:keyValueFileName}, loadJobs)
+    if rc:
+        return rc
 
     # update gxd_htexperiment_seq auto-sequence
     db.sql(''' select setval('gxd_htexperiment_seq', (select max(_Experiment_key) from GXD_HTExperiment)) ''', None)
@@ -985,6 +1032,21 @@ def closeFiles():
 
 # end closeFiles() -----------------------------------------
 
+#
+# Purpose: rolls back the COPY load of a failed run
+# Returns: nothing
+# Assumes: closeFiles() has been called
+# Effects: rolls back the database transaction
+# Throws: Nothing
+#
+def abortCopy():
+
+    if copyLoader:
+        print('COPY load rolled back')
+        copyLoader.abort()
+
+# end abortCopy() -----------------------------------------
+
 #
 # main
 #
@@ -995,15 +1057,18 @@ if initialize() != 0:
 if processAll() != 0:
     print("ae_htload failed during processing")
     closeFiles()
+    abortCopy()
     sys.exit(1)
 
 if writeQC() != 0:
     print("ae_htload failed writing QC")
     closeFiles()
+    abortCopy()
     sys.exit(1)
 
 if closeFiles() != 0:
     print("ae_htload failed closing files")
+    abortCopy()
     sys.exit(1)
 
 if doBCP() != 0:
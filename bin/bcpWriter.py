@@ -0,0 +1,194 @@
+'''
+#
+# bcpWriter.py
+#
+# Writes the rows of the bcp tables of geo_htload.py and ae_htload.py
+#
+# Each table has one row format, built once from its columns: a %s field
+# for each column the loader supplies and, for tables with the audit
+# columns, the constant suffix
+#       _CreatedBy_key, _ModifiedBy_key, creation_date, modification_date
+# already formatted with the load's user key and date. Rows are buffered
+# and written BATCH_ROWS at a time to the bcp file, or to the pgCopy table
+# stream when LOAD_BACKEND=copy.
+#
+# Values are written as given; the loaders clean them as before.
+#
+# Usage:
+#       bcpWriter.py --benchmark [--rows N]
+#
+#       --benchmark  rows per second of each table, formatted with the
+#                    loaders' previous per-row format strings and with
+#                    BcpWriter, written to /dev/null
+#
+'''
+import sys
+import time
+import argparse
+
+TAB = '\t'
+CRT = '\n'
+
+# rows buffered before a write
+BATCH_ROWS = 1000
+
+# table: (columns supplied by the loader, 1 if the table has the audit
+# columns), in table column order
+TABLE_DICT = {
+    'GXD_HTExperiment': (['_Experiment_key', '_Source_key', 'name',
+        'description', 'release_date', 'lastupdate_date', 'evaluated_date',
+        '_EvaluationState_key', '_CurationState_key', '_StudyType_key',
+        '_ExperimentType_key', '_EvaluatedBy_key', '_InitialCuratedBy_key',
+        '_LastCuratedBy_key', 'initial_curated_date', 'last_curated_date',
+        'confidence'], 1),
+    'ACC_Accession': (['_Accession_key', 'accID', 'prefixPart',
+        'numericPart', '_LogicalDB_key', '_Object_key', '_MGIType_key',
+        'private', 'preferred'], 1),
+    'GXD_HTExperimentVariable': (['_ExperimentVariable_key',
+        '_Experiment_key', '_Term_key'], 0),
+    'MGI_Property': (['_Property_key', '_PropertyType_key',
+        '_PropertyTerm_key', '_Object_key', '_MGIType_key', 'value',
+        'sequenceNum'], 1),
+    'GXD_HTRawSample': (['_RawSample_key', '_Experiment_key', 'accID'], 1),
+    'MGI_KeyValue': (['_KeyValue_key', '_Object_key', '_MGIType_key', 'key',
+        'value', 'sequenceNum'], 1),
+    }
+
+class BcpWriter:
+    # Is: the rows of one bcp table
+    # Has: the file or table stream the rows go to, the table's row format,
+    #       the buffered rows
+    # Does: write(), flush(), close()
+    #
+    def __init__ (self, fp, table, userKey, loadDate, batchRows=BATCH_ROWS):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: 'table' is in TABLE_DICT
+        # Effects: nothing
+        # Throws: KeyError if 'table' is not in TABLE_DICT
+        (columnList, hasAudit) = TABLE_DICT[table]
+        self.fp = fp
+        self.table = table
+        self.batchRows = batchRows
+        self.rowList = []
+
+        suffix = CRT
+        if hasAudit:
+            suffix = '%s%s%s%s%s%s%s%s%s' % (TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT)
+        self.rowFormat = TAB.join(['%s'] * len(columnList)) + suffix.replace('%', '%%')
+
+    def write(self, *values):
+        # Purpose: adds a row
+        # Returns: nothing
+        # Assumes: 'values' are the table's loader columns, in order
+        # Effects: writes the buffered rows when there are batchRows
+        # Throws: TypeError if the number of values is wrong, IOError
+        self.rowList.append(self.rowFormat % values)
+        if len(self.rowList) >= self.batchRows:
+            self.flush()
+
+    def flush(self):
+        # Purpose: writes the buffered rows
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: writes to the file or table stream
+        # Throws: IOError
+        if self.rowList:
+            self.fp.write(''.join(self.rowList))
+            self.rowList = []
+
+    def close(self):
+        # Purpose: writes the buffered rows and closes the file
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: writes to and closes the file or table stream
+        # Throws: IOError
+        self.flush()
+        self.fp.close()
+
+# end class BcpWriter -----------------------------------------
+
+#
+# Purpose: times the rows of each table, formatted the way the loaders
+#       did before BcpWriter and with BcpWriter
+# Returns: nothing
+# Assumes: nothing
+# Effects: writes to /dev/null and stdout
+# Throws: nothing
+#
+
+def benchmark(rows):
+
+    userKey = 1626
+    loadDate = '10/18/2026'
+    title = 'Gene expression in the developing mouse kidney'
+
+    # the previous per-row format of each table
+    def oldExperiment(fp, i):
+        fp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (i, TAB, 87145238, TAB, title, TAB, title, TAB, '2024-01-01', TAB, '', TAB, '', TAB, 20225943, TAB, 20475421, TAB, 20475461, TAB, 20475438, TAB, '', TAB, '', TAB, '', TAB, '', TAB, '', TAB, 0.0, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+    def oldAccession(fp, i):
+        fp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (i, TAB, 'GSE%s' % i, TAB, 'GSE', TAB, i, TAB, 190, TAB, i, TAB, 42, TAB, 0, TAB, 1, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+    def oldVariable(fp, i):
+        fp.write('%s%s%s%s%s%s' % (i, TAB, i, TAB, 20475439, CRT))
+    def oldProperty(fp, i):
+        propertyTemplate = "#====#%s%s%s#=#%s%s%s%s%s#==#%s#===#%s%s%s%s%s%s%s%s%s" % (TAB, 1002, TAB, TAB, i, TAB, 42, TAB, TAB, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT)
+        fp.write(propertyTemplate.replace('#=#', str(20475428)).replace('#==#', title).replace('#===#', '1').replace('#====#', str(i)))
+    def oldRawSample(fp, i):
+        fp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (i, TAB, i, TAB, 'GSM%s' % i, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+    def oldKeyValue(fp, i):
+        fp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (i, TAB, i, TAB, 47, TAB, 'tissue', TAB, title, TAB, 1, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+
+    def newExperiment(w, i):
+        w.write(i, 87145238, title, title, '2024-01-01', '', '', 20225943, 20475421, 20475461, 20475438, '', '', '', '', '', 0.0)
+    def newAccession(w, i):
+        w.write(i, 'GSE%s' % i, 'GSE', i, 190, i, 42, 0, 1)
+    def newVariable(w, i):
+        w.write(i, i, 20475439)
+    def newProperty(w, i):
+        w.write(i, 1002, 20475428, i, 42, title, 1)
+    def newRawSample(w, i):
+        w.write(i, i, 'GSM%s' % i)
+    def newKeyValue(w, i):
+        w.write(i, i, 47, 'tissue', title, 1)
+
+    for (table, old, new) in (
+            ('GXD_HTExperiment', oldExperiment, newExperiment),
+            ('ACC_Accession', oldAccession, newAccession),
+            ('GXD_HTExperimentVariable', oldVariable, newVariable),
+            ('MGI_Property', oldProperty, newProperty),
+            ('GXD_HTRawSample', oldRawSample, newRawSample),
+            ('MGI_KeyValue', oldKeyValue, newKeyValue)):
+
+        fp = open('/dev/null', 'w')
+        startTime = time.time()
+        for i in range(rows):
+            old(fp, i)
+        fp.close()
+        oldTime = time.time() - startTime
+
+        w = BcpWriter(open('/dev/null', 'w'), table, userKey, loadDate)
+        startTime = time.time()
+        for i in range(rows):
+            new(w, i)
+        w.close()
+        newTime = time.time() - startTime
+
+        print('%s: %.0f rows/s before, %.0f rows/s BcpWriter' % (table, rows / oldTime, rows / newTime))
+
+#
+# main
+#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='bcp table row writer')
+    parser.add_argument('--benchmark', action='store_true',
+        help='rows per second of each table, before and with BcpWriter')
+    parser.add_argument('--rows', type=int, default=500000,
+        help='rows per table in the benchmark')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.rows)
+
+    sys.exit(0)
@@ -0,0 +1,208 @@
+'''
+#
+# deleteSamples.py
+#
+# Deletes the raw samples and key/values listed in the sample delete file
+# written by geo_htload.py (DELETE_FILENAME)
+#
+# The delete file has one key per line:
+#       experiment<TAB>_Experiment_key    all raw samples of the experiment
+#       rawsample<TAB>_RawSample_key      one raw sample
+#       keyvalue<TAB>_KeyValue_key        one key/value
+#
+# The keys are copied into temporary tables and each table is deleted from
+# with one join; the key/values of the deleted raw samples are deleted
+# explicitly rather than by the GXD_HTRawSample delete trigger. Everything
+# runs in one transaction.
+#
+# The delete runs on a psycopg2 connection (pgCopy.connect()). If psycopg2
+# is not installed, the same statements are run as a psql script, the keys
+# copied in from the script, in one transaction (psql -1).
+#
+# Usage:
+#       deleteSamples.py
+#
+# Exit:
+#       0 if the deletes were committed, else 1
+#
+'''
+import io
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import pgCopy
+
+TAB = '\t'
+CRT = '\n'
+
+# lines of the delete file
+EXPERIMENT = 'experiment'
+RAWSAMPLE = 'rawsample'
+KEYVALUE = 'keyvalue'
+
+# MGI_KeyValue._MGIType_key of raw samples
+rawSampleMgiTypeKey = 47
+
+# the temporary tables of the keys, in the order of the lines
+TABLE_LIST = [(EXPERIMENT, 'delete_experiment', '_experiment_key'),
+    (RAWSAMPLE, 'delete_rawsample', '_rawsample_key'),
+    (KEYVALUE, 'delete_keyvalue', '_keyvalue_key')]
+
+# the steps of the delete once the keys are copied in, (name, sql); a
+# name of None is not reported
+#   the raw samples of the experiments, then the key/values of all raw
+#   samples to be deleted, then the deletes
+STEP_LIST = [
+    (None, '''analyze delete_experiment'''),
+    ('raw samples of experiments', '''insert into delete_rawsample
+        select rs._rawsample_key
+        from GXD_HTRawSample rs, delete_experiment d
+        where rs._experiment_key = d._experiment_key'''),
+    ('key/values of raw samples', '''insert into delete_keyvalue
+        select kv._keyvalue_key
+        from MGI_KeyValue kv, delete_rawsample d
+        where kv._object_key = d._rawsample_key
+        and kv._mgitype_key = %s''' % rawSampleMgiTypeKey),
+    (None, '''analyze delete_rawsample'''),
+    (None, '''analyze delete_keyvalue'''),
+    ('MGI_KeyValue', '''delete from MGI_KeyValue kv
+        using (select distinct _keyvalue_key from delete_keyvalue) d
+        where kv._keyvalue_key = d._keyvalue_key'''),
+    ('GXD_HTRawSample', '''delete from GXD_HTRawSample rs
+        using (select distinct _rawsample_key from delete_rawsample) d
+        where rs._rawsample_key = d._rawsample_key'''),
+    ]
+
+#
+# Purpose: reads the keys of 'fpDelete'
+# Returns: dict of {kind: StringIO of keys, one a line}
+# Assumes: Nothing
+# Effects: reads 'fpDelete'
+# Throws: ValueError, KeyError if a line is not a kind and a key
+#
+
+def readKeys(fpDelete):
+
+    keyDict = {EXPERIMENT:io.StringIO(), RAWSAMPLE:io.StringIO(), KEYVALUE:io.StringIO()}
+    for line in fpDelete:
+        (kind, key) = str.split(line[:-1], TAB)
+        keyDict[kind].write('%s%s' % (key, CRT))
+    return keyDict
+
+#
+# Purpose: the sql creating the temporary table 'table'
+# Returns: str
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
+
+def createSql(table, column):
+
+    return '''create temporary table %s (%s int not null) on commit drop''' % (table, column)
+
+#
+# Purpose: deletes the keys in 'fpDelete'
+# Returns: list of (step, rows, seconds)
+# Assumes: 'cursor' is in a transaction, the caller commits
+# Effects: writes to the database
+# Throws: psycopg2.Error
+#
+
+def deleteKeys(cursor, fpDelete):
+
+    keyDict = readKeys(fpDelete)
+    stepList = []
+
+    for (kind, table, column) in TABLE_LIST:
+        cursor.execute(createSql(table, column))
+
+    for (kind, table, column) in TABLE_LIST:
+        keyDict[kind].seek(0)
+        cursor.copy_expert('copy %s from stdin' % table, keyDict[kind])
+
+    for (name, sql) in STEP_LIST:
+        startTime = time.time()
+        cursor.execute(sql)
+        if name is not None:
+            stepList.append((name, cursor.rowcount, time.time() - startTime))
+
+    return stepList
+
+#
+# Purpose: deletes the keys in 'fpDelete' with psql, for when psycopg2 is
+#       not installed
+# Returns: the psql exit status, 0 if the deletes were committed
+# Assumes: psql is on the PATH and can log in as MGD_DBUSER
+# Effects: writes a temporary script, writes to the database; psql
+#       writes the statements and their row counts to stdout
+# Throws: ValueError, KeyError if a line of 'fpDelete' is not a kind and a
+#       key; OSError if psql cannot be run
+#
+
+def deleteKeysPsql(fpDelete):
+
+    keyDict = readKeys(fpDelete)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.sql') as fpScript:
+        for (kind, table, column) in TABLE_LIST:
+            fpScript.write('%s;%s' % (createSql(table, column), CRT))
+        for (kind, table, column) in TABLE_LIST:
+            fpScript.write('copy %s from stdin;%s%s\\.%s' % (table, CRT, keyDict[kind].getvalue(), CRT))
+        for (name, sql) in STEP_LIST:
+            fpScript.write('%s;%s' % (sql, CRT))
+        fpScript.flush()
+
+        # -1: one transaction, ON_ERROR_STOP: a failed statement rolls it
+        # back and exits 3
+        sys.stdout.flush()
+        return subprocess.call(['psql', '-h%s' % os.environ['MGD_DBSERVER'],
+            '-d%s' % os.environ['MGD_DBNAME'], '-U%s' % os.environ['MGD_DBUSER'],
+            '-v', 'ON_ERROR_STOP=1', '-1', '-e', '-f', fpScript.name])
+
+#
+# main
+#
+
+if __name__ == '__main__':
+
+    deleteFileName = os.environ['DELETE_FILENAME']
+
+    if not os.path.exists(deleteFileName) or os.path.getsize(deleteFileName) == 0:
+        print('%s is empty, nothing to delete' % deleteFileName)
+        sys.exit(0)
+
+    startTime = time.time()
+
+    try:
+        import psycopg2
+    except ImportError:
+        print('psycopg2 is not installed, the sample delete runs through psql')
+        with open(deleteFileName, 'r') as fpDelete:
+            rc = deleteKeysPsql(fpDelete)
+        if rc != 0:
+            print('sample delete failed, rolled back: psql exit status %s' % rc)
+            sys.exit(1)
+        print('sample delete: %.2f seconds' % (time.time() - startTime))
+        sys.exit(0)
+
+    conn = pgCopy.connect()
+    try:
+        cursor = conn.cursor()
+        with open(deleteFileName, 'r') as fpDelete:
+            stepList = deleteKeys(cursor, fpDelete)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print('sample delete failed, rolled back: %s' % e)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    for (name, rows, seconds) in stepList:
+        print('%s: %s rows %.2f seconds' % (name, rows, seconds))
+    print('sample delete: %.2f seconds' % (time.time() - startTime))
+
+    sys.exit(0)
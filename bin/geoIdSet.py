@@ -0,0 +1,403 @@
+'''
+#
+# geoIdSet.py
+#
+# Compact set of GEO accession IDs (GSE, GSM) used by geo_htload.py for the
+# raw sample IDs of each experiment
+#
+# GEO IDs are a prefix and a number. A GeoIdSet keeps the numbers of its IDs
+# in a sorted array('I') of unique values, 4 bytes an ID, rather than a
+# Python string each. IDs that are not the prefix and a number that fits the
+# array (no leading zeros, up to 9 digits) are kept as strings in a small set.
+#
+# IDs are iterated in numeric order, then the other IDs in string order.
+# difference() and union() merge the two sorted arrays: runs of numbers only
+# in one array are found by bisection and runs common to both by comparing
+# array slices, so the work per element is done in C.
+#
+# Usage:
+#       geoIdSet.py --benchmark [--experiments N] [--samples N] [--changed F]
+#
+#       --benchmark    compares the memory and time of GeoIdSets with the
+#                      dict of lists of strings they replace, for N
+#                      experiments with up to N samples each, a fraction F
+#                      of them (default all) with one sample gained and one lost
+#
+'''
+import sys
+import time
+import array
+import bisect
+import random
+import argparse
+import operator
+import itertools
+import tracemalloc
+
+# type code of the ID arrays, 4 byte unsigned
+TYPECODE = 'I'
+
+# longest number kept in the array, 9 digits always fits 4 bytes
+MAX_DIGITS = 9
+MAX_NUMBER = 10 ** MAX_DIGITS - 1
+
+class GeoIdSet:
+    # Is: a set of GEO IDs with the same prefix
+    # Has: the prefix, the sorted unique numbers of the IDs, the other
+    #       IDs as strings (None if there are none)
+    # Does: add(), update(), len, iteration, in, ==, difference(), union()
+    #
+    __slots__ = ('prefix', 'ids', 'extra', 'sorted')
+
+    def __init__ (self, prefix, idList=()):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        self.prefix = prefix
+        self.ids = array.array(TYPECODE)
+        self.extra = None
+        self.sorted = True
+        if idList:
+            self.update(idList)
+
+    def add(self, accID):
+        # Purpose: adds an ID
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: the numbers are sorted when next needed
+        # Throws: nothing
+        # toNumber(), inline as this is called for every row of a lookup
+        digits = accID[len(self.prefix):]
+        if accID.startswith(self.prefix) and digits.isascii() \
+                and digits.isdigit() and digits[0] != '0' \
+                and len(digits) <= MAX_DIGITS:
+            number = int(digits)
+            ids = self.ids
+            if self.sorted and ids and number <= ids[-1]:
+                self.sorted = False
+            ids.append(number)
+        else:
+            if self.extra is None:
+                self.extra = set()
+            self.extra.add(accID)
+
+    def update(self, idList):
+        # Purpose: adds a list of IDs
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: the numbers are sorted when next needed
+        # Throws: nothing
+        idList = list(idList)
+        if not idList:
+            return
+
+        # the usual case, every ID is the prefix and a number that toNumber()
+        # accepts; checked for the whole list at once on the IDs joined by
+        # commas: one comma before each ID and each followed by the prefix,
+        # then with the prefixes removed only digits
+        joined = ',' + ','.join(idList)
+        marker = ',' + self.prefix
+        numberList = None
+        if joined.count(',') == len(idList) and joined.count(marker) == len(idList):
+            digits = joined.replace(marker, ',')[1:]
+        else:
+            digits = ''
+        if digits and digits.isascii() \
+                and digits.replace(',', '').isdigit() \
+                and ',,' not in digits and ',0' not in digits \
+                and not digits.startswith((',', '0')) and not digits.endswith(','):
+            numberList = list(map(int, digits.split(',')))
+            if max(numberList) > MAX_NUMBER:
+                numberList = None
+
+        if numberList is None:
+            numberList = []
+            for accID in idList:
+                number = self.toNumber(accID)
+                if number is None:
+                    if self.extra is None:
+                        self.extra = set()
+                    self.extra.add(accID)
+                else:
+                    numberList.append(number)
+
+        if not numberList:
+            return
+        if self.ids:
+            self.ids.extend(numberList)
+            self.sorted = False
+        else:
+            self.ids = array.array(TYPECODE, sorted(set(numberList)))
+
+    def toNumber(self, accID):
+        # Purpose: the number of 'accID'
+        # Returns: int, None if 'accID' is kept as a string
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        digits = accID[len(self.prefix):]
+        if accID.startswith(self.prefix) and digits.isascii() \
+                and digits.isdigit() and digits[0] != '0' \
+                and len(digits) <= MAX_DIGITS:
+            return int(digits)
+        return None
+
+    def sort(self):
+        # Purpose: sorts the numbers and removes duplicates
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        if not self.sorted:
+            self.ids = array.array(TYPECODE, sorted(set(self.ids)))
+            self.sorted = True
+
+    def __len__(self):
+        if not self.sorted:
+            self.sort()
+        if self.extra:
+            return len(self.ids) + len(self.extra)
+        return len(self.ids)
+
+    def __iter__(self):
+        self.sort()
+        prefix = self.prefix
+        for number in self.ids:
+            yield '%s%s' % (prefix, number)
+        if self.extra:
+            for accID in sorted(self.extra):
+                yield accID
+
+    def __contains__(self, accID):
+        number = self.toNumber(accID)
+        if number is None:
+            return self.extra is not None and accID in self.extra
+        self.sort()
+        i = bisect.bisect_left(self.ids, number)
+        return i < len(self.ids) and self.ids[i] == number
+
+    def __eq__(self, other):
+        self.sort()
+        other.sort()
+        return self.prefix == other.prefix and self.ids == other.ids \
+            and (self.extra or set()) == (other.extra or set())
+
+    def new(self, ids, extra):
+        # Purpose: a set with this set's prefix
+        # Returns: GeoIdSet
+        # Assumes: 'ids' are sorted and unique
+        # Effects: nothing
+        # Throws: nothing
+        result = GeoIdSet.__new__(GeoIdSet)
+        result.prefix = self.prefix
+        result.ids = ids
+        result.extra = extra or None
+        result.sorted = True
+        return result
+
+    def difference(self, other):
+        # Purpose: the IDs of this set that are not in 'other'
+        # Returns: GeoIdSet
+        # Assumes: 'other' has the same prefix
+        # Effects: nothing
+        # Throws: nothing
+        self.sort()
+        other.sort()
+        a = self.ids
+        b = other.ids
+        extra = self.extra
+        if extra and other.extra:
+            extra = extra - other.extra
+        elif extra:
+            extra = set(extra)
+        if a == b:
+            return self.new(array.array(TYPECODE), extra)
+        ids = array.array(TYPECODE)
+        i = j = 0
+        while i < len(a) and j < len(b):
+            if a[i] < b[j]:
+                # a run only in this set
+                k = bisect.bisect_left(a, b[j], i)
+                ids.extend(a[i:k])
+                i = k
+            elif a[i] > b[j]:
+                j = bisect.bisect_left(b, a[i], j)
+            else:
+                n = commonRun(a, i, b, j)
+                i += n
+                j += n
+        ids.extend(a[i:])
+        return self.new(ids, extra)
+
+    def union(self, other):
+        # Purpose: the IDs in this set or in 'other'
+        # Returns: GeoIdSet
+        # Assumes: 'other' has the same prefix
+        # Effects: nothing
+        # Throws: nothing
+        self.sort()
+        other.sort()
+        a = self.ids
+        b = other.ids
+        ids = array.array(TYPECODE)
+        i = j = 0
+        while i < len(a) and j < len(b):
+            if a[i] < b[j]:
+                k = bisect.bisect_left(a, b[j], i)
+                ids.extend(a[i:k])
+                i = k
+            elif a[i] > b[j]:
+                k = bisect.bisect_left(b, a[i], j)
+                ids.extend(b[j:k])
+                j = k
+            else:
+                n = commonRun(a, i, b, j)
+                ids.extend(a[i:i + n])
+                i += n
+                j += n
+        ids.extend(a[i:])
+        ids.extend(b[j:])
+        extra = None
+        if self.extra or other.extra:
+            extra = (self.extra or set()) | (other.extra or set())
+        return self.new(ids, extra)
+
+# end class GeoIdSet -----------------------------------------
+
+#
+# Purpose: the length of the run of equal numbers at a[i] and b[j]
+# Returns: n > 0, a[i:i + n] == b[j:j + n] and the next numbers differ
+# Assumes: a and b are sorted unique arrays, a[i] == b[j]
+# Effects: nothing
+# Throws: nothing
+#
+
+def commonRun(a, i, b, j):
+
+    # double the run while the slices are equal, then bisect the last
+    # doubling; equal slices of length n imply equal slices of any shorter
+    # length, the arrays are compared in C
+    limit = min(len(a) - i, len(b) - j)
+
+    # the usual case, the rest of the shorter array
+    if a[i:i + limit] == b[j:j + limit]:
+        return limit
+
+    low = 1
+    high = 2
+    while high <= limit and a[i:i + high] == b[j:j + high]:
+        low = high
+        high *= 2
+    high = min(high, limit + 1)
+    # a[i:i + low] == b[j:j + low], a[i:i + high] != b[j:j + high]
+    while high - low > 1:
+        middle = (low + high) // 2
+        if a[i:i + middle] == b[j:j + middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+#
+# Purpose: compares GeoIdSets with a dict of lists of strings, building
+#       each from the same rows and computing the gain/loss of each
+#       experiment against an input with some samples changed
+# Returns: nothing
+# Assumes: nothing
+# Effects: prints memory and time of each
+# Throws: nothing
+#
+
+def benchmark(experiments, samples, changed):
+
+    random.seed(1)
+    rowList = []
+    inputDict = {}
+    for e in range(experiments):
+        exptID = 'GSE%s' % (100000 + e)
+        first = random.randint(1, 8000000)
+        count = random.randint(1, samples)
+        for s in range(count):
+            rowList.append((exptID, first + s))
+        # a changed input drops one sample and gains one
+        if random.random() < changed:
+            inputDict[exptID] = [first + s for s in range(1, count + 1)]
+        else:
+            inputDict[exptID] = [first + s for s in range(count)]
+
+    for kind in ('dict of lists', 'GeoIdSet'):
+
+        # the sample IDs are made as the rows are read, as they are when
+        # they come from the database ordered by experiment, and each
+        # GeoIdSet is built from the rows of its experiment as geo_htload.py
+        # builds them; the memory is measured in a second pass as tracemalloc
+        # slows the load down
+        for measure in (0, 1):
+            if measure:
+                tracemalloc.start()
+            startTime = time.time()
+            lookupDict = {}
+            if kind == 'GeoIdSet':
+                for (exptID, rows) in itertools.groupby(rowList, operator.itemgetter(0)):
+                    lookupDict[exptID] = GeoIdSet('GSM', ['GSM%s' % number for (e, number) in rows])
+            else:
+                for (exptID, number) in rowList:
+                    accID = 'GSM%s' % number
+                    if exptID not in lookupDict:
+                        lookupDict[exptID] = []
+                    lookupDict[exptID].append(accID)
+            if measure:
+                size = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+            else:
+                loadTime = time.time() - startTime
+
+        # the input sample IDs of an experiment are in its parsed samples
+        startTime = time.time()
+        inputSetDict = {}
+        for exptID in lookupDict:
+            inputSet = ['GSM%s' % number for number in inputDict[exptID]]
+            if kind == 'GeoIdSet':
+                inputSet = GeoIdSet('GSM', inputSet)
+            inputSetDict[exptID] = inputSet
+        inputTime = time.time() - startTime
+
+        startTime = time.time()
+        gained = lost = 0
+        for exptID in lookupDict:
+            if kind == 'GeoIdSet':
+                inputSet = inputSetDict[exptID]
+                dbSet = lookupDict[exptID]
+            else:
+                inputSet = set(inputSetDict[exptID])
+                dbSet = set(lookupDict[exptID])
+            gained += len(inputSet.difference(dbSet))
+            lost += len(dbSet.difference(inputSet))
+        diffTime = time.time() - startTime
+
+        print('%s: %s experiments %s samples, %.1f MB, load %.2f seconds, input %.2f seconds, gain/loss %.2f seconds (%s gained, %s lost)' % \
+            (kind, experiments, len(rowList), size / 1024.0 / 1024.0, loadTime, inputTime, diffTime, gained, lost))
+
+#
+# main
+#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='compact sets of GEO IDs')
+    parser.add_argument('--benchmark', action='store_true',
+        help='compare memory and time with a dict of lists of strings')
+    parser.add_argument('--experiments', type=int, default=50000,
+        help='number of experiments in the benchmark')
+    parser.add_argument('--samples', type=int, default=100,
+        help='maximum samples per experiment in the benchmark')
+    parser.add_argument('--changed', type=float, default=1.0,
+        help='fraction of experiments whose samples changed in the benchmark')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.experiments, args.samples, args.changed)
+
+    sys.exit(0)
@@ -5,7 +5,15 @@
 #	See http://mgiwiki/mediawiki/index.php/sw:Gxdhtload
 #
 # Usage:
-#       geo_htload.py
+#       geo_htload.py [--jobs N] [--full]
+#
+#       --jobs N  parse the esummary batch files (EXP_FILES) with N worker
+#                 processes. Default is PARSE_JOBS from the config, or 1.
+#                 Sample files larger than SPLIT_SAMPLE_FILE_MB are split
+#                 and parsed by all N
+#       --full    ignore the experiment fingerprints of the last load and
+#                 process every experiment, reloading the samples of every
+#                 experiment in the database
 #
 # History:
 #
@@ -19,20 +27,55 @@
 #       - created WTS2-431
 #
 '''
+import io
 import os
 import sys
 import types
 import re
+import time
+import resource
+import argparse
+import collections
+import itertools
+import operator
+import hashlib
+import mmap
+import multiprocessing
 import Set
 import db
 import loadlib
 import accessionlib
+import sampleCache
+import sampleFile
+import geoIdSet
+import bcpWriter
+import textNormalize
+import pgCopy
 import xml.etree.ElementTree as ET
 from datetime import date
 
 TAB = '\t'
 CRT = '\n'
 
+def getArgs():
+
+    parser = argparse.ArgumentParser( \
+        description='Load GEO HT experiments and raw samples')
+
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int,
+        required=False, default=int(os.getenv('PARSE_JOBS', '1')),
+        help='number of processes used to parse the experiment files. Default is PARSE_JOBS or 1')
+
+    parser.add_argument('--full', dest='full', action='store_true',
+        required=False, help='ignore the experiment fingerprints of the last load, process all experiments and reload all samples')
+
+    return parser.parse_args()
+
+args = getArgs()
+
+# the pool of parse workers when args.jobs > 1, see initialize()
+pool = None
+
 # default experiment confidence value
 confidence = 0.0
 
@@ -111,6 +154,10 @@ rawSampleMgiTypeKey = 47
 geoDownloads = os.environ['GEO_DOWNLOADS']
 sampleFileSuffix = os.environ['GEO_SAMPLE_FILE_SUFFIX']
 
+# with --jobs > 1, sample files larger than this are split at their samples
+# and the parts parsed by the worker pool, 0 never splits
+splitSampleBytes = int(float(os.getenv('SPLIT_SAMPLE_FILE_MB', '0')) * 1048576)
+
 # QC file and descriptor
 today = date.today()
 suffix  = '%s.rpt' % today.strftime("%b-%d-%Y")
@@ -135,6 +182,29 @@ fpSampInDbParsingFile = None
 # run parsing reports true/false
 runParsingReports = os.environ['RUN_PARSING_RPTS']
 
+# cache of parsed sample files, not used if SAMPLE_CACHE_DIR is empty
+sampleCacheDir = os.getenv('SAMPLE_CACHE_DIR', '')
+sampleCacheMaxBytes = int(os.getenv('SAMPLE_CACHE_MAX_MB', '2048')) * 1048576
+sampleCacheHash = os.getenv('SAMPLE_CACHE_HASH', 'false')
+
+# bump this whenever the output of parseSampleFile changes
+sampleCacheVersion = 3
+sampleFileCache = None
+
+# sample file elements whose text is read, at their end event: at the start
+# event the text is only there if the parser has already read past the end
+# tag, which depends on where its read buffer ends
+sampleTextTagSet = set(['{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}%s' % tag
+    for tag in ('Description', 'Title', 'Type', 'Source', 'Organism',
+        'Treatment-Protocol', 'Molecule')])
+
+# experiment fingerprints from the last successful load, an experiment
+# in the database whose fingerprint has not changed is skipped.
+# The fingerprints of this run are written to <EXPT_STATE_FILE>.new which
+# geo_htload.sh moves to EXPT_STATE_FILE once the load has succeeded
+exptStateFileName = os.getenv('EXPT_STATE_FILE', '')
+fpExptStateFile = None
+
 #
 # For bcp 
 #
@@ -160,11 +230,42 @@ propertyFileName = os.environ['PROPERTY_FILENAME']
 fpPropertyBcp = None
 
 #
-# sql file for deleting samples
+# bcp: write the bcp files, loaded by geo_htload.sh with bcpin.csh
+# copy: load the tables with COPY as they are written, see pgCopy.py;
+#       the bcp files are still written if COPY_TEE_BCP is 'true'
+#
+loadBackend = os.getenv('LOAD_BACKEND', 'bcp')
+copyTeeBcp = os.getenv('COPY_TEE_BCP', 'true')
+copyLoader = None
+
+#
+# file of the samples to delete, see deleteSamples.py
 #
 deleteFileName = os.environ['DELETE_FILENAME']
 fpSampleDelete = None
-deleteTemplate = '''delete from GXD_HTRawSample where _experiment_key = %s;\n'''
+deleteTemplate = 'experiment\t%s\n'
+rawSampleDeleteTemplate = 'rawsample\t%s\n'
+keyValueDeleteTemplate = 'keyvalue\t%s\n'
+
+#
+# differential sample reload for experiments in the database
+# if 'true' only the raw samples and key/values that differ from the
+# database are deleted and inserted, unchanged rows keep their keys.
+# The experiments are compared against the database in batches
+#
+diffSampleReload = os.getenv('DIFF_SAMPLE_RELOAD', 'false')
+diffBatchSize = 500
+
+# if 'true' the samples of experiments with > maxSamples samples are
+# streamed from the sample file to the bcp files instead of being skipped
+streamSamples = os.getenv('STREAM_SAMPLES', 'false')
+
+# bcp (postgres copy text format) escape sequences
+copyEscapeDict = {'b':'\b', 'f':'\f', 'n':'\n', 'r':'\r', 't':'\t', 'v':'\v'}
+
+# experiments waiting to be compared with the database
+# [(expID, exptKey, [(sampleID, [(key, value, seqNum), ...]), ...]), ...]
+sampleDiffList = []
 
 #
 # for MGI_Property
@@ -188,6 +289,13 @@ exptLoadedCount = 0
 # Number of samples loaded
 sampleLoadedCount = 0
 
+# differential sample reload counts
+diffSampleDeletedCount = 0
+diffSampleChangedCount = 0
+diffSampleKeptCount = 0
+diffKeyValueAddedCount = 0
+diffKeyValueDeletedCount = 0
+
 # Experiments in the db whose pubmed IDs were updated
 updateExptList = []
 
@@ -196,15 +304,31 @@ updateExptList = []
 #
 
 # experiments with curated samples
-# {exptID:[raw sample ids], ...}
+# {exptID:GeoIdSet of raw sample ids, ...}
 curatedExptDict = {}
 
+# all experiments, an empty GeoIdSet if the experiment has no raw samples
+# {exptID:GeoIdSet of raw sample ids, ...}
 nonCuratedExptDict = {}
 
-# GEO IDs in the database
+# GEO IDs in the database, limited to the GEO IDs in the input as are
+# the other experiment lookups, see scanInputIds()
 # {exptID:key, ...}
 geoExptInDbDict = {}
 
+# number of GEO IDs in the whole database, for the QC report
+geoExptInDbCount = 0
+
+# GEO IDs inserted into input_geo per statement when the lookups run
+# through db.sql, see createInputGeo()
+INPUT_GEO_BATCH = 1000
+
+# rows fetched per round trip by the experiment lookups, see streamLookup()
+lookupFetchSize = int(os.getenv('LOOKUP_FETCH_SIZE', '10000'))
+
+# GEO experiment ID in the esummary files
+inputIdRe = re.compile(rb'<Accession>(GSE[0-9]+)</Accession>')
+
 # raw experiment types mapped to controlled vocabulary keys
 exptTypeTransDict = {}
 
@@ -212,9 +336,18 @@ exptTypeTransDict = {}
 # {GEO ID: [pubmedId1, ..., pubmedIdn], ...}
 pubMedByExptDict = {}
 
+# highest pubmed property sequenceNum by experiment in the db,
+# see nextPubMedSeqNum()
+# {GEO ID: sequenceNum, ...}
+pubMedMaxSeqByExptDict = {}
+
 # experiment IDs in the input found to be in the database
 expIdsInDbSet = set()
 
+# fingerprints from the last successful load
+# {exptID:fingerprint, ...}
+exptStateDict = {}
+
 #
 # data structures for load QC reporting
 #
@@ -228,12 +361,23 @@ expSkippedNotInDbNoTransSet = set()
 # experiments, new and existin, that have > maxSamples
 expMaxSamplesSet = set()
 
+# experiments, new and existing, that have > maxSamples whose samples
+# were streamed, see processSampleStream()
+expStreamedSet = set()
+
 # experiments skipped because of sample parsing issues
 expSkippedNoSampleList = []
 
 # experiments loaded with no samples because no sample file
 expLoadedNoSampleList = []
 
+# experiments in the database skipped because unchanged since the last load
+expUnchangedCount = 0
+
+# experiments in the database whose samples were not reloaded because
+# the esummary sample IDs match the raw samples in the database
+expSamplesUnchangedCount = 0
+
 # {exptID:[sampleId1, ...sampleIdn], ...}
 duplicatedSampleIdDict = {}
 
@@ -247,7 +391,7 @@ ncSampleGainLossList = [] # not curated
 # This for debugging the difference in # sampled deleted vs reloaded
 # number of samples lost
 lostCt = 0
-lostSampleDict = {} # {exptID:(set of sampleIDs), ...}
+lostSampleDict = {} # {exptID:GeoIdSet of sampleIDs, ...}
 
 # number of samples gained
 gainedCt = 0
@@ -257,6 +401,363 @@ gainedSampleDict = {}
 # to the experiment summary for the full experiment description
 overallDesign = ''
 
+class Experiment:
+    # Is: data object that represents one DocumentSummary from an esummary
+    #       experiment file
+    # Has: the experiment attributes we use, no database keys; keys are
+    #       assigned when the experiment is processed
+    # Does: provides direct access to its attributes
+    #
+    def __init__ (self):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        self.expID = ''
+        self.title = ''
+        self.summary = ''
+        self.pdat = ''
+        self.gdsType = ''
+        self.n_samples = '' # used to test for max samples, not stored
+        self.isSuperSeries = 'no'   # flag to indicate expt is superseries, skip
+        self.pubmedList = []
+        self.sampleList = [] # list of sampleIDs
+
+        # AsyncResult of parseSampleFile when the sample file is parsed
+        # by the worker pool
+        self.sampleResult = None
+
+        # True if the experiment has more than maxSamples samples, None
+        # until isOversized() is called
+        self.oversized = None
+
+    def fingerprint(self):
+        # Purpose: digest of the esummary attributes we load
+        # Returns: sha1 hex string of title, summary, PDAT, gdsType,
+        #       pubmed IDs and sample IDs
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        fields = [self.title, self.summary, self.pdat, self.gdsType, \
+            ','.join(self.pubmedList), ','.join(self.sampleList)]
+        return hashlib.sha1('\x1f'.join(map(str, fields)).encode()).hexdigest()
+
+# end class Experiment -----------------------------------------
+
+class Sample:
+    # Is: data object that represents one Sample from a GEO family.xml
+    #       sample file
+    # Has: the sample attributes we load; the channels are a tuple of 1 or
+    #       2 channels, each a tuple of (key, value) in the order parsed
+    # Does: provides direct access to its attributes
+    #
+    __slots__ = ('expID', 'sampleID', 'description', 'title', 'sType', 'channelList')
+
+    def __init__ (self, expID, sampleID, description, title, sType, channelList):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        self.expID = expID
+        self.sampleID = sampleID
+        self.description = description
+        self.title = title
+        self.sType = sType
+        self.channelList = channelList
+
+    def __repr__(self):
+        return repr(self.reportString())
+
+    def reportString(self):
+        # Purpose: the sample as written to the sample parsing reports
+        # Returns: expID, sampleID, description, title, sType and the
+        #       channels, TAB delimited, see processChannels()
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        return '%s%s%s%s%s%s%s%s%s%s%s' % (self.expID, TAB, self.sampleID, TAB, self.description, TAB, self.title, TAB, self.sType, TAB, processChannels(self.channelList))
+
+# end class Sample -----------------------------------------
+
+class SampleFileReader:
+    # Is: a parse of one GEO family.xml sample file that reads the samples
+    #       one at a time
+    # Has: the experiment ID, the sample file path; once the samples have
+    #       been read, the overall design and the duplicated sample IDs
+    # Does: iteration, the Samples in file order. Each sample is released
+    #       from the parse tree once it has been read, so memory does not
+    #       grow with the number of samples (except for their IDs)
+    #
+    def __init__ (self, expID, text=None):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: the sample file exists, if 'text' is given it is parsed
+        #       instead of the file, see parseSampleRange()
+        # Effects: nothing
+        # Throws: nothing
+        self.expID = expID
+        self.samplePath = sampleFile.findSampleFile('%s/%s%s' % (geoDownloads, expID, sampleFileSuffix))
+        self.text = text
+        self.overallDesign = ''
+        self.dupIdList = []   # sample IDs seen more than once
+
+    def __iter__(self):
+        # Purpose: parses the sample file
+        # Returns: generator of Sample
+        # Assumes: nothing, may be run in a worker process
+        # Effects: reads the file system, sets overallDesign and dupIdList
+        # Throws: ET.ParseError
+
+        # save the sample IDs for this experiment so we can check for dups
+        idSet = set()
+
+        if self.text is None:
+            f = sampleFile.openSampleText(self.samplePath)
+        else:
+            f = io.StringIO(self.text)
+        context = ET.iterparse(f, events=("start","end"))
+        context = iter(context)
+
+        expID = self.expID
+        level = 0
+        root = None
+        sampleID = ''
+        description = ''
+        title = ''
+        sType = ''
+        molecule = ''
+        taxid = ''
+        taxidValue = ''
+        treatmentProt = ''
+        overallDesign = ''
+
+        # dictionary of key/values for the Channel section
+        channelDict = {}
+
+        # There can be 1 or 2 channels (not yet sure if there can be zero
+        # first dict in list is channel 1, second is channel 2 (if there is one)
+        channelList = []
+
+        # Channel, there can be 1 or 2, need for sequence of sets of 
+        # source/taxid/treatment/molecule
+        cCount = 0 
+
+        #
+        # Parse the sample file
+        #
+        for event, elem in context:
+            if event == 'start':
+                level += 1
+                if level == 1:
+                    root = elem
+            if event == 'end':
+                level -= 1
+
+            # the text elements are handled at their end event, at their
+            # own level
+            tagLevel = level
+            if elem.tag in sampleTextTagSet:
+                if event == 'start':
+                    continue
+                tagLevel = level + 1
+
+            #
+            # we are done processing a sample, print and reset
+            #
+            if event == 'end' and elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Sample':
+                # if the dict is not empty, add it to the list
+                if channelDict:
+                    channelList.append(channelDict)
+
+                yield Sample(expID, sampleID, description, title, sType, \
+                    tuple([tuple(channel.items()) for channel in channelList]))
+
+                #
+                # reset all attributes
+                #
+                sampleID = ''
+                description =  ''
+                title = ''
+                sType = ''
+                molecule = ''
+                taxid = ''
+                taxidValue = ''
+                treatmentProt = ''
+                overallDesign = ''
+                channelDict = {}
+                channelList = []
+
+                # the sample has been read, release it and anything before it
+                root.clear()
+
+            #
+            # Tag Level 2
+            #
+            if tagLevel == 2:
+                if DEBUG == 'true':
+                    print('processSample tag level 2')
+                if elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Sample':
+                    sampleID = str.strip(elem.get('iid'))
+                    if sampleID in idSet:
+                        self.dupIdList.append(sampleID)
+                        continue
+                    idSet.add(sampleID)
+                elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Overall-Design':
+                    if overallDesign == None:
+                        overallDesign = ''
+                    else:
+                        #overallDesign = ((str.strip(elem.text)).replace(TAB, ' ')).replace(CRT, ' ')
+                        overallDesign = elem.text
+                        overallDesign = textNormalize.removeNonAscii(overallDesign)
+
+
+            #
+            # Tag Level 3
+            #
+
+            if tagLevel == 3:
+                if DEBUG == 'true':
+                    print('processSample tag level 3')
+                if elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Description':
+                    description = elem.text
+                    if description == None:
+                        description = ''
+                    else:
+                        description = description.replace('\\', '')
+                        description =  textNormalize.removeNonAscii(description)
+
+                elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Title':
+                    title = elem.text
+                    if title == None:
+                        title = ''
+                    else:
+                        title = textNormalize.removeNonAscii(title)
+                    
+                elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Type':
+                    sType = elem.text
+                    if sType == None:
+                        sType = ''
+                    else:
+                        sType = textNormalize.flatten(sType)
+                elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Channel':
+                    cCount = int(elem.get('position'))
+                    # if we have a second channel, append the first to the 
+                    # List and reset the dict
+                    if cCount == 2:
+                        channelList.append(channelDict)
+                        channelDict = {}
+
+                elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Characteristics':
+                    tag = elem.get('tag')
+                    if tag == None: # not an attrib just get the text
+                        tag = 'Characteristics' # name it
+
+                    # strip and replace internal tabs and crt's
+                    tag = textNormalize.flatten(tag)
+                    value = textNormalize.flatten(elem.text)
+                
+                    #    (expID, sampleID, tag, value))
+                    if value is not None and value != '':
+                        channelDict[tag] = value
+
+
+            #
+            # Tag Level 4
+            #
+
+            if tagLevel == 4:
+                if DEBUG == 'true':
+                    print('processSample tag level 4')
+                if elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Source':
+                    source = elem.text
+                    if source is not None and source != '':
+                        channelDict['source'] = str.strip(source)
+                elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Organism':
+                    taxid = elem.get('taxid')
+                    if taxid is not None and taxid != '':
+                        channelDict['taxid'] = str.strip(taxid)
+                    taxidValue = elem.text
+                    if taxidValue is not None and taxidValue != '':
+                        channelDict['taxidValue'] = str.strip(taxidValue)
+
+                elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Treatment-Protocol':
+                    treatmentProt = elem.text
+                
+                    if treatmentProt is not None and treatmentProt != '':
+                        treatmentProt = textNormalize.flatten(treatmentProt)
+                        if DEBUG == 'true':
+                            print('adding to channelDict expID: %s sampleID: %s treatmentProt: %s' % (expID, sampleID, treatmentProt))
+                        channelDict['treatmentProt'] = treatmentProt
+                elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Molecule':
+                    molecule = elem.text
+                    if molecule is not None and molecule != '':
+                            channelDict['molecule'] = str.strip(molecule)
+
+        f.close()
+
+        self.overallDesign = overallDesign
+
+# end class SampleFileReader -----------------------------------------
+
+class SplitSampleResult:
+    # Is: the parse of one sample file split across the worker pool, see
+    #       startSampleParse()
+    # Has: the AsyncResult of each part of the file in file order, the
+    #       sample cache entry of the file
+    # Does: ready(), get(); used as the AsyncResult of loadSampleFile
+    #
+    def __init__ (self, resultList, entry):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        self.resultList = resultList
+        self.entry = entry
+
+    def ready(self):
+        # Purpose: determines if every part has been parsed
+        # Returns: True if get() will not wait
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        for result in self.resultList:
+            if not result.ready():
+                return False
+        return True
+
+    def get(self):
+        # Purpose: merges the parsed parts in file order
+        # Returns: tuple (parseSampleFile result, 0) as loadSampleFile
+        # Assumes: nothing
+        # Effects: waits for the parts, adds the result to the sample cache
+        # Throws: the exceptions of the parts
+        sampleRecordList = []
+        overallDesign = ''
+        for result in self.resultList:
+            (partList, overallDesign) = result.get()
+            sampleRecordList += partList
+
+        # the duplicates are found across the parts, as parseSampleFile
+        # does; the overall design is the last part's
+        idSet = set()
+        dupIdList = []
+        for sample in sampleRecordList:
+            if sample.sampleID in idSet:
+                dupIdList.append(sample.sampleID)
+            else:
+                idSet.add(sample.sampleID)
+
+        result = (0, sampleRecordList, overallDesign, dupIdList)
+        if sampleFileCache:
+            sampleFileCache.put(self.entry, result)
+
+        return (result, 0)
+
+# end class SplitSampleResult -----------------------------------------
+
 #
 # Purpose:  Open file descriptors, get next primary keys, create lookups
 # Returns: 1 if file does not exist or is not readable, else 0
@@ -269,9 +770,11 @@ def initialize():
     global fpExperimentBcp, fpSampleBcp, fpKeyValueBcp, fpSampleDelete
     global fpAccBcp, fpVariableBcp, fpPropertyBcp, nextExptKey
     global nextAccKey, nextExptVarKey, nextPropKey, geoExptInDbDict
+    global geoExptInDbCount
     global pubMedByExptDict, nextRawSampleKey, nextKeyValueKey 
     global curatedExptDict, nonCuratedExptDict
-    global fpCuratedQcFile
+    global fpCuratedQcFile, sampleFileCache, fpExptStateFile, copyLoader
+    global pool
 
     # create file descriptors
     try:
@@ -301,40 +804,57 @@ def initialize():
         except:
              print('Cannot create %s' % sampParsingFileName)
 
-    try:
-        fpExperimentBcp = open('%s/%s' % (outputDir, experimentFileName), 'w')
-    except:
-        print('Cannot create %s' % (eFile))
+    # LOAD_BACKEND=copy: the tables are opened at the end, see below
+    if loadBackend != 'copy':
+        try:
+            fpExperimentBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, experimentFileName), 'w'), 'GXD_HTExperiment', userKey, loadDate)
+        except:
+            print('Cannot create %s' % (eFile))
 
-    try:
-        fpAccBcp = open('%s/%s' % (outputDir, accFileName), 'w')
-    except:
-        print('Cannot create %s' % accFileName)
+        try:
+            fpAccBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, accFileName), 'w'), 'ACC_Accession', userKey, loadDate)
+        except:
+            print('Cannot create %s' % accFileName)
 
-    try:
-        fpVariableBcp = open('%s/%s' % (outputDir, variableFileName), 'w')
-    except:
-        print('Cannot create %s' % variableFileName) 
+        try:
+            fpVariableBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, variableFileName), 'w'), 'GXD_HTExperimentVariable', userKey, loadDate)
+        except:
+            print('Cannot create %s' % variableFileName) 
 
-    try:
-        fpPropertyBcp = open('%s/%s' % (outputDir, propertyFileName), 'w')
-    except:
-        print('Cannot create %s' % propertyFileName)
+        try:
+            fpPropertyBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, propertyFileName), 'w'), 'MGI_Property', userKey, loadDate)
+        except:
+            print('Cannot create %s' % propertyFileName)
 
-    try:
-        fpSampleBcp = open('%s/%s' % (outputDir, sampleFileName), 'w')
-    except:
-        print('Cannot create %s' % sampleFileName)
+        try:
+            fpSampleBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, sampleFileName), 'w'), 'GXD_HTRawSample', userKey, loadDate)
+        except:
+            print('Cannot create %s' % sampleFileName)
 
-    try:
-        fpKeyValueBcp = open('%s/%s' % (outputDir, keyValueFileName), 'w')
-    except:
-        print('Cannot create %s' % keyValueFileName)
+        try:
+            fpKeyValueBcp = bcpWriter.BcpWriter(open('%s/%s' % (outputDir, keyValueFileName), 'w'), 'MGI_KeyValue', userKey, loadDate)
+        except:
+            print('Cannot create %s' % keyValueFileName)
 
-    try:
-        fpSampleDelete = open('%s' % (deleteFileName), 'w')
-    except:
-        print('Cannot create %s' % deleteFileName)
+        try:
+            fpSampleDelete = open('%s' % (deleteFileName), 'w')
+        except:
+            print('Cannot create %s' % deleteFileName)
+
+    if sampleCacheDir != '':
+        sampleFileCache = sampleCache.SampleCache(sampleCacheDir, \
+            sampleCacheMaxBytes, sampleCacheHash == 'true', sampleCacheVersion)
+
+    if exptStateFileName != '':
+        if not args.full and os.path.exists(exptStateFileName):
+            for line in open(exptStateFileName, 'r'):
+                (exptID, fingerprint) = str.split(line[:-1], TAB)
+                exptStateDict[exptID] = fingerprint
+        os.makedirs(os.path.dirname(exptStateFileName), exist_ok=True)
+        try:
+            fpExptStateFile = open('%s.new' % exptStateFileName, 'w')
+        except:
+            print('Cannot create %s.new' % exptStateFileName)
 
     db.useOneConnection(1)
 
@@ -362,114 +882,282 @@ def initialize():
     results = db.sql(''' select nextval('mgi_property_seq') as maxKey ''', 'auto')
     nextPropKey  = results[0]['maxKey']
 
-    # Create experiment ID lookup - we are looking at preferred = 0 or 1 
-    # because GEO ids can be either
-    db.sql('''select accid, _Object_key as _experiment_key
-        into temporary table geo
-        from ACC_Accession
-        where _MGIType_key = 42 -- GXD HT Experiment
-        and _LogicalDB_key = 190 -- GEO Series''', None)
-    results = db.sql('''select * from  geo''', 'auto')
-
-    for r in results:
-        geoExptInDbDict[r['accid']] = r['_experiment_key']
-
     # Create experiment type translation lookup
     results = db.sql('''select badname, _Object_key from MGI_Translation where _TranslationType_key = 1020''', 'auto')
     for r in results:
         exptTypeTransDict[r['badname']] = r['_Object_key']
 
+    # GEO experiments in the whole database, the lookups below only have
+    # the ones in the input
+    results = db.sql('''select count(distinct accid) as geoCount
+        from ACC_Accession
+        where _MGIType_key = 42 -- GXD HT Experiment
+        and _LogicalDB_key = 190 -- GEO Series''', 'auto')
+    geoExptInDbCount = results[0]['geoCount']
+
+    # the experiment lookups are limited to the GEO IDs in this run's
+    # input, copied into the temp table input_geo
+    inputIdList = scanInputIds(str.split(os.environ['EXP_FILES']))
+    print('GEO IDs in the input: %s' % len(inputIdList))
+
+    # the lookups stream through server-side cursors on a psycopg2
+    # connection; without psycopg2 (the bcp backend does not need it) they
+    # run through db.sql, on its one connection for the temp tables
+    try:
+        conn = pgCopy.connect()
+    except ImportError:
+        print('psycopg2 is not installed, the experiment lookups run through db.sql')
+        conn = None
+    except Exception as e:
+        print('Cannot connect for the experiment lookups: %s' % e)
+        return 1
+
+    createInputGeo(conn, inputIdList)
+
+    # Create experiment ID lookup - we are looking at preferred = 0 or 1 
+    # because GEO ids can be either
+    for (accid, exptKey) in streamLookup(conn, 'geo', '''select a.accid, a._Object_key as _experiment_key
+        from ACC_Accession a, input_geo i
+        where a.accid = i.accid
+        and a._MGIType_key = 42 -- GXD HT Experiment
+        and a._LogicalDB_key = 190 -- GEO Series''', ['accid', '_experiment_key']):
+        geoExptInDbDict[accid] = exptKey
+
     # create the pubmed ID property lookup by experiment
     # This will be used in YAK-119 which includes updating pubmed ids
-    results = db.sql('''select a.accid, p.value
-        from GXD_HTExperiment e, ACC_Accession a, MGI_Property p
-        where e._Experiment_key = a._Object_key
-        and a._MGIType_key = %s
-        and a._LogicalDB_key = %s
-        and a.preferred = 1
-        and e._Experiment_key = p._Object_key
-        and p._PropertyTerm_key = %s
-        and p._PropertyType_key = %s
-        union all
-        select a.accid, p.value
-        from GXD_HTExperiment e, ACC_Accession a, MGI_Property p
+    for (accid, value, sequenceNum) in streamLookup(conn, 'pubmed', '''select a.accid, p.value, p.sequencenum
+        from GXD_HTExperiment e, ACC_Accession a, input_geo i, MGI_Property p
         where e._Experiment_key = a._Object_key
+        and a.accid = i.accid
         and a._MGIType_key = %s
         and a._LogicalDB_key = %s
-        and a.preferred = 0
         and e._Experiment_key = p._Object_key
         and p._PropertyTerm_key = %s
         and p._PropertyType_key = %s''' % \
-            (exptMgiTypeKey, geoLdbKey, pubmedPropKey, propTypeKey, exptMgiTypeKey, geoLdbKey, pubmedPropKey, propTypeKey), 'auto')
-
-    for r in results:
-        accid = r['accid'] 
-        value = r['value']
+            (exptMgiTypeKey, geoLdbKey, pubmedPropKey, propTypeKey), \
+            ['accid', 'value', 'sequencenum']):
         if accid not in pubMedByExptDict:
             pubMedByExptDict[accid] = []
         pubMedByExptDict[accid].append(value)
+        if sequenceNum is not None and \
+                sequenceNum > pubMedMaxSeqByExptDict.get(accid, 0):
+            pubMedMaxSeqByExptDict[accid] = sequenceNum
 
     # get curated experiments
-    db.sql('''select distinct a.accid as exptID, a._object_key as _experiment_key
+    lookupExecute(conn, '''select distinct a.accid as exptID, a._object_key as _experiment_key
         into temporary table curated
-        from acc_accession a, gxd_htsample s
+        from acc_accession a, input_geo i, gxd_htsample s
                 where a._MGIType_key = 42 -- GXD HT Experiment
                 and a._LogicalDB_key = 190 -- GEO Series
-        and a._object_key = s. _experiment_key''', None)
+        and a.accid = i.accid
+        and a._object_key = s. _experiment_key''')
 
-    db.sql('''create index idx_curated on curated(_experiment_key)''')
+    lookupExecute(conn, '''create index idx_curated on curated(_experiment_key)''')
 
     # bring in the raw samples
-    results = db.sql('''select c.*, rs.accid as rsID
+    # ordered by experiment, each GeoIdSet is built from all its rows at once
+    for (exptID, rows) in itertools.groupby(streamLookup(conn, 'curated', '''select c.exptID, rs.accid as rsID
         from curated c, gxd_htrawsample rs
-        where c._experiment_key = rs._experiment_key''', 'auto')
-
-    for r in results:
-        exptID = r['exptID']
-        rsID = r['rsID']
-        if exptID not in curatedExptDict:
-            curatedExptDict[exptID] = []
-        curatedExptDict[exptID].append(rsID)
+        where c._experiment_key = rs._experiment_key
+        order by c.exptID''', ['exptID', 'rsID']), operator.itemgetter(0)):
+        curatedExptDict[exptID] = geoIdSet.GeoIdSet('GSM', [rsID for (e, rsID) in rows])
        
-    results = db.sql('''select distinct a.accid as exptID, a._object_key as _experiment_key, rs.accid as rsID
+    for (exptID, rows) in itertools.groupby(streamLookup(conn, 'nonCurated', '''select distinct a.accid as exptID, rs.accid as rsID
         from acc_accession a
+        join input_geo i on (a.accid = i.accid)
 left outer join gxd_htrawsample rs on (a._object_key = rs._experiment_key)
                 where a._MGIType_key = 42 -- GXD HT Experiment
-                and a._LogicalDB_key = 190 -- GEO Series ''', 'auto')
-    for r in results:
-        exptID = r['exptID']
-        rsID = r['rsID']
-        if exptID not in nonCuratedExptDict:
-            nonCuratedExptDict[exptID] = []
-        nonCuratedExptDict[exptID].append(rsID)
+                and a._LogicalDB_key = 190 -- GEO Series
+        order by a.accid''', ['exptID', 'rsID']), operator.itemgetter(0)):
+        nonCuratedExptDict[exptID] = geoIdSet.GeoIdSet('GSM', \
+            [rsID for (e, rsID) in rows if rsID is not None])
+
+    if conn:
+        conn.close()
 
     db.useOneConnection(0)
-    
+
+    # the parse workers are forked once the lookups are loaded so they
+    # inherit them (geoExptInDbDict, exptTypeTransDict, curatedExptDict...)
+    # instead of having them re-queried or pickled with each task, and
+    # before the COPY load opens its connection and background thread,
+    # which a forked worker must not inherit. They only parse, they never
+    # assign keys or write to the bcp files
+    if args.jobs > 1:
+        pool = multiprocessing.get_context('fork').Pool(args.jobs)
+
+    if loadBackend == 'copy':
+        if openCopyLoader() != 0:
+            return 1
+
     return 0
 
 #
-# Purpose: removes all non-ascii characters from 'text'
-#          also remove embedded newline and line feed
-# Returns: 'text' with ascii chars removed
+# Purpose: creates the temp table input_geo of the GEO IDs in the input
+# Returns: Nothing
+# Assumes: 'conn' is from pgCopy.connect(), or None to use db.sql in
+#       db.useOneConnection(1) mode
+# Effects: creates and fills the temp table
+# Throws: psycopg2.Error
+#
+
+def createInputGeo(conn, inputIdList):
+
+    lookupExecute(conn, '''create temporary table input_geo (accid text not null)''')
+
+    if conn:
+        cursor = conn.cursor()
+        cursor.copy_expert('copy input_geo from stdin', \
+            io.StringIO(''.join(['%s%s' % (i, CRT) for i in inputIdList])))
+        cursor.close()
+    else:
+        # the IDs are GSE<digits>, see inputIdRe, nothing to quote
+        for i in range(0, len(inputIdList), INPUT_GEO_BATCH):
+            db.sql('''insert into input_geo values %s''' % \
+                ','.join(["('%s')" % accid for accid in inputIdList[i:i + INPUT_GEO_BATCH]]), None)
+
+    lookupExecute(conn, '''create index idx_input_geo on input_geo(accid)''')
+    lookupExecute(conn, '''analyze input_geo''')
+
+#
+# Purpose: runs a lookup statement that returns no rows
+# Returns: Nothing
+# Assumes: see createInputGeo()
+# Effects: writes to the database
+# Throws: psycopg2.Error
+#
+
+def lookupExecute(conn, sql):
+
+    if conn:
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        cursor.close()
+    else:
+        db.sql(sql, None)
+
+#
+# Purpose: runs a lookup query on a server-side cursor, so its rows are
+#       fetched lookupFetchSize at a time rather than all at once; with no
+#       connection the query runs through db.sql and is read all at once
+# Returns: generator of row tuples, in the order of 'columnList'
+# Assumes: 'conn' is in a transaction, as named cursors require, or None
+#       (see createInputGeo()); 'columnList' names the selected columns
+# Effects: queries the database, prints the rows and time of the lookup
+#       when it is done, with the peak rss of the process and how much it
+#       grew during the lookup (rows held by the caller included)
+# Throws: psycopg2.Error
+#
+
+def streamLookup(conn, name, sql, columnList):
+
+    startTime = time.time()
+    startRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rows = 0
+
+    if conn:
+        cursor = conn.cursor(name='lookup_%s' % name)
+        cursor.itersize = lookupFetchSize
+        cursor.execute(sql)
+        for row in cursor:
+            rows += 1
+            yield row
+        cursor.close()
+    else:
+        for r in db.sql(sql, 'auto'):
+            rows += 1
+            yield tuple([r[c] for c in columnList])
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('lookup %s: %s rows %.2f seconds, process peak rss %s MB (+%s MB)' % \
+        (name, rows, time.time() - startTime, peakRss // 1024, \
+        (peakRss - startRss) // 1024))
+
+#
+# Purpose: collects the GEO experiment IDs in the esummary files
+# Returns: sorted list of GEO IDs
 # Assumes: Nothing
-# Effects:
+# Effects: reads the esummary files
 # Throws: Nothing
 #
 
-def removeNonAscii(text):
+def scanInputIds(expFileList):
+
+    idSet = set()
 
-    text = ((str.strip(text)).replace(TAB, ' ')).replace(CRT, ' ')
-    newText = ''
-    for c in text:
-        if ord(c) < 128:
-            newText += c
+    for expFile in expFileList:
+        with open(expFile, 'rb') as fp:
+            for line in fp:
+                if b'<Accession>GSE' in line:
+                    for match in inputIdRe.finditer(line):
+                        idSet.add(match.group(1).decode())
 
-    return newText
+    return sorted(idSet)
 
 #
-# Purpose: Loops through all experiment files sending them to parser
-# Returns:
+# Purpose: opens the COPY load, the bcp and sample delete file descriptors
+#       become the table streams of the load
+# Returns: 1 if the database connection fails, else 0
+# Assumes: Nothing
+# Effects: connects to the database, starts the COPY of MGI_KeyValue,
+#       creates the bcp files if COPY_TEE_BCP is 'true'
+# Throws: Nothing
+#
+
+def openCopyLoader():
+    global fpExperimentBcp, fpSampleBcp, fpKeyValueBcp, fpSampleDelete
+    global fpAccBcp, fpVariableBcp, fpPropertyBcp, copyLoader
+
+    try:
+        copyLoader = pgCopy.CopyLoader(pgCopy.connect(), 'MGI_KeyValue')
+    except Exception as e:
+        print('Cannot connect for COPY load: %s' % e)
+        return 1
+
+    # the deletes run before the spooled tables are copied, then the
+    # tables in the order of geo_htload.sh
+    fpSampleDelete = copyLoader.openDelete(deleteFileName)
+    fpKeyValueBcp = openCopyTable('MGI_KeyValue', keyValueFileName)
+    fpExperimentBcp = openCopyTable('GXD_HTExperiment', experimentFileName)
+    fpAccBcp = openCopyTable('ACC_Accession', accFileName)
+    fpVariableBcp = openCopyTable('GXD_HTExperimentVariable', variableFileName)
+    fpPropertyBcp = openCopyTable('MGI_Property', propertyFileName)
+    fpSampleBcp = openCopyTable('GXD_HTRawSample', sampleFileName)
+
+    return 0
+
+#
+# Purpose: gets the bcp file a COPY table stream is teed to
+# Returns: full path of 'fileName', None if COPY_TEE_BCP is not 'true'
 # Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
+
+def copyTeeFile(fileName):
+
+    if copyTeeBcp == 'true':
+        return '%s/%s' % (outputDir, fileName)
+    return None
+
+#
+# Purpose: opens the COPY table stream of 'table' for its BcpWriter
+# Returns: bcpWriter.BcpWriter
+# Assumes: copyLoader is open
+# Effects: starts the COPY of 'table'
+# Throws: psycopg2.Error
+#
+
+def openCopyTable(table, fileName):
+
+    return bcpWriter.BcpWriter(copyLoader.open(table, copyTeeFile(fileName)), table, userKey, loadDate)
+
+#
+# Purpose: Loops through all experiment files sending them to parser
+#       if --jobs > 1 a pool of worker processes parses the files and the
+#       sample (family.xml) files. Experiments are always processed in file
+#       order so that primary keys are assigned exactly as in a serial run
+# Returns: 1 if there are no experiment files, else 0
+# Assumes: initialize() has created the pool if --jobs > 1
 # Effects:
 # Throws: Nothing
 #
@@ -482,526 +1170,910 @@ def processAll():
         fpExpParsingFile.write('expID%ssampleList%stitle%ssummary+overall-design%sisSuperSeries%spdat%sChosen Expt Type%sn_samples%spubmedList%s' % (TAB, TAB, TAB, TAB, TAB, TAB, TAB, TAB, CRT))
         fpSampParsingFile.write('expID%ssampleID%sdescription%stitle%ssType%schannelInfo%s' % (TAB, TAB, TAB, TAB, TAB, CRT))
         fpSampInDbParsingFile.write('expID%ssampleID%sdescription%stitle%ssType%schannelInfo%s' % (TAB, TAB, TAB, TAB, TAB, CRT))
-    for expFile in str.split(os.environ['EXP_FILES']):
+
+    expFileList = str.split(os.environ['EXP_FILES'])
+
+    if pool and len(expFileList) > 1:
+        parsedFiles = parseExperimentFiles(pool, expFileList)
+    else:
+        # stream each file straight into the experiment loop
+        parsedFiles = map(iterExperimentFile, expFileList)
+
+    # experiments whose sample file is being parsed by the pool, waiting
+    # to be processed in order
+    pendingList = collections.deque()
+    maxPending = args.jobs * 4
+
+    # parsedFiles returns results in the order of expFileList
+    for expFile, experimentList in zip(expFileList, parsedFiles):
         print('processing: %s' % expFile)
-        rc = process(expFile)
+        for experiment in experimentList:
+            if pool is None:
+                processExperiment(experiment)
+                continue
+
+            if needsSamples(experiment):
+                experiment.sampleResult = startSampleParse(pool, experiment.expID)
+            pendingList.append(experiment)
+
+            # process the oldest experiments once their samples are parsed
+            # or once the pipeline is full
+            while pendingList and (len(pendingList) > maxPending or \
+                    pendingList[0].sampleResult is None or \
+                    pendingList[0].sampleResult.ready()):
+                processExperiment(pendingList.popleft())
+        rc = 0
+
+    while pendingList:
+        processExperiment(pendingList.popleft())
+
+    applySampleDiffs()
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    if sampleFileCache:
+        sampleFileCache.writeStats()
+        print('sample cache entries evicted: %s' % sampleFileCache.evict())
 
     return rc
 
 #
-# Purpose: parse input file, QC, create bcp files
-# Returns: 
-# Assumes: globals have all been initialized
-# Effects: Creates files in the file system
+# Purpose: parse the esummary experiment files in the pool, at most
+#       args.jobs files ahead of the experiment loop. The pool's queue is
+#       first in first out; a file is only submitted when the loop takes
+#       the oldest, so the sample parses started by the loop wait behind
+#       at most args.jobs esummary parses rather than behind all of them
+# Returns: generator of lists of Experiment objects, in the order of
+#       'expFileList'
+# Assumes: Nothing
+# Effects: submits tasks to 'pool'
 # Throws: Nothing
 #
 
-def process(expFile):
-    global expCount, exptLoadedCount, updateExptList
-    global nextExptKey, nextAccKey, nextExptVarKey, nextPropKey
-    global expSkippedNotInDbTransIsSuperseriesSet, expSkippedNoSampleList
-    global expIdsInDbSet, expLoadedNoSampleList
-    global expSkippedNotInDbNoTransSet, expMaxSamplesSet
+def parseExperimentFiles(pool, expFileList):
 
-    f = open(expFile, encoding='utf-8', errors='replace')   
-    #f = open(expFile, encoding='latin-1', errors='replace')
-    context = ET.iterparse(f, events=("start","end"))
-    context = iter(context)
-      
-    level = 0
-    expID = ''
-    title = ''
-    summary = ''
-    pdat = ''
-    gdsType = ''
-    exptType = ''
-    n_samples = '' # this used to test for max samples, no longer stored
-    pubmedList = []
-    sampleList = [] # list of sampleIDs
+    parsingList = collections.deque()
+    for expFile in expFileList:
+        parsingList.append(pool.apply_async(parseExperimentFile, (expFile,)))
+        if len(parsingList) >= args.jobs:
+            yield parsingList.popleft().get()
 
-    isSuperSeries = 'no'   # flag to indicate expt is superseries, skip
-    exptTypeKey = 0        # if 0 chosen gdstype did not translate, skip
-    isTpr = 0
-    
-    for event, elem in context:
-        # end of a record - reset everything
-        if event=='end' and elem.tag == 'DocumentSummary':
-            if DEBUG == 'true':
-                print('expID: %s' % expID)
-            expCount += 1
-            skip = 0
+    while parsingList:
+        yield parsingList.popleft().get()
 
-            #
-            # Experiment is in the database
-            # add new pubmed ids
-            # reload sample data
-            #
-            if expID in geoExptInDbDict:
-                updateExpKey = geoExptInDbDict[expID]
-                #
-                # check for additional pubmed IDs
-                #
-                propertyUpdateTemplate = "#====#%s%s%s#=#%s#=====#%s%s%s#==#%s#===#%s%s%s%s%s%s%s%s%s" % (TAB, propTypeKey, TAB, TAB, TAB, exptMgiTypeKey, TAB, TAB, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT )
-                skip = 1
-                expIdsInDbSet.add(expID)
-                if DEBUG == 'true':
-                    print('expIdInDb skip')
+#
+# Purpose: parse one esummary experiment file
+# Returns: list of Experiment objects in file order, no keys assigned
+# Assumes: Nothing, may be run in a worker process
+# Effects: reads the file system
+# Throws: Nothing
+#
 
-                # not all experiments have pubmed IDs in the database
-                # assigning empty list assures we pick up this case
-                dbBibList = []
+def parseExperimentFile(expFile):
 
-                if expID in pubMedByExptDict:
-                    # get the list of pubmed Ids for this expt in the database
-                    dbBibList = pubMedByExptDict[expID]
+    return list(iterExperimentFile(expFile))
 
-                # get the set of incoming pubmed IDs not in the database
-                newSet = set(pubmedList).difference(set(dbBibList))
+#
+# Purpose: stream one esummary experiment file, one DocumentSummary at a time
+#       Only the end events of the tags we use are looked at. Each
+#       DocumentSummary is removed from the tree once it has been turned into
+#       an Experiment, so memory does not grow with the size of the file
+# Returns: generator of Experiment objects in file order, no keys assigned
+# Assumes: Nothing, may be run in a worker process
+# Effects: reads the file system
+# Throws: Nothing
+#
 
-                # if we have new pubmed IDs, add them to the database
-                if newSet:
+def iterExperimentFile(expFile):
 
-                    # get next sequenceNum for this expt's pubmed ID
-                    # in the database
+    f = open(expFile, encoding='utf-8', errors='replace')
+    #f = open(expFile, encoding='latin-1', errors='replace')
+    context = ET.iterparse(f, events=("start","end"))
 
-                    # get the next property sequence number
-                    results = db.sql('''select max(sequenceNum) + 1
-                        as nextNum
-                        from MGI_Property p
-                        where p._Object_key =  %s
-                        and p._PropertyTerm_key = 20475430
-                        and p._PropertyType_key = 1002''' % updateExpKey, 'auto')
-                    nextSeqNum = results[0]['nextNum']
+    # open elements, elemStack[-1] is the parent of the element that ends
+    # eSummaryResult/DocumentSummarySet/DocumentSummary is depth 3
+    elemStack = []
+    experiment = Experiment()
 
-                    if nextSeqNum == None:
-                        nextSeqNum = 1
+    for event, elem in context:
+        if event == 'start':
+            elemStack.append(elem)
+            continue
+
+        elemStack.pop()
+        depth = len(elemStack) + 1
+        tag = elem.tag
+
+        # end of a record - hand it off and release it from the tree
+        if tag == 'DocumentSummary':
+            yield experiment
+            experiment = Experiment()
+            elem.clear()
+            elemStack[-1].remove(elem)
+        elif tag == 'Accession':
+            if depth == 4:
+                experiment.expID = elem.text
+            elif depth == 6:
+                # Samples/Sample/Accession
+                experiment.sampleList.append(elem.text)
+        elif tag == 'int':
+            # PubMedIds/int
+            experiment.pubmedList.append(elem.text)
+        elif depth == 4:
+            if tag == 'title':
+                experiment.title = textNormalize.removeNonAscii(elem.text)
+            elif tag == 'summary':
+                experiment.summary = elem.text
+                if experiment.summary.find(SUPERSERIES) != -1:
+                    experiment.isSuperSeries =  'yes'
+            elif tag == 'PDAT':
+                experiment.pdat = elem.text
+            elif tag == 'gdsType':
+                experiment.gdsType = elem.text
+            elif tag == 'n_samples':
+                experiment.n_samples = elem.text
+
+    f.close()
 
-                    updateExptList.append(expID)
+#
+# Purpose: determines if processExperiment will parse the sample file for
+#       'experiment' so the parse can be started ahead of time
+# Returns: True if the experiment is in the database or may be loaded
+# Assumes: geoExptInDbDict and exptTypeTransDict have been initialized
+# Effects: sets experiment.oversized, may read the sample file
+# Throws: ET.ParseError
+#
 
-                    for b in newSet:
-                        toLoad = propertyUpdateTemplate.replace('#=#', str(pubmedPropKey)).replace('#==#', str(b)).replace('#===#', str(nextSeqNum)).replace('#====#', str(nextPropKey)).replace('#=====#', str(updateExpKey))
-                        fpPropertyBcp.write(toLoad)
-                        nextPropKey += 1
+def needsSamples(experiment):
 
-                # if there's no raw sample data for the existing experiment, add it
-                if DEBUG == 'true':
-                    print('processing samples')
-                ret =  processSamples(expID, 'true') # 1, 2 or a list of sample info
-                if ret == 1:
-                     print('returnCode for %s: %s, no sample file' % (expID, ret))
-                elif ret == 2:
-                     print('returnCode for %s: %s, parsing issue' % (expID, ret))
-                else:
-                     # wts2-1339: expt is in db, call processSampleBcp only if <= maxSamples
-                     # only add samples if <= the configured max samples
-                     sampleList = ret
-                     if len(sampleList) <= maxSamples:
-                         processSampleBcp(sampleList, updateExpKey)
-                     else:
-                        expMaxSamplesSet.add('Experiment in DB: %s' % expID) 
-
-            # -- end "if expID in geoExptInDbDict:" ------------------------------
-
-            typeList = list(map(str.strip, gdsType.split(';')))
-
-            # 'Other' is only used if it is the only term in the typeList
-            # wts2-1773/sprt-158/sw:GEO_GXD_HT_Load--make "Other" just another series type
-            #if 'Other' in typeList and len(typeList) > 1:
-            #    skip = 1
-
-            if skip != 1:
-                (exptTypeKey, exptType) = processExperimentType(typeList)
-                if exptTypeKey == 0:
-                    # expts whose type doesn't translate and is not already in the db
-                    expSkippedNotInDbNoTransSet.add(expID)
-                    skip = 1
-
-            if skip != 1 and isSuperSeries == 'yes':
-                # number of superseries not already caught because of un translated
-                # exptType or already in DB
-                expSkippedNotInDbTransIsSuperseriesSet.add(expID)
-                skip = 1
-            # wts2-1339: expt not in db, we want to create the expt 
-            # then later check how many samples
-            if  skip != 1: 
-                exptLoadedCount += 1
-                createExpObject = 0
-                # now process the samples
-                ret =  processSamples(expID, 'false')
-                if ret == 1:
-                    expLoadedNoSampleList.append('expID: %s' % (expID))
-                    createExpObject = 1
-                elif ret == 2:
-                    expSkippedNoSampleList.append('expID: %s' % (expID))
-                    exptLoadedCount -= 1 # decrement the loaded count
-                else:
-                    sampleList = ret #  list of sampleString's representing each sample for the current experiment
-                    createExpObject = 1
-                if createExpObject:
-                    # catenate the global overallDesign parsed from the sample to the
-                    # experiment summary
-                    description = '%s %s' % (summary, overallDesign)
-                    description = removeNonAscii(description)
-                    if runParsingReports == 'true':
-                       fpExpParsingFile.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (expID, TAB, ', '.join(sampleList), TAB, title, TAB, description, TAB, isSuperSeries, TAB, pdat, TAB, exptType, TAB, ', '.join(pubmedList), CRT) )
-
-                    #
-                    # GXD_HTExperiment BCP
-                    #
-
-                    line = '%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextExptKey, TAB, sourceKey, TAB, title, TAB, description, TAB, pdat, TAB, releasedate, TAB, evalDate, TAB, evalStateTermKey, TAB, curStateTermKey, TAB, studyTypeTermKey, TAB, exptTypeKey, TAB, evalByKey, TAB, initCurByKey, TAB, lastCurByKey, TAB, initCurDate, TAB, lastCurDate, TAB, confidence, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT) 
-                    fpExperimentBcp.write(line)
-           
-                    #
-                    # GXD_HTVariable BCP
-                    #
-                    fpVariableBcp.write('%s%s%s%s%s%s' % (nextExptVarKey, TAB, nextExptKey, TAB, exptVariableTermKey, CRT))
-                    nextExptVarKey += 1
-
-                    #
-                    # ACC_Accession BCP
-                    #
-                    prefixPart, numericPart = accessionlib.split_accnum(expID)
-                    fpAccBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextAccKey, TAB, expID, TAB, prefixPart, TAB, numericPart, TAB, geoLdbKey, TAB, nextExptKey, TAB, exptMgiTypeKey, TAB, private, TAB, isPreferred, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT ))
-                    nextAccKey += 1
-
-                    #
-                    # Experiment Properties
-                    #
-
-                    # title (1) experiment name 
-                    #   namePropKey = 20475428
-                    # typeList (1-n) raw experiment types 
-                    #   expTypePropKey = 20475425
-                    # pubmedList (0-n) pubmed Ids 
-                    #   pubmedPropKey = 20475430
-                    # description (1) sample overalldesign + expt summary 
-                    #   descriptionPropKey = 87508020
-
-                    # the template for properties:
-                    propertyTemplate = "#====#%s%s%s#=#%s%s%s%s%s#==#%s#===#%s%s%s%s%s%s%s%s%s" % (TAB, propTypeKey, TAB, TAB, nextExptKey, TAB, exptMgiTypeKey, TAB, TAB, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT )
-
-
-                    if title != '':
-                        toLoad = propertyTemplate.replace('#=#', str(namePropKey)).replace('#==#', title).replace('#===#', '1').replace('#====#', str(nextPropKey))
-                        fpPropertyBcp.write(toLoad)
-                        nextPropKey += 1
-
-                    seqNumCt = 1
-                    for e in typeList:
-                        toLoad = propertyTemplate.replace('#=#', str(expTypePropKey)).replace('#==#', e).replace('#===#', str(seqNumCt)).replace('#====#', str(nextPropKey))
-                        fpPropertyBcp.write(toLoad)
-                        seqNumCt += 1
-                        nextPropKey += 1
-
-                    for b in pubmedList:
-                        toLoad = propertyTemplate.replace('#=#', str(pubmedPropKey)).replace('#==#', str(b)).replace('#===#', str(seqNumCt)).replace('#====#', str(nextPropKey))
-                        fpPropertyBcp.write(toLoad)
-                        seqNumCt += 1
-                        nextPropKey += 1
-
-                    if title != '':
-                        toLoad = propertyTemplate.replace('#=#', str(namePropKey)).replace('#==#', title).replace('#===#', '1').replace('#====#', str(nextPropKey))
-                        fpPropertyBcp.write(toLoad)
-                        nextPropKey += 1
-
-                    #
-                    # GXD_HTRawSample and MGI_KeyValue BCP
-                    #
-                    # ret from processSample = 1 means there was no sample file
-                    # so experiment is created, but no samples wts2-1339 
-                        # we've created the experiment, 
-                        #   now check the number of samples
-                    if DEBUG == 'true':
-                        print('ret: %s len(sampleList): %s ' % (ret, len(sampleList)))
-                    if ret == 1: #no sample file
-                        pass # do nothing
-                    elif len(sampleList) <= maxSamples:
-                        processSampleBcp(sampleList, nextExptKey)
-                    else: #ret != 1 and len(sampleList) > maxSamples
-                        expMaxSamplesSet.add('New experiment: %s ' % expID)
-                        
-                    # now increment the experiment key
-                    nextExptKey += 1
-            title = ''
-            summary = ''
-            isSuperSeries = 'no'
-            pdat = ''
-            gdsType = ''
-            n_samples = ''
-            pubmedList = []
-            sampleList = []
-            exptTypeKey = 0
-        
-        if level == 4 : 
-            if DEBUG == 'true':
-                print('process experiment In tag level 4')
-            # Accession tag at level 4 tells us we have a new record
-            if elem.tag == 'Accession':
-                expID = elem.text
-            elif elem.tag == 'title':
-                title = elem.text
-                title = removeNonAscii(title)
-            elif elem.tag == 'summary':    
-                summary = elem.text
-                if summary.find(SUPERSERIES) != -1:
-                    isSuperSeries =  'yes'
-            elif elem.tag == 'PDAT':
-                pdat = elem.text
-            elif elem.tag == 'gdsType':
-                gdsType = elem.text
-            elif elem.tag == 'n_samples':
-                n_samples = elem.text
-        if event=='start':
-            level += 1
-        elif elem.tag == 'int':
-            id = elem.text
-            pubmedList.append(id)
-        elif level == 6 and elem.tag == 'Accession':
-            sampleList.append(elem.text)
-        if event == 'end':
-            level -= 1
-    
-    elem.clear()
-    return 0
+    if isUnchanged(experiment) or samplesUnchanged(experiment):
+        return False
+
+    if experiment.expID not in geoExptInDbDict:
+        if experiment.isSuperSeries == 'yes':
+            return False
+
+        if not any(exptType in exptTypeTransDict \
+                for exptType in map(str.strip, experiment.gdsType.split(';'))):
+            return False
+
+    # last, it may stat and read the sample file
+    return not isOversized(experiment)
 
 #
-# Purpose: looks a the list of expt types and determines if
-#       there is one in the expt translation. 
-# Returns: expt type and expt type key of the chosen expt type; both 0 if
-#       no translatable expt type
-# Assumes: exptTypeTransDict has been initialized
-# Effects: 
+# Purpose: determines if 'experiment' is in the database and unchanged
+#       since the last successful load
+# Returns: True if the experiment can be skipped
+# Assumes: exptStateDict has been initialized
+# Effects: Nothing
 # Throws: Nothing
 #
 
-def processExperimentType(typeList):
-     global expTypesSkippedSet
+def isUnchanged(experiment):
 
-     # pick first valid experiment type and translate it
-     exptTypeKey = 0
-     found = 0
-     for exptType in typeList:
-         if exptType not in exptTypeTransDict:
-             expTypesSkippedSet.add(exptType)
-         # we take the FIRST translatable expt type in the list
-         # but we want to iterate through all types to get all
-         # that do not translate i.e. don't use i'break'
-         elif exptType in exptTypeTransDict and found == 0:
-             exptTypeKey= exptTypeTransDict[exptType]
-             found = 1
-     return (exptTypeKey, exptType)
+    expID = experiment.expID
 
+    return expID in geoExptInDbDict and expID in exptStateDict \
+        and exptStateDict[expID] == experiment.fingerprint()
 
 #
-# Purpose: parses the sample file for 'expID' if it exists
-# Returns: 1 if the sample file does not exist, 2 if parsing errors, 
-#       otherwise sampleList. sampleList is a list of strings of sample
-#       metadata, one for each sample
-# Assumes: Nothing
-# Effects: 
+# Purpose: determines if 'experiment' is in the database with exactly the
+#       raw samples listed in its esummary
+# Returns: True if the samples need not be reloaded
+# Assumes: nonCuratedExptDict has been initialized, it has a GeoIdSet of the
+#       raw sample IDs of every GEO experiment in the database, empty if the
+#       experiment has none
+# Effects: Nothing
 # Throws: Nothing
 #
 
-def processSamples(expID, inDb): # inDb 'true' or 'false'
-    global overallDesign, duplicatedSampleIdDict
-    sampleFile = '%s%s' % (expID, sampleFileSuffix)
-    samplePath = '%s/%s' % (geoDownloads, sampleFile)
-    
-    # if sample file does not exist return 1
-    if not os.path.exists(samplePath):
-        return 1
+def samplesUnchanged(experiment):
 
-    # list of samples for this experiment to return
-    sampleList = []
+    expID = experiment.expID
 
-    # save the sample IDs for this experiment so we can check for dups
-    idList = []
+    if args.full or expID not in geoExptInDbDict \
+            or expID not in nonCuratedExptDict or not experiment.sampleList:
+        return False
 
-    f = open(samplePath, encoding='utf-8', errors='replace')
-    context = ET.iterparse(f, events=("start","end"))
-    context = iter(context)
-
-    level = 0
-    sampleID = ''
-    description = ''
-    title = ''
-    sType = ''
-    molecule = ''
-    taxid = ''
-    taxidValue = ''
-    treatmentProt = ''
-    overallDesign = ''
-
-    # dictionary of key/values for the Channel section
-    channelDict = {}
-
-    # There can be 1 or 2 channels (not yet sure if there can be zero
-    # first dict in list is channel 1, second is channel 2 (if there is one)
-    channelList = []
-
-    # Channel, there can be 1 or 2, need for sequence of sets of 
-    # source/taxid/treatment/molecule
-    cCount = 0 
+    return geoIdSet.GeoIdSet('GSM', experiment.sampleList) == nonCuratedExptDict[expID]
+
+#
+# Purpose: QC one parsed experiment, create bcp for it and its samples
+# Returns: 0
+# Assumes: globals have all been initialized
+# Effects: Creates files in the file system
+# Throws: Nothing
+#
+
+def processExperiment(experiment):
+    global expCount, exptLoadedCount, updateExptList
+    global nextExptKey, nextAccKey, nextExptVarKey, nextPropKey
+    global expSkippedNotInDbTransIsSuperseriesSet, expSkippedNoSampleList
+    global expIdsInDbSet, expLoadedNoSampleList
+    global expSkippedNotInDbNoTransSet, expMaxSamplesSet, expUnchangedCount
+    global expStreamedSet
+    global expSamplesUnchangedCount
+
+    expID = experiment.expID
+    title = experiment.title
+    summary = experiment.summary
+    pdat = experiment.pdat
+    gdsType = experiment.gdsType
+    exptType = ''
+    pubmedList = experiment.pubmedList
+    sampleList = experiment.sampleList # list of sampleIDs
+    isSuperSeries = experiment.isSuperSeries # flag to indicate expt is superseries, skip
+    exptTypeKey = 0        # if 0 chosen gdstype did not translate, skip
+
+    if DEBUG == 'true':
+        print('expID: %s' % expID)
+    expCount += 1
+    skip = 0
+
+    # nothing has changed since the last load, carry the fingerprint forward
+    if isUnchanged(experiment):
+        expUnchangedCount += 1
+        writeExptState(experiment)
+        return 0
+
+    # set when the samples are loaded, the experiment is then up to date
+    # and its fingerprint is saved for the next run
+    samplesLoaded = 0
 
     #
-    # Parse the sample file
+    # Experiment is in the database
+    # add new pubmed ids
+    # reload sample data
     #
-    for event, elem in context:
-        if event == 'start':
-            level += 1
-        if event == 'end':
-            level -= 1
+    if expID in geoExptInDbDict:
+        updateExpKey = geoExptInDbDict[expID]
         #
-        # we are done processing a sample, print and reset
+        # check for additional pubmed IDs
         #
-        if event == 'end' and elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Sample':
-            # if the dict is not empty, add it to the list
-            if channelDict:
-                channelList.append(channelDict)
+        skip = 1
+        expIdsInDbSet.add(expID)
+        if DEBUG == 'true':
+            print('expIdInDb skip')
+
+        # not all experiments have pubmed IDs in the database
+        # assigning empty list assures we pick up this case
+        dbBibList = []
 
-            # process the 1 or 2 channels for the current sample
-            channelString = processChannels(channelList)
+        if expID in pubMedByExptDict:
+            # get the list of pubmed Ids for this expt in the database
+            dbBibList = pubMedByExptDict[expID]
 
-            # the string of attributes representing the current sample
-            sampleString = ('%s%s%s%s%s%s%s%s%s%s%s' % (expID, TAB, sampleID, TAB, description, TAB, title, TAB, sType, TAB, channelString))
+        # get the incoming pubmed IDs not in the database, in input order
+        # so the property keys do not depend on set iteration order
+        newList = []
+        for b in pubmedList:
+            if b not in dbBibList and b not in newList:
+                newList.append(b)
 
-            # append to the list of attributes for each sample in this 
-            # experiment
-            sampleList.append(sampleString)
+        # if we have new pubmed IDs, add them to the database
+        if newList:
 
-            # optionally write this report for new experiments
-            if runParsingReports == 'true' and inDb == 'false':
-                fpSampParsingFile.write('%s%s' % (sampleString, CRT))
+            # get next sequenceNum for this expt's pubmed IDs
+            # in the database
+            nextSeqNum = nextPubMedSeqNum(expID)
 
-            # always write this report for experiments in the db
-            if inDb == 'true':
-                fpSampInDbParsingFile.write('%s%s' % (sampleString, CRT))
+            updateExptList.append(expID)
+
+            for b in newList:
+                fpPropertyBcp.write(nextPropKey, propTypeKey, pubmedPropKey, updateExpKey, exptMgiTypeKey, b, nextSeqNum)
+                nextPropKey += 1
+
+        # the raw samples in the database are the ones in the esummary,
+        # no need to open the sample file, delete and reload
+        if samplesUnchanged(experiment):
+            if DEBUG == 'true':
+                print('samples unchanged')
+            expSamplesUnchangedCount += 1
+            samplesLoaded = 1
+            ret = 0
+        else:
+            # if there's no raw sample data for the existing experiment, add it
+            if DEBUG == 'true':
+                print('processing samples')
+            ret =  processSamples(experiment, 'true') # 1, 2 or a list of sample info
+        if ret == 0:
+            pass
+        elif ret == 1:
+             print('returnCode for %s: %s, no sample file' % (expID, ret))
+        elif ret == 2:
+             print('returnCode for %s: %s, parsing issue' % (expID, ret))
+        elif ret == 3:
+             if streamSamples == 'true':
+                 processSampleStream(experiment, updateExpKey, 'true')
+                 expStreamedSet.add('Experiment in DB: %s' % expID)
+                 samplesLoaded = 1
+             else:
+                 expMaxSamplesSet.add('Experiment in DB: %s' % expID)
+        else:
+             # wts2-1339: expt is in db, call processSampleBcp only if <= maxSamples
+             # only add samples if <= the configured max samples
+             sampleList = ret
+             if len(sampleList) <= maxSamples:
+                 if diffSampleReload == 'true':
+                     processSampleDiff(sampleList, updateExpKey)
+                 else:
+                     processSampleBcp(sampleList, updateExpKey)
+                 samplesLoaded = 1
+             else:
+                expMaxSamplesSet.add('Experiment in DB: %s' % expID)
+
+    # -- end "if expID in geoExptInDbDict:" ------------------------------
+
+    typeList = list(map(str.strip, gdsType.split(';')))
+
+    # 'Other' is only used if it is the only term in the typeList
+    # wts2-1773/sprt-158/sw:GEO_GXD_HT_Load--make "Other" just another series type
+    #if 'Other' in typeList and len(typeList) > 1:
+    #    skip = 1
+
+    if skip != 1:
+        (exptTypeKey, exptType) = processExperimentType(typeList)
+        if exptTypeKey == 0:
+            # expts whose type doesn't translate and is not already in the db
+            expSkippedNotInDbNoTransSet.add(expID)
+            skip = 1
+
+    if skip != 1 and isSuperSeries == 'yes':
+        # number of superseries not already caught because of un translated
+        # exptType or already in DB
+        expSkippedNotInDbTransIsSuperseriesSet.add(expID)
+        skip = 1
+    # wts2-1339: expt not in db, we want to create the expt
+    # then later check how many samples
+    if  skip != 1:
+        exptLoadedCount += 1
+        createExpObject = 0
+        # now process the samples
+        ret =  processSamples(experiment, 'false')
+        if ret == 1:
+            expLoadedNoSampleList.append('expID: %s' % (expID))
+            createExpObject = 1
+        elif ret == 2:
+            expSkippedNoSampleList.append('expID: %s' % (expID))
+            exptLoadedCount -= 1 # decrement the loaded count
+        elif ret == 3:
+            # too many samples, the experiment is created without them
+            createExpObject = 1
+        else:
+            sampleList = ret #  list of Sample for the current experiment
+            createExpObject = 1
+        if createExpObject:
+            # catenate the global overallDesign parsed from the sample to the
+            # experiment summary
+            description = '%s %s' % (summary, overallDesign)
+            description = textNormalize.removeNonAscii(description)
+            if runParsingReports == 'true':
+               # the esummary sample IDs if the sample file was not parsed
+               if ret == 1 or ret == 3:
+                   sampleReport = ', '.join(sampleList)
+               else:
+                   sampleReport = ', '.join([sample.reportString() for sample in sampleList])
+               fpExpParsingFile.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (expID, TAB, sampleReport, TAB, title, TAB, description, TAB, isSuperSeries, TAB, pdat, TAB, exptType, TAB, ', '.join(pubmedList), CRT) )
 
             #
-            # reset all attributes
+            # GXD_HTExperiment BCP
             #
-            sampleID = ''
-            description =  ''
-            title = ''
-            sType = ''
-            molecule = ''
-            taxid = ''
-            taxidValue = ''
-            treatmentProt = ''
-            overallDesign = ''
-            channelDict = {}
-            channelList = []
 
-        #
-        # Tag Level 2
-        #
-        if level == 2:
-            if DEBUG == 'true':
-                print('processSample tag level 2')
-            if elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Sample':
-                sampleID = str.strip(elem.get('iid'))
-                if sampleID in idList:
-                    if expID not in duplicatedSampleIdDict:
-                        duplicatedSampleIdDict[expID] = []
-                    duplicatedSampleIdDict[expID].append(sampleID)
-                    continue
-                idList.append(sampleID)
-            elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Overall-Design':
-                if overallDesign == None:
-                    overallDesign = ''
-                else:
-                    #overallDesign = ((str.strip(elem.text)).replace(TAB, ' ')).replace(CRT, ' ')
-                    overallDesign = elem.text
-                    overallDesign = removeNonAscii(overallDesign)
+            fpExperimentBcp.write(nextExptKey, sourceKey, title, description, pdat, releasedate, evalDate, evalStateTermKey, curStateTermKey, studyTypeTermKey, exptTypeKey, evalByKey, initCurByKey, lastCurByKey, initCurDate, lastCurDate, confidence)
 
+            #
+            # GXD_HTVariable BCP
+            #
+            fpVariableBcp.write(nextExptVarKey, nextExptKey, exptVariableTermKey)
+            nextExptVarKey += 1
 
-        #
-        # Tag Level 3
-        #
+            #
+            # ACC_Accession BCP
+            #
+            prefixPart, numericPart = accessionlib.split_accnum(expID)
+            fpAccBcp.write(nextAccKey, expID, prefixPart, numericPart, geoLdbKey, nextExptKey, exptMgiTypeKey, private, isPreferred)
+            nextAccKey += 1
 
-        if level == 3:
+            #
+            # Experiment Properties
+            #
+
+            # title (1) experiment name
+            #   namePropKey = 20475428
+            # typeList (1-n) raw experiment types
+            #   expTypePropKey = 20475425
+            # pubmedList (0-n) pubmed Ids
+            #   pubmedPropKey = 20475430
+            # description (1) sample overalldesign + expt summary
+            #   descriptionPropKey = 87508020
+
+
+            if title != '':
+                fpPropertyBcp.write(nextPropKey, propTypeKey, namePropKey, nextExptKey, exptMgiTypeKey, title, 1)
+                nextPropKey += 1
+
+            seqNumCt = 1
+            for e in typeList:
+                fpPropertyBcp.write(nextPropKey, propTypeKey, expTypePropKey, nextExptKey, exptMgiTypeKey, e, seqNumCt)
+                seqNumCt += 1
+                nextPropKey += 1
+
+            for b in pubmedList:
+                fpPropertyBcp.write(nextPropKey, propTypeKey, pubmedPropKey, nextExptKey, exptMgiTypeKey, b, seqNumCt)
+                seqNumCt += 1
+                nextPropKey += 1
+
+            if title != '':
+                fpPropertyBcp.write(nextPropKey, propTypeKey, namePropKey, nextExptKey, exptMgiTypeKey, title, 1)
+                nextPropKey += 1
+
+            #
+            # GXD_HTRawSample and MGI_KeyValue BCP
+            #
+            # ret from processSample = 1 means there was no sample file
+            # so experiment is created, but no samples wts2-1339
+                # we've created the experiment,
+                #   now check the number of samples
             if DEBUG == 'true':
-                print('processSample tag level 3')
-            if elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Description':
-                description = elem.text
-                if description == None:
-                    description = ''
+                print('ret: %s len(sampleList): %s ' % (ret, len(sampleList)))
+            if ret == 1: #no sample file
+                pass # do nothing
+            elif ret == 3: # > maxSamples in the esummary, not parsed
+                if streamSamples == 'true':
+                    processSampleStream(experiment, nextExptKey, 'false')
+                    expStreamedSet.add('New experiment: %s ' % expID)
+                    samplesLoaded = 1
                 else:
-                    description = description.replace('\\', '')
-                    description =  removeNonAscii(description)
+                    expMaxSamplesSet.add('New experiment: %s ' % expID)
+            elif len(sampleList) <= maxSamples:
+                processSampleBcp(sampleList, nextExptKey)
+                samplesLoaded = 1
+            else: #ret != 1 and len(sampleList) > maxSamples
+                expMaxSamplesSet.add('New experiment: %s ' % expID)
 
-            elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Title':
-                title = elem.text
-                if title == None:
-                    title = ''
-                else:
-                    title = removeNonAscii(title)
-                    
-            elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Type':
-                sType = elem.text
-                if sType == None:
-                    sType = ''
-                else:
-                    sType = ((str.strip(sType)).replace(TAB, ' ')).replace(CRT, ' ')
-            elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Channel':
-                cCount = int(elem.get('position'))
-                # if we have a second channel, append the first to the 
-                # List and reset the dict
-                if cCount == 2:
-                    channelList.append(channelDict)
-                    channelDict = {}
+            # now increment the experiment key
+            nextExptKey += 1
 
-            elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Characteristics':
-                tag = elem.get('tag')
-                if tag == None: # not an attrib just get the text
-                    tag = 'Characteristics' # name it
+    if samplesLoaded:
+        writeExptState(experiment)
 
-                # strip and replace internal tabs and crt's
-                tag = ((str.strip(tag)).replace(TAB, ' ')).replace(CRT, ' ') 
-                value = ((str.strip(elem.text)).replace(TAB, ' ')).replace(CRT, ' ') 
-                
-                #    (expID, sampleID, tag, value))
-                if value is not None and value != '':
-                    channelDict[tag] = value
+    return 0
 
+#
+# Purpose: gets the next pubmed property sequenceNum of an experiment
+#       in the database, the preloaded max(sequenceNum) + 1; all of the
+#       pubmed IDs an experiment gains in a run get this number
+# Returns: the highest sequenceNum in the database plus one; 1 if the
+#       experiment has no pubmed properties
+# Assumes: pubMedMaxSeqByExptDict has been initialized
+# Effects: Nothing
+# Throws: Nothing
+#
 
-        #
-        # Tag Level 4
-        #
+def nextPubMedSeqNum(expID):
 
-        if level == 4:
-            if DEBUG == 'true':
-                print('processSample tag level 4')
-            if elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Source':
-                source = elem.text
-                if source is not None and source != '':
-                    channelDict['source'] = str.strip(source)
-            elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Organism':
-                taxid = elem.get('taxid')
-                if taxid is not None and taxid != '':
-                    channelDict['taxid'] = str.strip(taxid)
-                taxidValue = elem.text
-                if taxidValue is not None and taxidValue != '':
-                    channelDict['taxidValue'] = str.strip(taxidValue)
-
-            elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Treatment-Protocol':
-                treatmentProt = elem.text
-                
-                if treatmentProt is not None and treatmentProt != '':
-                    treatmentProt = ((str.strip(treatmentProt)).replace(TAB, ' ')).replace(CRT, ' ')
-                    if DEBUG == 'true':
-                        print('adding to channelDict expID: %s sampleID: %s treatmentProt: %s' % (expID, sampleID, treatmentProt))
-                    channelDict['treatmentProt'] = treatmentProt
-            elif elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Molecule':
-                molecule = elem.text
-                if molecule is not None and molecule != '':
-                        channelDict['molecule'] = str.strip(molecule)
+    return pubMedMaxSeqByExptDict.get(expID, 0) + 1
+
+#
+# Purpose: saves the fingerprint of 'experiment' for the next run
+# Returns: Nothing
+# Assumes: Nothing
+# Effects: writes to the experiment state file
+# Throws: Nothing
+#
+
+def writeExptState(experiment):
+
+    if fpExptStateFile:
+        fpExptStateFile.write('%s%s%s%s' % (experiment.expID, TAB, experiment.fingerprint(), CRT))
+
+#
+# Purpose: looks a the list of expt types and determines if
+#       there is one in the expt translation. 
+# Returns: expt type and expt type key of the chosen expt type; both 0 if
+#       no translatable expt type
+# Assumes: exptTypeTransDict has been initialized
+# Effects: 
+# Throws: Nothing
+#
+
+def processExperimentType(typeList):
+     global expTypesSkippedSet
+
+     # pick first valid experiment type and translate it
+     exptTypeKey = 0
+     found = 0
+     for exptType in typeList:
+         if exptType not in exptTypeTransDict:
+             expTypesSkippedSet.add(exptType)
+         # we take the FIRST translatable expt type in the list
+         # but we want to iterate through all types to get all
+         # that do not translate i.e. don't use i'break'
+         elif exptType in exptTypeTransDict and found == 0:
+             exptTypeKey= exptTypeTransDict[exptType]
+             found = 1
+     return (exptTypeKey, exptType)
+
+
+#
+# Purpose: gets the parsed sample file for 'experiment', from the worker
+#       pool if the parse was started there, else parses it now. Records the
+#       overall design and duplicate sample IDs and writes the sample
+#       parsing reports
+# Returns: 1 if the sample file does not exist, 2 if parsing errors, 
+#       3 if the experiment has more than maxSamples samples (the sample
+#       file is not parsed), otherwise sampleList. sampleList is a list
+#       of Sample, one for each sample
+# Assumes: Nothing
+# Effects: sets the global overallDesign
+# Throws: Nothing
+#
+
+def processSamples(experiment, inDb): # inDb 'true' or 'false'
+    global overallDesign, duplicatedSampleIdDict
+
+    expID = experiment.expID
+
+    if experiment.sampleResult is None and isOversized(experiment):
+        # the overall design is still part of a new experiment's description
+        overallDesign = ''
+        if inDb == 'false':
+            overallDesign = readOverallDesign(expID)
+        return 3
+
+    if experiment.sampleResult is not None:
+        (result, cacheHit) = experiment.sampleResult.get()
+        experiment.sampleResult = None
+    else:
+        (result, cacheHit) = loadSampleFile(expID)
+
+    (rc, sampleRecordList, sampleOverallDesign, dupIdList) = result
+
+    # do not let the overall design of the last sample file parsed leak
+    # into an experiment with no sample file
+    overallDesign = sampleOverallDesign
+
+    if rc != 0:
+        return rc
+
+    if sampleFileCache:
+        if cacheHit:
+            sampleFileCache.hits += 1
+        else:
+            sampleFileCache.misses += 1
+
+    for sampleID in dupIdList:
+        if expID not in duplicatedSampleIdDict:
+            duplicatedSampleIdDict[expID] = []
+        duplicatedSampleIdDict[expID].append(sampleID)
+
+    # optionally write this report for new experiments
+    if runParsingReports == 'true' and inDb == 'false':
+        for sample in sampleRecordList:
+            fpSampParsingFile.write('%s%s' % (sample.reportString(), CRT))
+
+    # always write this report for experiments in the db
+    if inDb == 'true':
+        for sample in sampleRecordList:
+            fpSampInDbParsingFile.write('%s%s' % (sample.reportString(), CRT))
+
+    return sampleRecordList
+
+#
+# Purpose: determines if 'experiment' has more than maxSamples samples
+#       without parsing its sample file: from the esummary n_samples, else
+#       the esummary sample IDs, else a count of the Sample elements of the
+#       sample file that stops at maxSamples + 1
+# Returns: True if the samples are not to be loaded; False if there are
+#       maxSamples or fewer, or there is no sample file
+# Assumes: Nothing
+# Effects: sets experiment.oversized, may read the sample file
+# Throws: ET.ParseError
+#
+
+def isOversized(experiment):
+
+    if experiment.oversized is not None:
+        return experiment.oversized
+
+    samplePath = sampleFile.findSampleFile('%s/%s%s' % (geoDownloads, experiment.expID, sampleFileSuffix))
+
+    # no sample file is reported as before by processSamples
+    if samplePath is None:
+        experiment.oversized = False
+        return False
+
+    n_samples = str.strip(experiment.n_samples or '')
+    if n_samples.isdigit():
+        count = int(n_samples)
+    elif experiment.sampleList:
+        count = len(experiment.sampleList)
+    else:
+        count = countSampleElements(samplePath, maxSamples + 1)
+
+    experiment.oversized = count > maxSamples
+    return experiment.oversized
+
+#
+# Purpose: counts the Sample elements of a sample file, up to 'limit'
+# Returns: the number of Sample elements, at most 'limit'
+# Assumes: Nothing
+# Effects: reads the sample file until 'limit' samples are seen
+# Throws: ET.ParseError
+#
+
+def countSampleElements(samplePath, limit):
+
+    count = 0
+    f = sampleFile.openSampleText(samplePath)
+    for event, elem in ET.iterparse(f, events=("start","end")):
+        if elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Sample':
+            if event == 'start':
+                count += 1
+                if count >= limit:
+                    break
+            else:
+                elem.clear()
+    f.close()
+
+    return count
+
+#
+# Purpose: reads the Overall-Design of a sample file that is not parsed,
+#       the last one in the file as in parseSampleFile
+# Returns: the overall design, '' if there is none
+# Assumes: the sample file exists
+# Effects: reads the sample file
+# Throws: Nothing
+#
+
+def readOverallDesign(expID):
+
+    samplePath = sampleFile.findSampleFile('%s/%s%s' % (geoDownloads, expID, sampleFileSuffix))
+
+    if sampleFile.isCompressed(samplePath):
+        f = sampleFile.openSampleFile(samplePath)
+        design = scanOverallDesign(f)
+        f.close()
+    elif os.path.getsize(samplePath) == 0:
+        return ''
+    else:
+        # the Series, and its Overall-Design, is at the end of the file
+        f = open(samplePath, 'rb')
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = m.rfind(b'<Overall-Design>')
+        end = m.find(b'</Overall-Design>', start)
+        design = None
+        # parseSampleFile resets the overall design at the end of each sample
+        if start != -1 and end != -1 and m.find(b'<Sample ', end) == -1:
+            design = m[start:end + len(b'</Overall-Design>')]
+        m.close()
+        f.close()
+
+    text = ''
+    if design is not None:
+        try:
+            text = ET.fromstring(design.decode('utf-8', 'replace')).text
+        except ET.ParseError:
+            text = None
+
+    if text is None:
+        return ''
+    return textNormalize.removeNonAscii(text)
+
+#
+# Purpose: finds the last Overall-Design element of a compressed sample
+#       file, as readOverallDesign() does for a plain file
+# Returns: bytes of the element, None if there is none or there is a
+#       Sample after it
+# Assumes: Nothing
+# Effects: reads 'fp' to the end
+# Throws: IOError
+#
+
+def scanOverallDesign(fp):
+
+    design = None
+    data = b''
+    while True:
+        block = fp.read(1048576)
+        data += block
+        pos = 0
+        while True:
+            start = data.find(b'<Overall-Design>', pos)
+            sample = data.find(b'<Sample ', pos)
+            # parseSampleFile resets the overall design at each sample
+            if sample != -1 and (start == -1 or sample < start):
+                design = None
+                pos = sample + 1
+                continue
+            if start == -1:
+                break
+            end = data.find(b'</Overall-Design>', start)
+            if end == -1:
+                # the rest of the element is in the next block
+                break
+            pos = end + len(b'</Overall-Design>')
+            design = data[start:pos]
+
+        if not block:
+            return design
+
+        # keep what a tag may still start in
+        if start != -1 and end == -1:
+            data = data[start:]
+        else:
+            data = data[max(pos, len(data) - len(b'<Overall-Design>')):]
+
+#
+# Purpose: starts the parse of the sample file of 'expID' on the worker
+#       pool. A file larger than splitSampleBytes, not in the sample cache,
+#       is split at its samples and the parts are parsed by the pool
+# Returns: AsyncResult of loadSampleFile or SplitSampleResult
+# Assumes: Nothing
+# Effects: reads the sample file to split it
+# Throws: Nothing
+#
+
+def startSampleParse(pool, expID):
+
+    samplePath = sampleFile.findSampleFile('%s/%s%s' % (geoDownloads, expID, sampleFileSuffix))
+
+    # a compressed file cannot be read at an offset
+    if samplePath is None or sampleFile.isCompressed(samplePath):
+        size = 0
+    else:
+        size = os.path.getsize(samplePath)
 
-    return sampleList
+    if splitSampleBytes <= 0 or size <= splitSampleBytes:
+        return pool.apply_async(loadSampleFile, (expID,))
+
+    entry = None
+    if sampleFileCache:
+        entry = sampleFileCache.entryPath(samplePath)
+        if entry is not None and os.path.exists(entry):
+            return pool.apply_async(loadSampleFile, (expID,))
+
+    split = splitSampleFile(samplePath, args.jobs)
+    if split is None:
+        return pool.apply_async(loadSampleFile, (expID,))
+
+    (rootTag, rangeList) = split
+    return SplitSampleResult([pool.apply_async(parseSampleRange, \
+        (expID, rootTag, start, end)) for (start, end) in rangeList], entry)
+
+#
+# Purpose: splits a sample file into 'partCount' parts of about the same
+#       size. Each part ends at the end of a Sample element, so it starts
+#       with the state parseSampleFile has after a sample; the text between
+#       two samples stays with the sample after it. The last part runs to
+#       the end of the root element (the Series and its Overall-Design)
+# Returns: tuple (root start tag, [(start offset, end offset), ...]) in
+#       file order, None if the file cannot be split
+# Assumes: Nothing
+# Effects: reads the sample file
+# Throws: Nothing
+#
+
+def splitSampleFile(samplePath, partCount):
+
+    f = open(samplePath, 'rb')
+    if os.fstat(f.fileno()).st_size == 0:
+        f.close()
+        return None
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    rootStart = m.find(b'<MINiML')
+    rootEnd = m.find(b'>', rootStart) + 1
+    closeStart = m.rfind(b'</MINiML>')
+
+    if rootStart == -1 or rootEnd == 0 or closeStart < rootEnd:
+        m.close()
+        f.close()
+        return None
+
+    rootTag = m[rootStart:rootEnd]
+
+    rangeList = []
+    start = rootEnd
+    partBytes = (closeStart - rootEnd) // partCount + 1
+    end = m.find(b'</Sample>', start)
+    while end != -1 and end < closeStart and len(rangeList) < partCount - 1:
+        end += len(b'</Sample>')
+        if end - start >= partBytes:
+            rangeList.append((start, end))
+            start = end
+        end = m.find(b'</Sample>', end)
+    rangeList.append((start, closeStart))
+
+    m.close()
+    f.close()
+
+    if len(rangeList) < 2:
+        return None
+
+    return (rootTag, rangeList)
+
+#
+# Purpose: parses one part of a sample file, see splitSampleFile()
+# Returns: tuple (sampleRecordList, overallDesign) of the part
+# Assumes: Nothing, run in a worker process
+# Effects: reads the sample file
+# Throws: ET.ParseError
+#
+
+def parseSampleRange(expID, rootTag, start, end):
+
+    samplePath = '%s/%s%s' % (geoDownloads, expID, sampleFileSuffix)
+
+    f = open(samplePath, 'rb')
+    f.seek(start)
+    data = f.read(end - start)
+    f.close()
+
+    # the part is parsed inside a copy of the root element, for its namespace
+    reader = SampleFileReader(expID, (rootTag + data + b'</MINiML>').decode('utf-8', 'replace'))
+    sampleRecordList = list(reader)
+
+    return (sampleRecordList, reader.overallDesign)
+
+#
+# Purpose: gets the parsed sample file for 'expID' from the sample cache,
+#       or parses it and adds it to the cache
+# Returns: tuple (parseSampleFile result, 1 if it came from the cache else 0)
+# Assumes: Nothing, may be run in a worker process
+# Effects: reads and writes the sample cache directory
+# Throws: Nothing
+#
+
+def loadSampleFile(expID):
+
+    if sampleFileCache is None:
+        return (parseSampleFile(expID), 0)
+
+    samplePath = sampleFile.findSampleFile('%s/%s%s' % (geoDownloads, expID, sampleFileSuffix))
+    if samplePath is None:
+        return (parseSampleFile(expID), 0)
+    entry = sampleFileCache.entryPath(samplePath)
+
+    result = sampleFileCache.get(entry)
+    if result is not None:
+        return (result, 1)
+
+    result = parseSampleFile(expID)
+    if result[0] == 0:
+        sampleFileCache.put(entry, result)
+
+    return (result, 0)
+
+#
+# Purpose: parses the sample file for 'expID' if it exists
+# Returns: tuple (rc, sampleRecordList, overallDesign, dupIdList)
+#       rc is 1 if the sample file does not exist, else 0
+#       sampleRecordList is a list of Sample, one for each sample
+#       dupIdList is the list of sample IDs seen more than once
+# Assumes: Nothing, may be run in a worker process
+# Effects: reads the file system
+# Throws: Nothing
+#
+
+def parseSampleFile(expID):
+    samplePath = '%s/%s%s' % (geoDownloads, expID, sampleFileSuffix)
+    
+    # if sample file does not exist return 1
+    if sampleFile.findSampleFile(samplePath) is None:
+        return (1, [], '', [])
+
+    reader = SampleFileReader(expID)
+    sampleRecordList = list(reader)
+
+    return (0, sampleRecordList, reader.overallDesign, reader.dupIdList)
 
 #
 # Purpose: creates a string representation of channel metadata in channelList
+#       for the sample parsing reports
 # Returns: empty string if no channels or string of channel data pipe delimited
 #       if two channels
 # Assumes: Nothing
@@ -1009,7 +2081,7 @@ def processSamples(expID, inDb): # inDb 'true' or 'false'
 # Throws: Nothing
 #
 
-def processChannels(channelList): # list of 1 or 2 dictionaries of key/value
+def processChannels(channelList): # tuple of 1 or 2 channels of (key, value)
     # no channels in this sample, return empty string
     if not channelList:
         return ''
@@ -1021,7 +2093,7 @@ def processChannels(channelList): # list of 1 or 2 dictionaries of key/value
         return '%s|||%s' % (string1, string2)
 
 #
-# Purpose: processes one dictionary of channel metadata, delimiting key/value
+# Purpose: processes one channel of metadata, delimiting key/value
 #       with':::', delimiting each key/value with '!!!'
 # Returns: string representing channel metadata for one channel
 # Assumes: Nothing
@@ -1029,16 +2101,15 @@ def processChannels(channelList): # list of 1 or 2 dictionaries of key/value
 # Throws: Nothing
 #
 
-def processOneChannel(channelDict):
+def processOneChannel(channel):
     keyValueList = []
-    for key in channelDict:
-        keyValueList.append('%s:::%s' % (key, channelDict[key]))
+    for (key, value) in channel:
+        keyValueList.append('%s:::%s' % (key, value))
     return '!!!'.join(keyValueList)
 
 #
-# Purpose: parses a list of sample strings for a single experiment
-#       and writes to bcp file for gxd_htrawsample and mgi_keyvalue
-#       for the channel data
+# Purpose: writes the samples of a single experiment to the bcp files
+#       for gxd_htrawsample and mgi_keyvalue for the channel data
 # Returns: 
 # Assumes: Nothing
 # Effects: increments the global raw sample and key value primary keys
@@ -1048,99 +2119,330 @@ def processOneChannel(channelDict):
 def processSampleBcp(sampleList, # list of samples for current experiment
                      nextExptKey): # expt key for samples we are processing
 
-    global nextRawSampleKey, nextKeyValueKey, sampleLoadedCount
-    global curSampleGainLossList, ncSampleGainLossList
-    global lostCt, gainedCt, lostSampleDict, gainedSampleDict
-
-    #
-    # sampleString looks like:
-    # (expID, TAB, sampleID, TAB, description, TAB, title, TAB, sType, 
-    #    TAB, channelString)
-    #
-    # channelString looks like:
-    # '!!!' delim key:value,  '|||' delim channel
-    #
-    inputSampleIdSet = set()
+    inputSampleIdSet = geoIdSet.GeoIdSet('GSM', \
+        [sample.sampleID for sample in sampleList])
     expID = ''
 
     # write experiment to be deleted
     fpSampleDelete.write(deleteTemplate % nextExptKey)
 
-    for sampleString in sampleList:
-        sampleLoadedCount += 1
+    for sample in sampleList:
+        expID = sample.expID
+        writeSampleBcp(sample, nextExptKey)
+
+    processSampleGainLoss(expID, inputSampleIdSet)
+
+    return 0
+
+#
+# Purpose: streams the samples of an experiment with more than maxSamples
+#       samples from its sample file to the bcp files, deletes and reloads
+#       them as processSampleBcp does. Only one sample is parsed at a time,
+#       the rows are written in the batches of the bcp writers
+# Returns: 0
+# Assumes: the sample file exists
+# Effects: reads the sample file, writes the sample parsing reports, the
+#       sample delete file and the bcp files
+# Throws: ET.ParseError
+#
+
+def processSampleStream(experiment, # experiment with > maxSamples samples
+                        exptKey,    # expt key for samples we are processing
+                        inDb):      # 'true' or 'false'
+
+    global duplicatedSampleIdDict
+
+    expID = experiment.expID
+    inputSampleIdSet = geoIdSet.GeoIdSet('GSM')
+
+    # write experiment to be deleted
+    fpSampleDelete.write(deleteTemplate % exptKey)
+
+    reader = SampleFileReader(expID)
+    for sample in reader:
+        if inDb == 'true':
+            fpSampInDbParsingFile.write('%s%s' % (sample.reportString(), CRT))
+        elif runParsingReports == 'true':
+            fpSampParsingFile.write('%s%s' % (sample.reportString(), CRT))
+
+        inputSampleIdSet.add(sample.sampleID)
+        writeSampleBcp(sample, exptKey)
+
+    for sampleID in reader.dupIdList:
+        if expID not in duplicatedSampleIdDict:
+            duplicatedSampleIdDict[expID] = []
+        duplicatedSampleIdDict[expID].append(sampleID)
+
+    processSampleGainLoss(expID, inputSampleIdSet)
+
+    return 0
+
+#
+# Purpose: writes the raw sample and key value rows of one sample
+# Returns: Nothing
+# Assumes: Nothing
+# Effects: writes to the raw sample and key value bcp files, increments
+#       the global raw sample primary key
+# Throws: Nothing
+#
+
+def writeSampleBcp(sample, exptKey):
+
+    global nextRawSampleKey, sampleLoadedCount
+
+    sampleLoadedCount += 1
+    if DEBUG == 'true':
+        print('sampleString: %s' % sample.reportString())
+
+    # write to fpSampleBcp here
+    fpSampleBcp.write(nextRawSampleKey, exptKey, sample.sampleID)
+
+    for (key, value, seqNum) in sampleKeyValues(sample):
+        writeKeyValueBcp(nextRawSampleKey, key, value, seqNum)
+
+    # increment the sample key, multiple samples/experiment
+    nextRawSampleKey += 1
+
+#
+# Purpose: queues the samples of an experiment in the database to be
+#       compared with the database, see applySampleDiffs()
+# Returns: 0
+# Assumes: Nothing
+# Effects: applies the queued experiments when the batch is full
+# Throws: Nothing
+#
+
+def processSampleDiff(sampleList, # list of samples for current experiment
+                      exptKey):   # key of the experiment in the database
+
+    inputSampleIdSet = geoIdSet.GeoIdSet('GSM', \
+        [sample.sampleID for sample in sampleList])
+    inputSampleList = []
+    expID = ''
+
+    for sample in sampleList:
         if DEBUG == 'true':
-            print('sampleString: %s' % sampleString)
+            print('sampleString: %s' % sample.reportString())
+
+        expID = sample.expID
+        inputSampleList.append((sample.sampleID, sampleKeyValues(sample)))
+
+    sampleDiffList.append((expID, exptKey, inputSampleList))
+
+    processSampleGainLoss(expID, inputSampleIdSet)
+
+    if len(sampleDiffList) >= diffBatchSize:
+        applySampleDiffs()
+
+    return 0
+
+#
+# Purpose: compares the queued experiments with the raw samples and
+#       key/values in the database. Samples not in the input and
+#       key/values that changed are deleted by key, new samples and
+#       changed key/values are inserted, everything else is kept
+# Returns: 0
+# Assumes: Nothing
+# Effects: queries the database, writes to the sample delete file and the
+#       raw sample and key value bcp files, increments the global raw
+#       sample and key value primary keys, empties sampleDiffList
+# Throws: Nothing
+#
+
+def applySampleDiffs():
+
+    global nextRawSampleKey, sampleLoadedCount, sampleDiffList
+    global diffSampleDeletedCount, diffSampleChangedCount, diffSampleKeptCount
+    global diffKeyValueAddedCount, diffKeyValueDeletedCount
+
+    if not sampleDiffList:
+        return 0
 
-        expID, sampleID, description, title, sType, channelString = str.split(sampleString, TAB) 
+    # {exptKey: {sampleID: [rawSampleKey, ...]}, ...}
+    dbSampleDict = {}
+    # {rawSampleKey: {(key, value, seqNum): [keyValueKey, ...]}, ...}
+    dbKeyValueDict = {}
 
-        inputSampleIdSet.add(sampleID)
+    results = db.sql('''select rs._experiment_key, rs._rawsample_key, rs.accid,
+            kv._keyvalue_key, kv.key, kv.value, kv.sequencenum
+        from GXD_HTRawSample rs
+        left outer join MGI_KeyValue kv on (rs._rawsample_key = kv._object_key
+            and kv._mgitype_key = %s)
+        where rs._experiment_key in (%s)
+        order by rs._rawsample_key, kv._keyvalue_key''' % \
+            (rawSampleMgiTypeKey, ','.join([str(e[1]) for e in sampleDiffList])), 'auto')
 
-        # write to fpSampleBcp here
-        fpSampleBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextRawSampleKey, TAB, nextExptKey, TAB, sampleID, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
+    for r in results:
+        rawSampleKey = r['_rawsample_key']
+        if rawSampleKey not in dbKeyValueDict:
+            dbKeyValueDict[rawSampleKey] = {}
+            dbSampleDict.setdefault(r['_experiment_key'], {}).setdefault(r['accid'], []).append(rawSampleKey)
+        if r['_keyvalue_key'] is not None:
+            dbKeyValueDict[rawSampleKey].setdefault((r['key'], r['value'], r['sequencenum']), []).append(r['_keyvalue_key'])
+
+    deleteSampleList = []
+    deleteKeyValueList = []
+
+    for (expID, exptKey, inputSampleList) in sampleDiffList:
+        expSampleDict = dbSampleDict.get(exptKey, {})
+
+        for (sampleID, keyValueList) in inputSampleList:
+
+            # new sample, insert it and all its key/values
+            if not expSampleDict.get(sampleID):
+                fpSampleBcp.write(nextRawSampleKey, exptKey, sampleID)
+                for (key, value, seqNum) in keyValueList:
+                    writeKeyValueBcp(nextRawSampleKey, key, value, seqNum)
+                diffKeyValueAddedCount += len(keyValueList)
+                sampleLoadedCount += 1
+                nextRawSampleKey += 1
+                continue
+
+            # sample in the database, the key/values are compared as they
+            # are stored, i.e. after bcp has unescaped them
+            rawSampleKey = expSampleDict[sampleID].pop(0)
+            dbKeyValues = dbKeyValueDict[rawSampleKey]
+            changed = 0
+
+            for (key, value, seqNum) in keyValueList:
+                keyList = dbKeyValues.get((copyUnescape(key), copyUnescape(value), seqNum))
+                if keyList:
+                    keyList.pop(0)
+                else:
+                    writeKeyValueBcp(rawSampleKey, key, value, seqNum)
+                    diffKeyValueAddedCount += 1
+                    changed = 1
+
+            for keyList in dbKeyValues.values():
+                deleteKeyValueList += keyList
+                diffKeyValueDeletedCount += len(keyList)
+                if keyList:
+                    changed = 1
+
+            if changed:
+                diffSampleChangedCount += 1
+            else:
+                diffSampleKeptCount += 1
+
+        # samples in the database not in the input
+        for keyList in expSampleDict.values():
+            deleteSampleList += keyList
+            diffSampleDeletedCount += len(keyList)
+
+    for key in deleteSampleList:
+        fpSampleDelete.write(rawSampleDeleteTemplate % key)
+    for key in deleteKeyValueList:
+        fpSampleDelete.write(keyValueDeleteTemplate % key)
+
+    sampleDiffList = []
+
+    return 0
+
+#
+# Purpose: undoes the escaping bcp (postgres copy text format) applies
+#       to a column value
+# Returns: 'text' as it is stored in the database
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
+
+def copyUnescape(text):
+
+    if '\\' not in text:
+        return text
+
+    def unescape(match):
+        c = match.group(1)
+        if c in copyEscapeDict:
+            return copyEscapeDict[c]
+        if c[0] == 'x' and len(c) > 1:
+            return chr(int(c[1:], 16))
+        if c[0] in '01234567':
+            return chr(int(c, 8) & 0xff)
+        return c
+
+    return re.sub(r'\\(x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.)', unescape, text, flags=re.S)
+
+#
+# Purpose: builds the MGI_KeyValue rows of one sample
+# Returns: list of (key, value, seqNum), key and value as written to the
+#       bcp file
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
 
-        channels = str.split(channelString, '|||')
-        seqNum = 1 # there can be 1 or 2 channels, data for each channel
-                   # distinguished by seqNum
+def sampleKeyValues(sample):
 
-        # write out key/value for description, title and sType
-        if description != None and description != '':
-            fpKeyValueBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextKeyValueKey, TAB, nextRawSampleKey, TAB, rawSampleMgiTypeKey, TAB, 'description', TAB, description, TAB, seqNum, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
-            nextKeyValueKey += 1
-        if title != None and title != '':
-            fpKeyValueBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextKeyValueKey, TAB, nextRawSampleKey, TAB, rawSampleMgiTypeKey, TAB, 'title', TAB, title, TAB, seqNum, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
-            nextKeyValueKey += 1
-        if sType != None and sType != '':
-            fpKeyValueBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextKeyValueKey, TAB, nextRawSampleKey, TAB, rawSampleMgiTypeKey, TAB, 'sType', TAB, sType, TAB, seqNum, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
-            nextKeyValueKey += 1
+    keyValueList = []
 
-        for channel in channels:
-            tokens = str.split(channel, '!!!')
+    seqNum = 1 # there can be 1 or 2 channels, data for each channel
+               # distinguished by seqNum
+
+    # write out key/value for description, title and sType
+    if sample.description != None and sample.description != '':
+        keyValueList.append(('description', sample.description, seqNum))
+    if sample.title != None and sample.title != '':
+        keyValueList.append(('title', sample.title, seqNum))
+    if sample.sType != None and sample.sType != '':
+        keyValueList.append(('sType', sample.sType, seqNum))
+
+    for channel in sample.channelList:
+        for (key, value) in channel:
+            # escape, em-dash to two en-dash, non-ascii characters to '?'
+            value_decode = textNormalize.escapeKeyValue(value)
+            key_decode = textNormalize.escapeKeyValue(key)
+
+            if value_decode == '-' or value_decode == '' or value_decode is None:
+                value_decode = '--'
             
-            for keyValue in tokens:
-                key, value = str.split(keyValue, ':::')
-                value = value.replace('\\', '\\\\')
-                value = value.replace('#', '\#')
-                value = value.replace('?', '\?')
-                value = value.replace('\n', '\\n')
-                key = key.replace('\\', '\\\\')
-                key = key.replace('#', '\#')
-                key = key.replace('?', '\?')
-                key = key.replace('\n', '\\n')
-
-                # replace em-dash(unicode) with two en-dash
-                value = value.replace(b'\xe2\x80\x94'.decode('utf-8'), '--')
-                key = key.replace(b'\xe2\x80\x94'.decode('utf-8'), '--')
-
-                # this removes non-ascii characters; 
-                # 'replace' replaces with '?'
-                value_encode = value.encode('ascii', 'replace')
-                key_encode = key.encode('ascii', 'replace')
-
-                value_decode = value_encode.decode()
-                key_decode = key_encode.decode()
-
-                if value_decode == '-' or value_decode == '' or value_decode is None:
-                    value_decode = '--'
-                
-                # write to fpKeyValueBcp here
-                fpKeyValueBcp.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextKeyValueKey, TAB, nextRawSampleKey, TAB, rawSampleMgiTypeKey, TAB, key_decode, TAB, value_decode, TAB, seqNum, TAB, userKey, TAB, userKey, TAB, loadDate, TAB, loadDate, CRT))
-                nextKeyValueKey += 1     
-            # increment, there may be a second channel
-            seqNum += 1 
+            keyValueList.append((key_decode, value_decode, seqNum))
+        # increment, there may be a second channel
+        seqNum += 1 
+
+    return keyValueList
+
+#
+# Purpose: writes one MGI_KeyValue row for a raw sample
+# Returns: Nothing
+# Assumes: Nothing
+# Effects: writes to the key value bcp file, increments the global key
+#       value primary key
+# Throws: Nothing
+#
 
-        # increment the sample key, multiple samples/experiment
-        nextRawSampleKey += 1
+def writeKeyValueBcp(rawSampleKey, key, value, seqNum):
+
+    global nextKeyValueKey
+
+    fpKeyValueBcp.write(nextKeyValueKey, rawSampleKey, rawSampleMgiTypeKey, key, value, seqNum)
+    nextKeyValueKey += 1     
+
+#
+# Purpose: compares the sample IDs of an experiment in the input with
+#       those in the database for the curation QC report
+# Returns: 0
+# Assumes: Nothing
+# Effects: updates the global gained/lost sample lists and counts
+# Throws: Nothing
+#
+
+def processSampleGainLoss(expID, inputSampleIdSet):
+
+    global curSampleGainLossList, ncSampleGainLossList
+    global lostCt, gainedCt, lostSampleDict, gainedSampleDict
 
     if expID in curatedExptDict:
 
-        dbSampleIdSet = set(curatedExptDict[expID])
+        dbSampleIdSet = curatedExptDict[expID]
 
         # input rs not in database
         gainedSet = inputSampleIdSet.difference(dbSampleIdSet)
 
         # for debugging
         if expID not in gainedSampleDict:
-            gainedSampleDict[expID] = set()
+            gainedSampleDict[expID] = geoIdSet.GeoIdSet('GSM')
         gainedSampleDict[expID] = gainedSampleDict[expID].union(gainedSet)
 
         # db rs not in input
@@ -1148,7 +2450,7 @@ def processSampleBcp(sampleList, # list of samples for current experiment
 
         # for debugging
         if expID not in lostSampleDict:
-            lostSampleDict[expID] = set()
+            lostSampleDict[expID] = geoIdSet.GeoIdSet('GSM')
         lostSampleDict[expID] = lostSampleDict[expID].union(lostSet)
 
         if lostSet or gainedSet:
@@ -1161,14 +2463,14 @@ def processSampleBcp(sampleList, # list of samples for current experiment
     else:
         if expID in nonCuratedExptDict:
             
-            dbSampleIdSet = set(nonCuratedExptDict[expID])
+            dbSampleIdSet = nonCuratedExptDict[expID]
 
             # input rs not in database
             gainedSet = inputSampleIdSet.difference(dbSampleIdSet)
             
             # for debugging
             if expID not in gainedSampleDict:
-                gainedSampleDict[expID] = set()
+                gainedSampleDict[expID] = geoIdSet.GeoIdSet('GSM')
             gainedSampleDict[expID] = gainedSampleDict[expID].union(gainedSet)
 
             # db rs not in input
@@ -1176,17 +2478,17 @@ def processSampleBcp(sampleList, # list of samples for current experiment
 
             # for debugging
             if expID not in lostSampleDict:
-                lostSampleDict[expID] = set()
+                lostSampleDict[expID] = geoIdSet.GeoIdSet('GSM')
             lostSampleDict[expID] = lostSampleDict[expID].union(lostSet)
 
-            if lostSet or gainedSet:
+            # an empty set, the experiment had no raw samples in the db
+            if lostSet or gainedSet or not dbSampleIdSet:
                lostCt += len(lostSet)
                gainedCt += len(gainedSet) 
                gainString = ', '.join(str(s) for s in gainedSet)
                lostString = ', '.join(str(s) for s in lostSet)
-               if lostString == 'None':
+               if not dbSampleIdSet:
                    lostString = 'Experiment had no samples prior'
-                   lostCt -= 1 # deduct 1 as 'None' was counted above
                line = '%s%s%s%s%s' % (expID, TAB, gainString, TAB, lostString)
                
                ncSampleGainLossList.append(line)
@@ -1241,16 +2543,33 @@ def writeQC():
         (exptLoadedCount, CRT, CRT))
 
     fpQcFile.write('* Number experiments, already in DB: %s%s%s' % \
-        (len(geoExptInDbDict), CRT, CRT))
+        (geoExptInDbCount, CRT, CRT))
+
+    if fpExptStateFile:
+        fpQcFile.write('* Number experiments in DB skipped, unchanged since the last load: %s%s%s' % \
+            (expUnchangedCount, CRT, CRT))
+
+    fpQcFile.write('* Number experiments in DB with samples not reloaded, sample IDs unchanged: %s%s%s' % \
+        (expSamplesUnchangedCount, CRT, CRT))
 
     fpQcFile.write('* Number of raw samples loaded: %s%s%s' % \
         (sampleLoadedCount, CRT, CRT))
 
+    if diffSampleReload == 'true':
+        fpQcFile.write('* Experiments in DB, raw samples kept: %s changed: %s deleted: %s, key/values inserted: %s deleted: %s%s%s' % \
+            (diffSampleKeptCount, diffSampleChangedCount, diffSampleDeletedCount, diffKeyValueAddedCount, diffKeyValueDeletedCount, CRT, CRT))
+
     fpQcFile.write('* Number experiments that have > max samples, samples not loaded: %s%s%s' % \
         (len(expMaxSamplesSet), CRT, CRT))
     for id in expMaxSamplesSet:
         fpQcFile.write('    %s%s' %  (id, CRT))
 
+    if streamSamples == 'true':
+        fpQcFile.write('* Number experiments that have > max samples, samples streamed: %s%s%s' % \
+            (len(expStreamedSet), CRT, CRT))
+        for id in expStreamedSet:
+            fpQcFile.write('    %s%s' %  (id, CRT))
+
     fpQcFile.write('* Number experiments skipped, not already in db. Type not in translation: %s%s%s' % \
         (len(expSkippedNotInDbNoTransSet), CRT, CRT))
 
@@ -1267,6 +2586,10 @@ def writeQC():
 
     fpQcFile.write('* Number experiments with updated PubMed ID properties: %s%s%s' % (len(updateExptList), CRT, CRT))
 
+    if sampleFileCache:
+        fpQcFile.write('* Sample files read from the sample cache: %s, parsed: %s, hit rate: %s%s%s' % \
+            (sampleFileCache.hits, sampleFileCache.misses, sampleCache.rate(sampleFileCache.hits, sampleFileCache.misses), CRT, CRT))
+
     fpQcFile.write('* Number experiments with duplicated sample IDs: %s%s%s' % (len(duplicatedSampleIdDict), CRT, CRT))
     for eId in duplicatedSampleIdDict:
         sIds = ', '.join(duplicatedSampleIdDict[eId])
@@ -1301,8 +2624,40 @@ def closeFiles():
 
     fpSampleDelete.close()
 
+    if fpExptStateFile:
+        fpExptStateFile.close()
+
+    return 0
+
+# Purpose: commits the COPY load, called only once the run has succeeded
+# Returns: 1 if the load failed and was rolled back, else 0
+# Assumes: closeFiles() has been called
+# Effects: writes to the database
+# Throws: Nothing
+#
+def commitCopy():
+
+    if copyLoader:
+        try:
+            copyLoader.close(pgCopy.SETVAL_SQL)
+        except Exception as e:
+            print('COPY load failed: %s' % e)
+            return 1
+
     return 0
 
+# Purpose: rolls back the COPY load of a failed run
+# Returns: nothing
+# Assumes: closeFiles() has been called
+# Effects: rolls back the database transaction
+# Throws: Nothing
+#
+def abortCopy():
+
+    if copyLoader:
+        print('COPY load rolled back')
+        copyLoader.abort()
+
 #
 # main
 #
@@ -1314,13 +2669,20 @@ if initialize() != 0:
 if processAll() != 0:
     print("geo_htload failed during processing")
     closeFiles()
+    abortCopy()
     sys.exit(1)
 
 if writeQC() != 0:
     print("geo_htload failed writing QC")
     closeFiles()
+    abortCopy()
     sys.exit(1)
 
 if closeFiles() != 0:
     print("geo_htload failed closing files")
+    abortCopy()
+    sys.exit(1)
+
+if commitCopy() != 0:
+    print("geo_htload failed loading")
     sys.exit(1)
@@ -140,64 +140,47 @@ ${PYTHON} -W ignore::SyntaxWarning ${GXDHTLOAD}/bin/geo_htload.py >> ${LOG_DIAG}
 STAT=$?
 checkStatus ${STAT} "${GXDHTLOAD}/bin/geo_htload.py"
 
+#
+# LOAD_BACKEND=copy: geo_htload.py has already deleted the samples, loaded
+# the tables and updated the sequences, see pgCopy.py
+#
+if [ "${LOAD_BACKEND}" != "copy" ]
+then
+
 #
 # Do Deletes
 #
 # check for empty file
-# execute sql file
+# bulk delete the keys in the delete file, in one transaction
 if [ -s "${DELETE_FILENAME}" ]
 then
     echo "" >> ${LOG_DIAG}
     date >> ${LOG_DIAG}
     echo 'Deleting Raw Samples'  >> ${LOG_DIAG}
-    psql -U${MGD_DBUSER} -h${MGD_DBSERVER} -d${MGD_DBNAME} -f ${DELETE_FILENAME} -e >> ${LOG_DIAG} 2>&1
+    ${PYTHON} ${GXDHTLOAD}/bin/deleteSamples.py >> ${LOG_DIAG} 2>&1
+    STAT=$?
+    checkStatus ${STAT} "${GXDHTLOAD}/bin/deleteSamples.py"
 fi
 
 #
-# run BCP
+# run BCP, tables that do not depend on each other are loaded in parallel
 #
 
-date >> ${LOG_DIAG}
-echo "Load GXD_HTExperiment" | tee -a ${LOG_DIAG}
-${PG_DBUTILS}/bin/bcpin.csh ${MGD_DBSERVER} ${MGD_DBNAME} GXD_HTExperiment ${OUTPUTDIR} GXD_HTExperiment.bcp "\t" "\n" mgd
-date >> ${LOG_DIAG}
-
-echo "" >> ${LOG_DIAG}
-date >> ${LOG_DIAG}
-echo "Load ACC_Accession" | tee -a ${LOG_DIAG}
-${PG_DBUTILS}/bin/bcpin.csh ${MGD_DBSERVER} ${MGD_DBNAME} ACC_Accession ${OUTPUTDIR} ACC_Accession.bcp "\t" "\n" mgd
-date >> ${LOG_DIAG}
-
-echo "" >> ${LOG_DIAG}
-date >> ${LOG_DIAG}
-echo "Load GXD_HTExperimentVariable" | tee -a ${LOG_DIAG}
-${PG_DBUTILS}/bin/bcpin.csh ${MGD_DBSERVER} ${MGD_DBNAME} GXD_HTExperimentVariable ${OUTPUTDIR} GXD_HTExperimentVariable.bcp "\t" "\n" mgd
-date >> ${LOG_DIAG}
-
-echo "" >> ${LOG_DIAG}
-date >> ${LOG_DIAG}
-echo "Load MGI_Property" | tee -a ${LOG_DIAG}
-${PG_DBUTILS}/bin/bcpin.csh ${MGD_DBSERVER} ${MGD_DBNAME} MGI_Property ${OUTPUTDIR} MGI_Property.bcp "\t" "\n" mgd
-date >> ${LOG_DIAG}
-
-echo "" >> ${LOG_DIAG}
-date >> ${LOG_DIAG}
-echo "Load GXD_HTRawSample" | tee -a ${LOG_DIAG}
-${PG_DBUTILS}/bin/bcpin.csh ${MGD_DBSERVER} ${MGD_DBNAME} GXD_HTRawSample ${OUTPUTDIR} GXD_HTRawSample.bcp "\t" "\n" mgd
-date >> ${LOG_DIAG}
-
 echo "" >> ${LOG_DIAG}
 date >> ${LOG_DIAG}
-echo "Load MGI_KeyValue" | tee -a ${LOG_DIAG}
-${PG_DBUTILS}/bin/bcpin.csh ${MGD_DBSERVER} ${MGD_DBNAME} MGI_KeyValue ${OUTPUTDIR} MGI_KeyValue.bcp "\t" "\n" mgd
+echo "Load bcp files" | tee -a ${LOG_DIAG}
+${PYTHON} ${GXDHTLOAD}/bin/loadBcp.py >> ${LOG_DIAG} 2>&1
+STAT=$?
+checkStatus ${STAT} "${GXDHTLOAD}/bin/loadBcp.py"
 date >> ${LOG_DIAG}
 
 #
 # Update autosequence
 # 
 
+# ON_ERROR_STOP so that a failed setval gives a non-zero exit status
 echo "Updating auto-sequence" >>  ${LOG_DIAG}
-cat - <<EOSQL | psql -h${MGD_DBSERVER} -d${MGD_DBNAME} -U mgd_dbo -e >> ${LOG_DIAG} 2>&1
+cat - <<EOSQL | psql -h${MGD_DBSERVER} -d${MGD_DBNAME} -U mgd_dbo -v ON_ERROR_STOP=1 -e >> ${LOG_DIAG} 2>&1
 
 select setval('gxd_htexperiment_seq', (select max(_Experiment_key) from GXD_HTExperiment)) 
 ;
@@ -215,6 +198,19 @@ select setval('mgi_property_seq', (select max(_Property_key) from MGI_Property))
 ;
 
 EOSQL
+STAT=$?
+checkStatus ${STAT} "Updating auto-sequence"
+
+fi
+
+#
+# The load succeeded, save the experiment fingerprints for the next run
+#
+if [ "${EXPT_STATE_FILE}" != "" -a -f "${EXPT_STATE_FILE}.new" ]
+then
+    echo "Saving experiment fingerprints" >> ${LOG_DIAG}
+    mv -f ${EXPT_STATE_FILE}.new ${EXPT_STATE_FILE}
+fi
 
 #
 # Run the classifier
@@ -0,0 +1,409 @@
+'''
+#
+# httpClient.py
+#
+# HTTP/HTTPS client of the mirror scripts (mirror_geo_sample.py,
+# mirror_ae.py, mirror_geo_exp.sh), in place of a wget process a url
+#
+# Connections are kept open (keep-alive) and reused, an idle pool per
+# scheme, host and port, so a run pays the TCP connect and TLS handshake
+# once a host and thread rather than once a url. A connection the server
+# has closed while idle is replaced and the request sent again.
+# Downloads are streamed to <file>.tmp and renamed over the file once
+# complete; a file is only written for a 200 response. Redirects are
+# followed.
+#
+# Each request's latency (request sent to response headers read) is kept;
+# report() gives their count, mean, median and 95th percentile and the
+# connections opened.
+#
+# Usage:
+#       httpClient.py [-a log] -O file url
+#       httpClient.py [-a log] [--rate N] --list file
+#       httpClient.py --benchmark url [--requests N]
+#
+#       -O          downloads url to file, as wget -O
+#       --list      downloads each "file<TAB>url" line of file, in order,
+#                   on the same connections
+#       --rate      at most N requests/sec of the --list downloads
+#       -a          appends the requests and the report to log, as wget -a
+#       --benchmark per-request latency of N downloads of url with a
+#                   wget process each and with the client
+#
+#       Exits 1 if a download fails
+#
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+import email.utils
+
+TAB = '\t'
+CRT = '\n'
+
+# seconds to wait for a server
+TIMEOUT = 60
+
+# redirects followed before giving up
+MAX_REDIRECTS = 5
+
+# bytes read and written at a time
+READ_BYTES = 1048576
+
+USER_AGENT = 'gxdhtload-mirror'
+
+class HttpClient:
+    # Is: a pool of keep-alive connections
+    # Has: the idle connections by (scheme, host, port), the latency of
+    #       each request, the connections opened
+    # Does: head(), download(), report(); may be shared by threads
+    #
+    def __init__ (self, timeout=TIMEOUT):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        self.timeout = timeout
+        self.idleDict = {}   # (scheme, host, port): list of connections
+        self.lock = threading.Lock()
+        self.latencyList = []
+        self.connections = 0
+
+    def _connect(self, key):
+        # Purpose: gets an idle connection to 'key', or opens one
+        # Returns: tuple (connection, 1 if it was idle)
+        # Assumes: nothing
+        # Effects: nothing, the connection is opened by its first request
+        # Throws: nothing
+        with self.lock:
+            idleList = self.idleDict.get(key)
+            if idleList:
+                return (idleList.pop(), 1)
+            self.connections += 1
+
+        (scheme, host, port) = key
+        if scheme == 'https':
+            return (http.client.HTTPSConnection(host, port, timeout=self.timeout), 0)
+        return (http.client.HTTPConnection(host, port, timeout=self.timeout), 0)
+
+    def _release(self, key, conn, response):
+        # Purpose: returns a connection to the pool once its response is
+        #       read, closes it if the server will close it
+        # Returns: nothing
+        # Assumes: the response has been read to the end
+        # Effects: nothing
+        # Throws: nothing
+        if response.will_close:
+            conn.close()
+            return
+        with self.lock:
+            self.idleDict.setdefault(key, []).append(conn)
+
+    def _request(self, method, url, headerDict):
+        # Purpose: sends a request, following redirects
+        # Returns: tuple (key, connection, response) with the response
+        #       headers read
+        # Assumes: nothing
+        # Effects: sends the request, counts its latency
+        # Throws: OSError, http.client.HTTPException if there is no
+        #       response, ValueError if the url is not http or https
+        for redirect in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise ValueError('not an http or https url: %s' % url)
+            key = (parts.scheme, parts.hostname, parts.port)
+            path = parts.path or '/'
+            if parts.query:
+                path = '%s?%s' % (path, parts.query)
+            headers = {'User-Agent': USER_AGENT}
+            headers.update(headerDict or {})
+
+            while True:
+                (conn, idle) = self._connect(key)
+                startTime = time.time()
+                try:
+                    conn.request(method, path, headers=headers)
+                    response = conn.getresponse()
+                    break
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    # the server closed the idle connection, try a new one
+                    if idle:
+                        continue
+                    raise
+
+            with self.lock:
+                self.latencyList.append(time.time() - startTime)
+
+            if response.status not in (301, 302, 303, 307, 308) or \
+                    response.getheader('Location') is None:
+                return (key, conn, response)
+
+            response.read()
+            self._release(key, conn, response)
+            url = urllib.parse.urljoin(url, response.getheader('Location'))
+            if response.status == 303:
+                method = 'GET'
+
+        raise http.client.HTTPException('too many redirects: %s' % url)
+
+    def head(self, url, headerDict=None):
+        # Purpose: sends a HEAD request
+        # Returns: tuple (status, headers); headers is an
+        #       http.client.HTTPMessage
+        # Assumes: nothing
+        # Effects: a request
+        # Throws: see _request()
+        (key, conn, response) = self._request('HEAD', url, headerDict)
+        response.read()
+        self._release(key, conn, response)
+        return (response.status, response.headers)
+
+    def download(self, url, path, headerDict=None):
+        # Purpose: downloads 'url' to 'path'
+        # Returns: tuple (status, bytes written, headers); only a 200
+        #       response is written
+        # Assumes: nothing
+        # Effects: writes <path>.tmp and renames it to 'path'
+        # Throws: see _request(), IOError; 'path' is not changed if the
+        #       download fails
+        (key, conn, response) = self._request('GET', url, headerDict)
+
+        if response.status != 200:
+            response.read()
+            self._release(key, conn, response)
+            return (response.status, 0, response.headers)
+
+        tmpPath = '%s.tmp' % path
+        size = 0
+        try:
+            with open(tmpPath, 'wb') as fp:
+                while True:
+                    block = response.read(READ_BYTES)
+                    if not block:
+                        break
+                    fp.write(block)
+                    size += len(block)
+            length = response.getheader('Content-Length')
+            if length is not None and length.isdigit() and int(length) != size:
+                raise http.client.IncompleteRead(b'', int(length) - size)
+            os.replace(tmpPath, path)
+        except:
+            conn.close()
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
+        self._release(key, conn, response)
+        return (response.status, size, response.headers)
+
+    def close(self):
+        # Purpose: closes the idle connections
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: closes connections
+        # Throws: nothing
+        with self.lock:
+            for idleList in self.idleDict.values():
+                for conn in idleList:
+                    conn.close()
+            self.idleDict = {}
+
+    def report(self):
+        # Purpose: summarizes the requests so far
+        # Returns: str
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        with self.lock:
+            latencyList = sorted(self.latencyList)
+            connections = self.connections
+        if not latencyList:
+            return 'http: 0 requests'
+        n = len(latencyList)
+        return 'http: %s requests on %s connections, latency mean %.1f ms, median %.1f ms, 95%% %.1f ms' % \
+            (n, connections, 1000 * sum(latencyList) / n, 1000 * latencyList[n // 2], \
+            1000 * latencyList[min(n - 1, int(n * 0.95))])
+
+# end class HttpClient -----------------------------------------
+
+class RateLimiter:
+    # Is: a token bucket limiting the requests of all download threads,
+    #       e.g. to the NCBI request rate
+    # Has: the requests per second, the tokens, the time they were counted
+    # Does: acquire()
+    #
+    def __init__ (self, rate, capacity=1):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: rate > 0; capacity 1 spaces the requests 1/rate apart
+        # Effects: nothing
+        # Throws: nothing
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.lastTime = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Purpose: waits for a token and takes it
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: sleeps the calling thread
+        # Throws: nothing
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.lastTime) * self.rate)
+                self.lastTime = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# end class RateLimiter -----------------------------------------
+
+#
+# Purpose: the wait a 429 or 503 response asks for in its Retry-After
+#       header, given in seconds or as an http date
+# Returns: seconds, float >= 0; None if there is no valid Retry-After
+# Assumes: nothing
+# Effects: nothing
+# Throws: nothing
+#
+
+def retryAfter(headers):
+
+    if headers is None:
+        return None
+    value = (headers.get('Retry-After') or '').strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+#
+# Purpose: downloads each (file, url) of 'downloadList' in order, at most
+#       'rate' requests/sec if 'rate' is not 0
+# Returns: 0 if all were downloaded, else 1
+# Assumes: nothing
+# Effects: writes the files, writes to 'fpLog'
+# Throws: nothing
+#
+
+def downloadAll(downloadList, fpLog, rate=0):
+
+    client = HttpClient()
+    limiter = None
+    if rate > 0:
+        limiter = RateLimiter(rate)
+    rc = 0
+    for (path, url) in downloadList:
+        if limiter:
+            limiter.acquire()
+        startTime = time.time()
+        try:
+            (status, size, headers) = client.download(url, path)
+            message = '%s %s bytes' % (status, size)
+        except Exception as e:
+            status = None
+            message = 'failed: %s' % e
+        fpLog.write('%s -> %s: %s, %.2f seconds%s' % (url, path, message, time.time() - startTime, CRT))
+        if status != 200:
+            rc = 1
+    fpLog.write('%s%s' % (client.report(), CRT))
+    client.close()
+    return rc
+
+#
+# Purpose: times the downloads of 'url' with a wget process each and with
+#       an HttpClient
+# Returns: nothing
+# Assumes: wget is on the PATH
+# Effects: writes a temporary file and to stdout
+# Throws: nothing
+#
+
+def benchmark(url, requests):
+
+    (fd, path) = tempfile.mkstemp()
+    os.close(fd)
+
+    latencyList = []
+    startTime = time.time()
+    for i in range(requests):
+        t = time.time()
+        subprocess.run(['wget', '-q', '-O', path, url])
+        latencyList.append(time.time() - t)
+    wgetTime = time.time() - startTime
+    latencyList.sort()
+    print('wget:       %s requests, %.2f s, per request mean %.1f ms, median %.1f ms, 95%% %.1f ms' % \
+        (requests, wgetTime, 1000 * wgetTime / requests, 1000 * latencyList[requests // 2], \
+        1000 * latencyList[min(requests - 1, int(requests * 0.95))]))
+
+    client = HttpClient()
+    latencyList = []
+    startTime = time.time()
+    for i in range(requests):
+        t = time.time()
+        client.download(url, path)
+        latencyList.append(time.time() - t)
+    clientTime = time.time() - startTime
+    latencyList.sort()
+    print('HttpClient: %s requests, %.2f s, per request mean %.1f ms, median %.1f ms, 95%% %.1f ms' % \
+        (requests, clientTime, 1000 * clientTime / requests, 1000 * latencyList[requests // 2], \
+        1000 * latencyList[min(requests - 1, int(requests * 0.95))]))
+    print(client.report())
+    client.close()
+    os.remove(path)
+
+#
+# main
+#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='pooled http/https downloads')
+    parser.add_argument('-O', dest='output', help='file to download url to')
+    parser.add_argument('--list', help='file of "file<TAB>url" lines to download')
+    parser.add_argument('--rate', type=float, default=0,
+        help='requests/sec of the --list downloads, 0 for no limit')
+    parser.add_argument('-a', dest='log', help='log file to append to')
+    parser.add_argument('--benchmark', action='store_true',
+        help='per-request latency with wget and with the client')
+    parser.add_argument('--requests', type=int, default=100,
+        help='requests of the benchmark')
+    parser.add_argument('url', nargs='?')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.url, args.requests)
+        sys.exit(0)
+
+    downloadList = []
+    if args.output and args.url:
+        downloadList.append((args.output, args.url))
+    if args.list:
+        with open(args.list, 'r') as fp:
+            for line in fp:
+                if line.strip():
+                    downloadList.append(tuple(line.rstrip(CRT).split(TAB, 1)))
+
+    fpLog = sys.stderr
+    if args.log:
+        fpLog = open(args.log, 'a')
+    rc = downloadAll(downloadList, fpLog, args.rate)
+    if args.log:
+        fpLog.close()
+
+    sys.exit(rc)
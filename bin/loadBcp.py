@@ -0,0 +1,153 @@
+'''
+#
+# loadBcp.py
+#
+# Loads the bcp files of geo_htload.py and ae_htload.py with bcpin.csh,
+# running the loads of independent tables at the same time
+#
+# The foreign keys between the tables make a small DAG:
+#
+#       GXD_HTExperiment
+#           ACC_Accession
+#           GXD_HTExperimentVariable
+#           MGI_Property
+#           GXD_HTRawSample
+#               MGI_KeyValue
+#
+# A table is loaded once the tables it depends on are loaded; up to
+# LOAD_JOBS bcpin.csh run at a time, each on its own connection. If a load
+# fails the tables that depend on it are not loaded. The output of each
+# bcpin.csh is printed when it finishes, followed by its time.
+#
+# Usage:
+#       loadBcp.py [--jobs N]
+#
+#       --jobs N  number of tables loaded at the same time. Default is
+#                 LOAD_JOBS from the config, or 4
+#
+#       The bcp files are OUTPUTDIR/<*_FILENAME>, empty files are skipped
+#
+# Exit:
+#       0 if every table loaded, else 1
+#
+'''
+import os
+import sys
+import time
+import argparse
+import subprocess
+import concurrent.futures
+
+# (table, bcp file name variable, tables it depends on) in load order
+TABLE_LIST = [
+    ('GXD_HTExperiment', 'EXPERIMENT_FILENAME', []),
+    ('ACC_Accession', 'ACC_FILENAME', ['GXD_HTExperiment']),
+    ('GXD_HTExperimentVariable', 'VARIABLE_FILENAME', ['GXD_HTExperiment']),
+    ('MGI_Property', 'PROPERTY_FILENAME', ['GXD_HTExperiment']),
+    ('GXD_HTRawSample', 'SAMPLE_FILENAME', ['GXD_HTExperiment']),
+    ('MGI_KeyValue', 'KEYVALUE_FILENAME', ['GXD_HTRawSample']),
+    ]
+
+#
+# Purpose: loads one bcp file with bcpin.csh
+# Returns: tuple (table, return code, output, seconds)
+# Assumes: Nothing, run in a worker thread
+# Effects: writes to the database
+# Throws: Nothing
+#
+
+def loadTable(table, outputDir, fileName):
+
+    bcpin = '%s/bin/bcpin.csh' % os.environ['PG_DBUTILS']
+    bcpCmd = [bcpin, os.environ['MGD_DBSERVER'], os.environ['MGD_DBNAME'], \
+        table, outputDir, fileName, '\\t', '\\n', 'mgd']
+
+    startTime = time.time()
+    result = subprocess.run(bcpCmd, stdout=subprocess.PIPE, \
+        stderr=subprocess.STDOUT, universal_newlines=True)
+
+    return (table, result.returncode, '%s%s' % (' '.join(bcpCmd), '\n') + result.stdout, time.time() - startTime)
+
+#
+# Purpose: loads the bcp files in 'outputDir', independent tables at the
+#       same time
+# Returns: 0 if every table loaded, else 1
+# Assumes: fileDict has the bcp file name of each table in TABLE_LIST
+# Effects: writes to the database and stdout
+# Throws: Nothing
+#
+
+def loadTables(outputDir, fileDict, jobs=4):
+
+    jobs = max(jobs, 1)
+    startTime = time.time()
+    doneSet = set()
+    failedSet = set()
+    runningDict = {}
+
+    # tables still to be loaded, in load order
+    todoList = []
+    for (table, fileVar, dependsList) in TABLE_LIST:
+        path = os.path.join(outputDir, fileDict[table])
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            print('%s: empty, not loaded' % table)
+            doneSet.add(table)
+        else:
+            todoList.append((table, dependsList))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        while todoList or runningDict:
+
+            # start the tables whose dependencies are loaded
+            for (table, dependsList) in list(todoList):
+                if set(dependsList) & failedSet:
+                    print('%s: not loaded, depends on a failed table' % table)
+                    failedSet.add(table)
+                    todoList.remove((table, dependsList))
+                elif set(dependsList) <= doneSet and len(runningDict) < jobs:
+                    print('%s: started %s' % (table, time.strftime('%H:%M:%S')))
+                    future = executor.submit(loadTable, table, outputDir, fileDict[table])
+                    runningDict[future] = table
+                    todoList.remove((table, dependsList))
+
+            if not runningDict:
+                break
+
+            finishedSet, notDone = concurrent.futures.wait(runningDict, \
+                return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in finishedSet:
+                del runningDict[future]
+                (table, rc, output, seconds) = future.result()
+                print(output.rstrip('\n'))
+                print('%s: rc %s, %.2f seconds' % (table, rc, seconds))
+                if rc == 0:
+                    doneSet.add(table)
+                else:
+                    failedSet.add(table)
+
+    print('all tables: %.2f seconds' % (time.time() - startTime))
+
+    if failedSet:
+        print('failed: %s' % ', '.join(sorted(failedSet)))
+        return 1
+
+    return 0
+
+#
+# main
+#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='load the bcp files, independent tables in parallel')
+    parser.add_argument('-j', '--jobs', type=int, dest='jobs',
+        default=int(os.getenv('LOAD_JOBS', '4')),
+        help='number of tables loaded at the same time. Default is LOAD_JOBS or 4')
+    args = parser.parse_args()
+
+    fileDict = {}
+    for (table, fileVar, dependsList) in TABLE_LIST:
+        fileDict[table] = os.environ[fileVar]
+
+    sys.exit(loadTables(os.environ['OUTPUTDIR'], fileDict, args.jobs))
@@ -20,7 +20,7 @@ import argparse
 import db
 import htMLsample as mlSampleLib
 import htRawSampleTextManager
-from utilsLib import removeNonAscii
+import textNormalize
 #-----------------------------------
 
 sampleObjType = mlSampleLib.HtSample
@@ -179,7 +179,7 @@ def sqlRecord2HtSample(r,               # sql Result record
 def cleanUpTextField(text):
     if text == None:
         text = ''
-    text = removeNonAscii(cleanDelimiters(text))
+    text = textNormalize.replaceNonAscii(cleanDelimiters(text))
     return text
 #-----------------------------------
 
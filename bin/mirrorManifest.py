@@ -0,0 +1,162 @@
+'''
+#
+# mirrorManifest.py
+#
+# Manifest of the files downloaded by mirror_geo_sample.py and mirror_ae.py
+#
+# For each local file the manifest keeps the url it was downloaded from and
+# the validators of the response it was downloaded with:
+#       file, url, Last-Modified, ETag, size
+# one tab delimited line a file. When the local file exists, its download
+# is a conditional GET: the manifest's ETag is sent as If-None-Match and
+# its Last-Modified as If-Modified-Since. A 304 (Not Modified) response has
+# no body, the local file is kept; any other response is handled as a
+# plain GET and a 200 records the new validators. Each file costs one
+# request, as without a manifest; a 304 saves the download. A file with
+# no validators is not recorded and is downloaded in full every run.
+#
+# The manifest is written to <manifest>.new and renamed over the manifest
+# by save(), so an interrupted run leaves the last complete one.
+#
+# Usage:
+#       mirrorManifest.py --report manifest
+#
+#       --report  print the number of files in the manifest and their size
+#
+'''
+import os
+import sys
+import argparse
+import threading
+
+TAB = '\t'
+CRT = '\n'
+
+class MirrorManifest:
+    # Is: the validators of the downloaded files of one mirror directory
+    # Has: the manifest file, the entries by file name, the conditional
+    #       requests, files not modified and downloaded and bytes saved of
+    #       this run
+    # Does: conditionalHeaders(), notModified(), put(), save(), report();
+    #       may be shared by download threads
+    #
+    def __init__ (self, path):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: reads the manifest file if it exists
+        # Throws: IOError
+        self.path = path
+        self.entryDict = {}   # file: (url, lastModified, etag, size)
+        self.lock = threading.Lock()
+        self.conditionals = 0
+        self.skips = 0
+        self.downloads = 0
+        self.bytesSaved = 0
+
+        if os.path.exists(path):
+            with open(path, 'r') as fp:
+                for line in fp:
+                    tokens = line.rstrip(CRT).split(TAB)
+                    if len(tokens) == 5:
+                        self.entryDict[tokens[0]] = tuple(tokens[1:])
+
+    def conditionalHeaders(self, file, localPath):
+        # Purpose: the request headers of the download of 'file' to
+        #       'localPath', conditional on the validators of the local copy
+        # Returns: dict of headers, empty if there is no local copy or it
+        #       has no validators; a 304 response is only a skip if the
+        #       headers were not empty
+        # Assumes: nothing
+        # Effects: counts a conditional request
+        # Throws: nothing
+        headerDict = {}
+        with self.lock:
+            entry = self.entryDict.get(file)
+            if entry is None or not os.path.exists(localPath):
+                return headerDict
+            (url, lastModified, etag, size) = entry
+            if etag:
+                headerDict['If-None-Match'] = etag
+            if lastModified:
+                headerDict['If-Modified-Since'] = lastModified
+            if headerDict:
+                self.conditionals += 1
+        return headerDict
+
+    def notModified(self, file):
+        # Purpose: records a 304 response to the conditional download of
+        #       'file', the local copy is current
+        # Returns: nothing
+        # Assumes: the request had conditionalHeaders() of 'file'
+        # Effects: counts the skip and the bytes saved
+        # Throws: nothing
+        with self.lock:
+            self.skips += 1
+            entry = self.entryDict.get(file)
+            if entry is not None and entry[3].isdigit():
+                self.bytesSaved += int(entry[3])
+
+    def put(self, file, url, headers, size):
+        # Purpose: records that 'file' was downloaded from 'url', 'size'
+        #       bytes, with response 'headers'; with no validators it is
+        #       forgotten so it is downloaded in full next time
+        # Returns: nothing
+        # Assumes: 'headers' are of the 200 response, an
+        #       http.client.HTTPMessage
+        # Effects: nothing, see save()
+        # Throws: nothing
+        lastModified = headers.get('Last-Modified', '')
+        etag = headers.get('ETag', '')
+        with self.lock:
+            self.downloads += 1
+            if not lastModified and not etag:
+                self.entryDict.pop(file, None)
+            else:
+                self.entryDict[file] = (url, lastModified, etag, str(size))
+
+    def save(self):
+        # Purpose: writes the manifest
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: writes <path>.new and renames it to the manifest
+        # Throws: IOError
+        with self.lock:
+            newPath = '%s.new' % self.path
+            with open(newPath, 'w') as fp:
+                for file in sorted(self.entryDict):
+                    fp.write('%s%s%s%s' % (file, TAB, TAB.join(self.entryDict[file]), CRT))
+            os.replace(newPath, self.path)
+
+    def report(self):
+        # Purpose: summarizes this run
+        # Returns: str
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        return 'manifest: %s conditional requests; %s files not modified (304), %s downloaded; %.1f MB and %s downloads saved' % \
+            (self.conditionals, self.skips, self.downloads, self.bytesSaved / 1048576.0, self.skips)
+
+# end class MirrorManifest -----------------------------------------
+
+#
+# main
+#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='mirror download manifest')
+    parser.add_argument('--report', action='store_true',
+        help='print the number of files in the manifest and their size')
+    parser.add_argument('manifest', help='the manifest file')
+    args = parser.parse_args()
+
+    if args.report:
+        manifest = MirrorManifest(args.manifest)
+        size = 0
+        for (url, lastModified, etag, fileSize) in manifest.entryDict.values():
+            if fileSize.isdigit():
+                size += int(fileSize)
+        print('%s files, %.1f MB' % (len(manifest.entryDict), size / 1048576.0))
+
+    sys.exit(0)
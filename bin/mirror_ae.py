@@ -10,9 +10,10 @@
 import sys 
 import os
 import reportlib
-import subprocess
 import loadlib
 import Set
+import httpClient
+import mirrorManifest
 
 CRT = reportlib.CRT
 SPACE = reportlib.SPACE
@@ -24,6 +25,14 @@ inputFile =  os.getenv('INPUT_FILE_DEFAULT')
 
 curLogName = os.getenv('MIRROR_LOG_CUR')
 
+# manifest of the downloaded files, empty downloads every experiment file
+# every run and each sample file once
+manifestPath = os.getenv('MIRROR_MANIFEST', '')
+manifest = None
+
+# the downloads share its keep-alive connections
+client = httpClient.HttpClient()
+
 #
 # Create the path and file templates
 #
@@ -55,7 +64,7 @@ headerSet = set([])
 # example: ftp://ftp.ncbi.nlm.nih.gov/geo/series/GSE62nnn/GSE62608/miniml/GSE62608_family.xml.tgz
 
 def init():
-    global fpIn, expIdList, fpCurLogFile
+    global fpIn, expIdList, fpCurLogFile, manifest
 
     try:
         fpIn = open(inputFile, 'r')
@@ -74,8 +83,30 @@ def init():
         (exptID, action) = list(map(str.strip, str.split(line, TAB)))[:2]
         expIdList.append(exptID)
 
+    if manifestPath != '':
+        manifest = mirrorManifest.MirrorManifest(manifestPath)
+
     return
 
+#
+# Purpose: downloads 'url' to 'path'
+# Returns: tuple (http status, None if there was no response; error
+#       message, '' if it succeeded; response headers, None if there was
+#       no response)
+# Assumes: Nothing
+# Effects: writes 'path'
+# Throws: Nothing
+#
+def download(url, path, headerDict=None):
+    try:
+        (status, size, headers) = client.download(url, path, headerDict)
+    except Exception as e:
+        return (None, str(e) or e.__class__.__name__, None)
+
+    if status != 200:
+        return (status, 'http status %s' % status, headers)
+    return (status, '', headers)
+
 # iterate thru the ArrayExpress IDs fetching the experiment and sample files
 def process():
     for id in expIdList:
@@ -102,58 +133,69 @@ def process():
         print('%sProcessing: %s%s' % (CRT, id, CRT)) 
         print('expURL: %s%s expFile: %s/%s%s smpURL: %s%s smpFile: %s/%s%s' % (expURL, CRT, inputDir, expFile, CRT, smpURL, CRT, inputDir, smpFile, CRT))
 
-        # create experiment command and run it
-        cmd = 'wget -O %s/%s %s' % (inputDir, expFile, expURL)
-        print('cmd: %s' % cmd)
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stdout = result.stdout
-        stderr = result.stderr
-        statusCode = result.returncode
+        # with the manifest the GETs are conditional, a file that has not
+        # changed since it was downloaded is not sent again (304)
+        headerDict = {}
+        if manifest:
+            headerDict = manifest.conditionalHeaders(expFile, '%s/%s' % (inputDir, expFile))
+
+        # download the experiment file
+        print('GET %s' % expURL)
+        (status, message, headers) = download(expURL, '%s/%s' % (inputDir, expFile), headerDict)
 
         # try the second URL
-        if statusCode != 0:
+        if status not in (200, 304):
             expURL = ftpExpUrlTemplate2 % (t1, t3, id, id)
-            cmd = 'wget -O %s/%s %s' % (inputDir, expFile, expURL)
-            print('cmd: %s' % cmd)
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            stdout = result.stdout
-            stderr = result.stderr
-            statusCode = result.returncode
-    
-        if statusCode != 0:
-            fpCurLogFile.write('%sExperiment file: %s%s' % (CRT, expFile, CRT))
-            fpCurLogFile.write('%s failed with exit code %s \nstderr %s' % (cmd, statusCode, stderr))
-            print('Skipping %s' % (expFile))
-            cmd = '/usr/bin/rm -f %s/%s ' % (inputDir, expFile)
-            print(cmd)
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            continue
-        else:
-            print('Experiment file: %s successfully downloaded' % expFile)
+            print('GET %s' % expURL)
+            (status, message, headers) = download(expURL, '%s/%s' % (inputDir, expFile), headerDict)
 
-        # -nc no clobber - if the file exists, don't overwrite it
+        if status == 304 and headerDict:
+            manifest.notModified(expFile)
+            print('Experiment file: %s not modified' % expFile)
+        else:
+            if status != 200:
+                fpCurLogFile.write('%sExperiment file: %s%s' % (CRT, expFile, CRT))
+                fpCurLogFile.write('GET %s failed: %s%s' % (expURL, message, CRT))
+                print('Skipping %s' % (expFile))
+                if os.path.exists('%s/%s' % (inputDir, expFile)):
+                    os.remove('%s/%s' % (inputDir, expFile))
+                continue
+            else:
+                print('Experiment file: %s successfully downloaded' % expFile)
+                if manifest:
+                    manifest.put(expFile, expURL, headers, \
+                        os.path.getsize('%s/%s' % (inputDir, expFile)))
+
+        headerDict = {}
+        if manifest:
+            # the manifest finds the changed sample files, replace them
+            headerDict = manifest.conditionalHeaders(smpFile, '%s/%s' % (inputDir, smpFile))
+        elif os.path.exists('%s/%s' % (inputDir, smpFile)):
+            # no clobber - if the file exists, don't overwrite it
+            print('Sample file: %s already there' % smpFile)
+            continue
 
-        # create experiment command and run it
-        cmd = 'wget -nc -O %s/%s %s' % (inputDir, smpFile, smpURL, )
+        # download the sample file
+        print('GET %s' % smpURL)
+        (status, message, headers) = download(smpURL, '%s/%s' % (inputDir, smpFile), headerDict)
 
-        print('cmd: %s' % cmd)
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stdout = result.stdout
-        stderr = result.stderr
-        statusCode = result.returncode
+        if status == 304 and headerDict:
+            manifest.notModified(smpFile)
+            print('Sample file: %s not modified' % smpFile)
+            continue
 
-        if statusCode != 0 and str.find(stderr, 'already there') == -1:
+        if status != 200:
             fpCurLogFile.write('%sSample file: %s%s' % (CRT, smpFile, CRT))
-            fpCurLogFile.write('%s failed with exit code %s \nstderr %s' % (cmd, statusCode, stderr))
+            fpCurLogFile.write('GET %s failed: %s%s' % (smpURL, message, CRT))
             print('Skipping %s' % (smpFile))
-
-            cmd = '/usr/bin/rm -f %s/%s ' % (inputDir, smpFile)
-            print(cmd)
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            if os.path.exists('%s/%s' % (inputDir, smpFile)):
+                os.remove('%s/%s' % (inputDir, smpFile))
             continue
         else:
             print('Sample file: %s successfully downloaded' % smpFile)
-            print('    %s' % stderr)
+            if manifest:
+                manifest.put(smpFile, smpURL, headers, \
+                    os.path.getsize('%s/%s' % (inputDir, smpFile)))
             continue
 
 ### main ###
@@ -165,6 +207,11 @@ print(expIdList)
 
 print('process')
 process()
+if manifest:
+    manifest.save()
+    print(manifest.report())
+print(client.report())
+client.close()
 fpCurLogFile.write('%s%s%s' % (CRT, CRT, loadlib.loaddate))
 fpCurLogFile.close()
 
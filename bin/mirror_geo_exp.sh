@@ -92,16 +92,22 @@ fi
 # how far to go back to fetch experiments in days
 reldate=${EXPT_DOWNLOAD_DAYS}
 
+#
+# the eutils requests are made by httpClient.py, which keeps its connection
+# to eutils open from one to the next
+#
+HTTP_CLIENT="${PYTHON} ${GXDHTLOAD}/bin/httpClient.py"
+
 #
 # step one get query key, web env and query count
 #
 if [ -z ${reldate} ]
 then
-	wget  -a ${LOG} -O $GEO_UID_FILE "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=gds&term=GSE[ETYP]+AND+Mus[ORGN]&retmax=300000&usehistory=y&datetype=pdat"
+	${HTTP_CLIENT} -a ${LOG} -O $GEO_UID_FILE "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=gds&term=GSE[ETYP]+AND+Mus[ORGN]&retmax=300000&usehistory=y&datetype=pdat"
 	STAT=$?
 	echo "STAT: ${STAT}"
 else
-    wget  -a ${LOG} -O $GEO_UID_FILE "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=gds&term=GSE[ETYP]+AND+Mus[ORGN]&reldate=${reldate}&retmax=300000&usehistory=y&datetype=pdat"
+    ${HTTP_CLIENT} -a ${LOG} -O $GEO_UID_FILE "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=gds&term=GSE[ETYP]+AND+Mus[ORGN]&reldate=${reldate}&retmax=300000&usehistory=y&datetype=pdat"
     STAT=$?
     echo "STAT: ${STAT}"
 fi
@@ -138,21 +144,52 @@ rm -f ${GEO_DOWNLOADS_ARCHIVE}/${EXPT_XML_FILE}.*
 # then move the last processed files to the archive directory
 mv -f ${GEO_DOWNLOADS}/${EXPT_XML_FILE}.* ${GEO_DOWNLOADS_ARCHIVE}
 
-# Loop grabbing retrieve_max experiments at a time
+# list of the batch files and their urls, "file<TAB>url" a line
+ESUMMARY_LIST=${GEO_DOWNLOADS}/esummary.list
+rm -f ${ESUMMARY_LIST}
+touch ${ESUMMARY_LIST}
+
+# Loop listing retrieve_max experiments at a time
 while [ $retrieve_start -lt $GEO_COUNT ]
 do
     echo "fileCount: $fileCount"
     echo "retrieve_start: $retrieve_start"
 
-    wget -a ${LOG} -O ${GEO_XML_FILE}.${fileCount} "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=gds&version=2.0&query_key=${QUERY_KEY}&WebEnv=${WEB_ENV}&retstart=$retrieve_start&retmax=$retrieve_max&api_key=${EUTILS_API_KEY}"
-    error=`cat ${GEO_XML_FILE}.${fileCount}  | grep 'WWW Error 500 Diagnostic'` 
+    printf "%s\t%s\n" ${GEO_XML_FILE}.${fileCount} "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=gds&version=2.0&query_key=${QUERY_KEY}&WebEnv=${WEB_ENV}&retstart=$retrieve_start&retmax=$retrieve_max&api_key=${EUTILS_API_KEY}" >> ${ESUMMARY_LIST}
+    fileCount=`expr $fileCount + 1`
+    retrieve_start=`expr $retrieve_start + $retrieve_max`
+done
+
+# NCBI allows 3 requests/sec, 10 with an API key; MIRROR_REQUESTS_PER_SEC
+# overrides
+REQUESTS_PER_SEC=${MIRROR_REQUESTS_PER_SEC}
+if [ -z "${REQUESTS_PER_SEC}" ]
+then
+    if [ -z "${EUTILS_API_KEY}" ]
+    then
+        REQUESTS_PER_SEC=3
+    else
+        REQUESTS_PER_SEC=10
+    fi
+fi
+
+# grab the batches, in order, on one connection, at most REQUESTS_PER_SEC
+# requests a second
+${HTTP_CLIENT} -a ${LOG} --rate ${REQUESTS_PER_SEC} --list ${ESUMMARY_LIST}
+
+for file in `cut -f1 ${ESUMMARY_LIST}`
+do
+    if [ ! -f ${file} ]
+    then
+        echo "${file}: not downloaded" | tee -a ${LOG}
+        continue
+    fi
+    error=`cat ${file}  | grep 'WWW Error 500 Diagnostic'` 
     if [ "$error" !=  "" ]
     then
         echo $error
-        echo "${GEO_XML_FILE}.${fileCount}: $error" >> ${LOG}
+        echo "${file}: $error" >> ${LOG}
     fi
-    fileCount=`expr $fileCount + 1`
-    retrieve_start=`expr $retrieve_start + $retrieve_max`
 done
 
 ALL_FILES=`ls ${GEO_DOWNLOADS}/geo.xml.*`
@@ -10,10 +10,18 @@
  
 import sys 
 import os
+import time
+import gzip
+import zlib
+import shutil
+import tarfile
+import concurrent.futures
 import db
 import reportlib
-import subprocess
 import loadlib
+import httpClient
+import mirrorManifest
+import sampleFile
 
 db.setTrace()
 
@@ -26,18 +34,50 @@ GEO_DOWNLOADS = os.getenv('GEO_DOWNLOADS')
 
 curLogName = os.getenv('MIRROR_LOG_CUR')
 
+# download threads
+mirrorJobs = int(os.getenv('MIRROR_JOBS', '4'))
+
+# NCBI allows 3 requests/sec, 10 with an API key; MIRROR_REQUESTS_PER_SEC
+# overrides
+mirrorRequestsPerSec = os.getenv('MIRROR_REQUESTS_PER_SEC', '')
+if mirrorRequestsPerSec == '':
+    if os.getenv('EUTILS_API_KEY', '') != '':
+        mirrorRequestsPerSec = 10
+    else:
+        mirrorRequestsPerSec = 3
+mirrorRequestsPerSec = float(mirrorRequestsPerSec)
+
+# retries of a failed download, the first after MIRROR_RETRY_SECONDS
+mirrorRetries = int(os.getenv('MIRROR_RETRIES', '3'))
+mirrorRetrySeconds = float(os.getenv('MIRROR_RETRY_SECONDS', '5'))
+
+# manifest of the downloaded files, empty downloads every file every run
+manifestPath = os.getenv('MIRROR_MANIFEST', '')
+manifest = None
+
+# the form the family files are kept in, geo_htload.py reads each:
+#       xml  <GSE>_family.xml, extracted from the tarball
+#       gz   <GSE>_family.xml.gz, extracted and gzipped
+#       tgz  <GSE>_family.xml.tgz, the tarball as downloaded
+mirrorSampleFormat = os.getenv('MIRROR_SAMPLE_FORMAT', 'xml')
+
+# print the progress every PROGRESS_FILES files
+PROGRESS_FILES = 100
+
 # the list of geo experiment Ids from all the metadata files
 geoExperimentIdList = []
 
 # plug GEO ids into this template to get the sample data files
-# example: ftp://ftp.ncbi.nlm.nih.gov/geo/series/GSE62nnn/GSE62608/miniml/GSE62608_family.xml.tgz
+# example: https://ftp.ncbi.nlm.nih.gov/geo/series/GSE62nnn/GSE62608/miniml/GSE62608_family.xml.tgz
+# (the ftp site is also served over https, which httpClient downloads on
+# keep-alive connections)
 
 # GEO data are available for download from the FTP site. Directory structure is organized by type, GEO accession range, GEO accession number, and format. Range subdirectory name is created by replacing the three last digits of the accession with letters "nnn". For example,
 #  GSM575: /samples/GSMnnn/GSM575/
 #  GSM1234: /samples/GSM1nnn/GSM1234/
 #  GSM12345: /samples/GSM12nnn/GSM12345/
 
-ftpUrlTemplate = "ftp://ftp.ncbi.nlm.nih.gov/geo/series/~x~/~id~/miniml/~id~_family.xml.tgz"
+ftpUrlTemplate = "https://ftp.ncbi.nlm.nih.gov/geo/series/~x~/~id~/miniml/~id~_family.xml.tgz"
 ftpFileTemplate = "~id~_family.xml.tgz"
 
 def init():
@@ -111,84 +151,234 @@ def parseFile(fpInFile):
              line = str.strip(line)
     return
 
-# iterate thru the geo IDs fetching the family files from the ftp site
-def process():
-    for id in geoExperimentIdList:
-
-        # create url
-        #print(id)
-        if len(id) == 4:
-            xPart = id[:-1] + 'nnn'
-        elif len(id) == 5:
-            xPart = id[:-2] + 'nnn'
+#
+# Purpose: builds the url and file name of the family tarball of 'id'
+# Returns: tuple (url, file name)
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
+def familyUrl(id):
+    if len(id) == 4:
+        xPart = id[:-1] + 'nnn'
+    elif len(id) == 5:
+        xPart = id[:-2] + 'nnn'
+    else:
+        xPart = id[:-3] + 'nnn'
+    url = ftpUrlTemplate.replace('~x~', xPart)
+    url = url.replace('~id~', id)
+    file = ftpFileTemplate.replace('~id~', id)
+    return (url, file)
+
+#
+# Purpose: downloads 'url' to 'path', retrying network errors, server
+#       (5xx) errors and 429 Too Many Requests, the response to going over
+#       the NCBI request rate, after mirrorRetrySeconds, doubled for each
+#       retry, or the longer Retry-After of the response
+# Returns: tuple (http status, None if there was no response; error
+#       message of the last try, '' if it succeeded; tries; response
+#       headers, None if there was no response)
+# Assumes: Nothing
+# Effects: writes 'path', sleeps between tries
+# Throws: Nothing
+#
+def download(url, path, headerDict=None):
+    tries = 0
+    while True:
+        limiter.acquire()
+        tries += 1
+        try:
+            (status, size, headers) = client.download(url, path, headerDict)
+            message = ''
+            if status != 200:
+                message = 'http status %s' % status
+        except Exception as e:
+            status = None
+            headers = None
+            message = str(e) or e.__class__.__name__
+
+        # a missing file (404) and other client errors are not retried
+        if (status is not None and status < 500 and status != 429) or tries > mirrorRetries:
+            return (status, message, tries, headers)
+
+        wait = mirrorRetrySeconds * 2 ** (tries - 1)
+        if status is not None:
+            wait = max(wait, httpClient.retryAfter(headers) or 0)
+        time.sleep(wait)
+
+#
+# Purpose: extracts the family file from a family tarball, streaming it
+#       through once; the other members are read past, not written.
+#       A 'familyPath' ending in .gz is written gzipped
+# Returns: Nothing
+# Assumes: Nothing
+# Effects: writes 'familyPath' through <familyPath>.tmp and a rename, so
+#       it is never left partly written
+# Throws: tarfile.TarError, OSError, EOFError if the tarball is bad,
+#       KeyError if it has no family file
+#
+def extractFamilyFile(tgzPath, familyPath):
+    member = os.path.basename(familyPath)
+    tmpPath = '%s.tmp' % familyPath
+    openOut = open
+    if familyPath.endswith('.gz'):
+        member = member[:-3]
+        openOut = gzip.open
+
+    with tarfile.open(tgzPath, 'r|gz') as tar:
+        for info in tar:
+            if info.isfile() and os.path.basename(info.name) == member:
+                try:
+                    with openOut(tmpPath, 'wb') as fp:
+                        shutil.copyfileobj(tar.extractfile(info), fp, 1048576)
+                    os.replace(tmpPath, familyPath)
+                except:
+                    if os.path.exists(tmpPath):
+                        os.remove(tmpPath)
+                    raise
+                return
+
+    raise KeyError('%s not in %s' % (member, tgzPath))
+
+#
+# Purpose: reads the family file of a family tarball that is kept as
+#       downloaded, to check it can be read by geo_htload.py
+# Returns: Nothing
+# Assumes: Nothing
+# Effects: reads the tarball
+# Throws: tarfile.TarError, OSError, EOFError, zlib.error if the tarball
+#       is bad or has no family file
+#
+def checkFamilyFile(tgzPath):
+    fp = sampleFile.openSampleFile(tgzPath)
+    try:
+        while fp.read(1048576):
+            pass
+    finally:
+        fp.close()
+
+#
+# Purpose: downloads and unpacks the family file of 'id', in a download
+#       thread; with a manifest the download is conditional and skipped
+#       if the tarball has not changed
+# Returns: tuple (id, bytes downloaded, list of lines for stdout,
+#       list of lines for the curator log); no curator lines if it succeeded
+# Assumes: Nothing
+# Effects: writes GEO_DOWNLOADS, downloads, updates the manifest
+# Throws: Nothing
+#
+def fetchFamilyFile(id):
+    (url, file) = familyUrl(id)
+    outList = [url]
+    curList = []
+    path = '%s/%s' % (GEO_DOWNLOADS, file)
+    familyPath = path[:-4]
+    if mirrorSampleFormat == 'gz':
+        familyPath = '%s.gz' % familyPath
+    elif mirrorSampleFormat == 'tgz':
+        familyPath = path
+
+    # -nc no clobber - if the file exists, don't overwrite it
+    # wts2-1369 - remove the -nc as we want new sample files each
+    # time we download to find samples added to an experiment;
+    # with the manifest the GET is conditional, a tarball that has not
+    # changed since is not sent again (304)
+    headerDict = {}
+    if manifest:
+        headerDict = manifest.conditionalHeaders(file, familyPath)
+
+    (status, message, tries, headers) = download(url, path, headerDict)
+    outList.append('GET %s %s' % (url, status))
+    if tries > 1:
+        outList.append('%s tries' % tries)
+
+    if status == 304 and headerDict:
+        manifest.notModified(file)
+        outList.append('%s not modified, skipped' % file)
+        return (id, 0, outList, [])
+
+    if status != 200:
+        curList.append('Experiment sample file: %s%s%s' % (file, CRT, CRT))
+        curList.append('GET %s failed: %s%s' % (url, message, CRT))
+        outList.append('Skipping %s see %s' % (file, curLogName))
+        if os.path.exists(path):
+            os.remove(path)
+        return (id, 0, outList, curList)
+
+    size = os.path.getsize(path)
+
+    # extract the family file; the GPL* and GSM* files of the tarball are
+    # not written
+    try:
+        if mirrorSampleFormat == 'tgz':
+            checkFamilyFile(path)
         else:
-            xPart = id[:-3] + 'nnn'
-        #print('xPart: %s' % xPart)
-        url = ftpUrlTemplate.replace('~x~', xPart)
-        url = url.replace('~id~', id)
-        file = ftpFileTemplate.replace('~id~', id)
-        unzipped = '%s/%s' % (GEO_DOWNLOADS, file[:-4])
-        #print('file: %s' % file)
-        print(url)
-
-        # create command and run it
-        # -nc no clobber - if the file exists, don't overwrite it
-        # wts2-1369 - remove the -nc as we want new sample files each
-        # time we download to find samples added to an experiment
-        #cmd = 'wget -nc -O %s/%s %s' % (GEO_DOWNLOADS, file, url)
-        cmd = 'wget -O %s/%s %s' % (GEO_DOWNLOADS, file, url)
-        print('cmd: %s' % cmd)
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stdout = result.stdout
-        stderr = result.stderr
-        statusCode = result.returncode
-
-        if statusCode != 0:
-            fpCurLogFile.write('Experiment sample file: %s%s%s' % (file, CRT, CRT))
-            fpCurLogFile.write('%s failed with exit code %s \nstderr %s' % (cmd, statusCode, stderr))
-            print('Skipping %s see %s' % (file, curLogName))
-
-            cmd = '/usr/bin/rm -f %s/%s ' % (GEO_DOWNLOADS, file)
-            print(cmd)
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            continue
-
-        # untar/unzip the file
-        cmd = '/usr/bin/tar -xzvf %s/%s ' % (GEO_DOWNLOADS, file) 
-        print(cmd)
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stdout = result.stdout
-        stderr = result.stderr
-        statusCode = result.returncode
-        if statusCode != 0:
-            fpCurLogFile.write('Experiment sample file: %s%s%s' % (file, CRT, CRT))
-            fpCurLogFile.write('%s failed with exit code %s stderr %s%s:' % (cmd, statusCode, stderr, CRT))
-            print('Skipping %s see %s' % (file, curLogName))
-            continue
-
-	# remove extraneous files from the tarball and the 
-	# *.tgz, GPL*, GSM*
-        cmd = '/usr/bin/rm -f %s/%s ' % (GEO_DOWNLOADS, file)
-        print(cmd)
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stdout = result.stdout
-        stderr = result.stderr
-        statusCode = result.returncode
-            
-        cmd = '/usr/bin/rm -f %s/GPL* ' % (GEO_DOWNLOADS)
-        print(cmd)
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stdout = result.stdout
-        stderr = result.stderr
-        statusCode = result.returncode
-            
-        cmd = '/usr/bin/rm -f %s/GSM* ' % (GEO_DOWNLOADS)
-        print(cmd)
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stdout = result.stdout
-        stderr = result.stderr
-        statusCode = result.returncode
-            
+            extractFamilyFile(path, familyPath)
+    except (tarfile.TarError, OSError, EOFError, KeyError, zlib.error) as e:
+        curList.append('Experiment sample file: %s%s%s' % (file, CRT, CRT))
+        curList.append('extracting %s from %s failed: %s%s:' % (os.path.basename(path[:-4]), path, e, CRT))
+        outList.append('Skipping %s see %s' % (file, curLogName))
+        return (id, size, outList, curList)
+    if mirrorSampleFormat == 'tgz':
+        outList.append('kept %s' % familyPath)
+    else:
+        outList.append('extracted %s' % familyPath)
+
+    # remove the *.tgz, and the family file in any other form, which
+    # geo_htload.py could read instead
+    for otherPath in [path[:-4]] + [path[:-4] + suffix for suffix in sampleFile.COMPRESSED_SUFFIXES]:
+        if otherPath != familyPath and os.path.exists(otherPath):
+            os.remove(otherPath)
+
+    if manifest:
+        manifest.put(file, url, headers, size)
+
+    return (id, size, outList, [])
+
+#
+# Purpose: prints the files/sec and MB/sec so far
+# Returns: Nothing
+# Assumes: Nothing
+# Effects: writes to stdout
+# Throws: Nothing
+#
+def printProgress(label, fileCount, failCount, byteCount, startTime):
+    seconds = max(time.time() - startTime, 0.001)
+    print('%s: %s of %s files, %s failed, %.1f MB, %.0f seconds, %.2f files/sec, %.2f MB/sec' % \
+        (label, fileCount, len(geoExperimentIdList), failCount, byteCount / 1048576.0, seconds, \
+        fileCount / seconds, byteCount / 1048576.0 / seconds))
+    sys.stdout.flush()
+
+# iterate thru the geo IDs fetching the family files from the ftp site,
+# mirrorJobs at a time
+def process():
+    print('download threads: %s, requests/sec: %s, retries: %s' % (mirrorJobs, mirrorRequestsPerSec, mirrorRetries))
+    fileCount = 0
+    failCount = 0
+    byteCount = 0
+    startTime = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(mirrorJobs) as executor:
+        futureList = [executor.submit(fetchFamilyFile, id) for id in geoExperimentIdList]
+        for future in concurrent.futures.as_completed(futureList):
+            (id, size, outList, curList) = future.result()
+            print(CRT.join(outList))
+            for line in curList:
+                fpCurLogFile.write(line)
+            fileCount += 1
+            byteCount += size
+            if curList:
+                failCount += 1
+            if fileCount % PROGRESS_FILES == 0:
+                printProgress('progress', fileCount, failCount, byteCount, startTime)
+
+    printProgress('downloaded', fileCount, failCount, byteCount, startTime)
+
+    if manifest:
+        manifest.save()
+        print(manifest.report())
+    print(client.report())
+
     return
 
 ### main ###
@@ -196,6 +386,11 @@ init()
 parseAll()
 print('Number GEO Ids to process: %s' % len(geoExperimentIdList))
 #print(geoIdList)
+limiter = httpClient.RateLimiter(mirrorRequestsPerSec)
+client = httpClient.HttpClient()
+if manifestPath != '':
+    manifest = mirrorManifest.MirrorManifest(manifestPath)
 process()
+client.close()
 fpCurLogFile.write('%s%s%s' % (CRT, CRT, loadlib.loaddate))
 fpCurLogFile.flush() 
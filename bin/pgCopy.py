@@ -0,0 +1,343 @@
+'''
+#
+# pgCopy.py
+#
+# Loads the bcp tables of geo_htload.py and ae_htload.py with postgres
+# COPY ... FROM STDIN over a single connection, used when LOAD_BACKEND=copy
+#
+# The loaders write their rows to CopyLoader table streams instead of bcp
+# files. A connection runs one COPY at a time, so one table (the largest,
+# MGI_KeyValue) is streamed to the server by a background thread while the
+# loader is still parsing; the rows of the other tables are spooled, in
+# memory then in a temporary file, and copied when the loader is closed.
+#
+# close() runs, in one transaction:
+#       1. the end of the streamed table's COPY
+#       2. the sample deletes, see deleteSamples.py
+#       3. a COPY of each spooled table, in the order they were opened
+#       4. the final sql (the sequence updates)
+#       5. commit
+#
+# Nothing is committed if any step fails; a loader that fails before it
+# gets to close() calls abort() instead, which rolls back. Each stream can tee its rows to
+# its bcp file so the files are still archived.
+#
+# The connection uses MGD_DBSERVER, MGD_DBNAME and MGD_DBUSER, the password
+# is taken from the user's .pgpass as it is by psql.
+#
+'''
+import os
+import time
+import queue
+import tempfile
+import threading
+import deleteSamples
+
+CRT = '\n'
+
+# schema of the loaded tables, as passed to bcpin.csh
+SCHEMA = 'mgd'
+
+# rows are sent to the streamed table in chunks of about this size
+CHUNK_SIZE = 256 * 1024
+
+# spooled tables are kept in memory up to this size
+SPOOL_SIZE = 64 * 1024 * 1024
+
+# COPY options matching bcpin.csh, tab delimited, empty string is null
+COPY_SQL = '''copy %s.%s from stdin with null as \'\''''
+
+# the sequence updates run by geo_htload.sh and ae_htload.doBCP()
+SETVAL_SQL = [
+    '''select setval('gxd_htexperiment_seq', (select max(_Experiment_key) from GXD_HTExperiment))''',
+    '''select setval('gxd_htexperimentvariable_seq', (select max(_ExperimentVariable_key) from GXD_HTExperimentVariable))''',
+    '''select setval('gxd_htrawsample_seq', (select max(_RawSample_key) from GXD_HTRawSample))''',
+    '''select setval('mgi_keyvalue_seq', (select max(_KeyValue_key) from MGI_KeyValue))''',
+    '''select setval('mgi_property_seq', (select max(_Property_key) from MGI_Property))''',
+    ]
+
+#
+# Purpose: opens a connection to the mgd database
+# Returns: psycopg2 connection, not in autocommit mode
+# Assumes: psycopg2 is installed, only needed when LOAD_BACKEND=copy
+# Effects: connects to the database
+# Throws: psycopg2.Error
+#
+
+def connect():
+
+    import psycopg2
+
+    return psycopg2.connect(host=os.environ['MGD_DBSERVER'],
+        dbname=os.environ['MGD_DBNAME'], user=os.environ['MGD_DBUSER'])
+
+class QueueReader:
+    # Is: the read end of the streamed table, a file-like object
+    #       read by cursor.copy_expert() in the background thread
+    # Has: a bounded queue of chunks, None marks the end
+    # Does: read()
+    #
+    def __init__ (self):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        self.queue = queue.Queue(maxsize=64)
+        self.buffer = ''
+        self.done = 0
+
+    def read(self, size=-1):
+        # Purpose: returns the next rows of the table
+        # Returns: up to 'size' characters, '' at the end of the table
+        # Assumes: nothing
+        # Effects: waits for the writer
+        # Throws: nothing
+        while not self.buffer and not self.done:
+            chunk = self.queue.get()
+            if chunk is None:
+                self.done = 1
+            else:
+                self.buffer = chunk
+
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+# end class QueueReader -----------------------------------------
+
+class TableStream:
+    # Is: the rows of one table, or the sample delete file
+    # Has: the table name, the spool or the queue the rows go to, the
+    #       optional tee file, the number of rows written
+    # Does: write(), close(), the same as the bcp file it replaces
+    #
+    def __init__ (self, loader, table, teeFileName=None, reader=None):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: creates 'teeFileName'
+        # Throws: IOError
+        self.loader = loader
+        self.table = table
+        self.reader = reader
+        self.spool = None
+        if reader is None:
+            self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+')
+        self.teeFile = None
+        if teeFileName:
+            self.teeFile = open(teeFileName, 'w')
+        self.chunkList = []
+        self.chunkSize = 0
+        self.rows = 0
+        self.closed = 0
+
+    def write(self, text):
+        # Purpose: adds rows to the table
+        # Returns: nothing
+        # Assumes: 'text' is one or more complete rows
+        # Effects: writes to the tee file, sends full chunks
+        # Throws: the error of the background COPY
+        if self.teeFile:
+            self.teeFile.write(text)
+        self.rows += text.count(CRT)
+        self.chunkList.append(text)
+        self.chunkSize += len(text)
+        if self.chunkSize >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        # Purpose: sends the buffered rows to the spool or the queue
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: may wait for the background COPY
+        # Throws: the error of the background COPY
+        if not self.chunkList:
+            return
+        chunk = ''.join(self.chunkList)
+        self.chunkList = []
+        self.chunkSize = 0
+        if self.spool:
+            self.spool.write(chunk)
+            return
+        while 1:
+            self.loader.checkStream()
+            try:
+                self.reader.queue.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        # Purpose: ends the table
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: flushes, closes the tee file, ends the streamed COPY
+        # Throws: the error of the background COPY
+        if self.closed:
+            return
+        self.closed = 1
+        self.flush()
+        if self.teeFile:
+            self.teeFile.close()
+        if self.reader:
+            while 1:
+                self.loader.checkStream()
+                try:
+                    self.reader.queue.put(None, timeout=1)
+                    break
+                except queue.Full:
+                    pass
+
+# end class TableStream -----------------------------------------
+
+class CopyLoader:
+    # Is: the COPY load of a set of tables in one transaction
+    # Has: the connection, the table streams in load order, the background
+    #       thread of the streamed table and its error
+    # Does: open(), openDelete(), close(), abort()
+    #
+    def __init__ (self, conn, streamTable=None):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: 'conn' is from connect()
+        # Effects: nothing
+        # Throws: nothing
+        self.conn = conn
+        self.streamTable = streamTable
+        self.streamList = []
+        self.deleteStream = None
+        self.thread = None
+        self.error = None
+        self.streamTime = 0.0
+
+    def open(self, table, teeFileName=None):
+        # Purpose: opens a table for loading
+        # Returns: TableStream
+        # Assumes: tables are opened in the order they are to be loaded
+        # Effects: starts the background COPY if 'table' is the streamed table
+        # Throws: IOError
+        if table == self.streamTable:
+            reader = QueueReader()
+            stream = TableStream(self, table, teeFileName, reader)
+            self.thread = threading.Thread(target=self.copyStream, args=(stream,))
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            stream = TableStream(self, table, teeFileName)
+        self.streamList.append(stream)
+        return stream
+
+    def openDelete(self, teeFileName=None):
+        # Purpose: opens the sample delete file, run before the spooled
+        #       tables are copied
+        # Returns: TableStream
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: IOError
+        self.deleteStream = TableStream(self, None, teeFileName)
+        return self.deleteStream
+
+    def copyStream(self, stream):
+        # Purpose: body of the background thread, copies the streamed table
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: writes to the database, sets self.error on failure
+        # Throws: nothing
+        startTime = time.time()
+        try:
+            cursor = self.conn.cursor()
+            cursor.copy_expert(COPY_SQL % (SCHEMA, stream.table), stream.reader)
+            cursor.close()
+        except Exception as e:
+            self.error = e
+            # unblock the writer
+            stream.reader.done = 1
+            while 1:
+                try:
+                    stream.reader.queue.get_nowait()
+                except queue.Empty:
+                    break
+        self.streamTime = time.time() - startTime
+
+    def checkStream(self):
+        # Purpose: reports a failure of the background COPY to the writer
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: the error of the background COPY
+        if self.error is not None:
+            raise self.error
+
+    def close(self, finalSqlList=()):
+        # Purpose: finishes the load and commits it
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: writes to the database, prints the rows and time per table
+        # Throws: psycopg2.Error, the transaction is rolled back
+        try:
+            for stream in self.streamList:
+                stream.close()
+            if self.deleteStream:
+                self.deleteStream.close()
+
+            if self.thread:
+                self.thread.join()
+            self.checkStream()
+
+            cursor = self.conn.cursor()
+
+            if self.deleteStream and self.deleteStream.rows:
+                self.deleteStream.spool.seek(0)
+                for (name, rows, seconds) in deleteSamples.deleteKeys(cursor, self.deleteStream.spool):
+                    print('delete %s: %s rows %.2f seconds' % (name, rows, seconds))
+
+            for stream in self.streamList:
+                if stream.reader:
+                    print('%s: %s rows %.2f seconds (streamed)' % (stream.table, stream.rows, self.streamTime))
+                    continue
+                startTime = time.time()
+                stream.spool.seek(0)
+                if stream.rows:
+                    cursor.copy_expert(COPY_SQL % (SCHEMA, stream.table), stream.spool)
+                stream.spool.close()
+                print('%s: %s rows %.2f seconds' % (stream.table, stream.rows, time.time() - startTime))
+
+            for sql in finalSqlList:
+                cursor.execute(sql)
+
+            cursor.close()
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.close()
+
+    def abort(self):
+        # Purpose: abandons the load, nothing is committed
+        # Returns: nothing
+        # Assumes: close() has not been called
+        # Effects: ends the streamed COPY, rolls back the transaction and
+        #       closes the connection
+        # Throws: nothing
+        try:
+            for stream in self.streamList:
+                if stream.reader:
+                    while self.thread.is_alive():
+                        try:
+                            stream.reader.queue.put(None, timeout=1)
+                            break
+                        except queue.Full:
+                            pass
+            if self.thread:
+                self.thread.join()
+            self.conn.rollback()
+        except Exception as e:
+            print('COPY load rollback failed: %s' % e)
+        finally:
+            self.conn.close()
+
+# end class CopyLoader -----------------------------------------
@@ -0,0 +1,226 @@
+'''
+#
+# sampleCache.py
+#
+# Persistent cache of parsed GEO family.xml sample files used by geo_htload.py
+#
+# An entry is the parsed output of one sample file, pickled and zlib
+# compressed, in a file named by the sha1 of its key:
+#       path + size + mtime
+#   or, if useHash is set
+#       path + size + sha1 of the file contents
+#
+# The mirror re-downloads the sample files every night so their mtime
+# changes even when their contents do not; use the hash to get hits in that
+# case. The key also includes a version the caller bumps whenever the parsed
+# output changes, so stale entries are never used.
+#
+# Entries are evicted least recently used first (a hit touches the entry)
+# once the cache is over its size limit. Each run appends its hits and
+# misses to the stats file.
+#
+# Usage:
+#       sampleCache.py [--report] [--clear]
+#
+#       --report  print the hit rate of each run and the cache size
+#       --clear   remove all entries
+#
+#       The cache directory is SAMPLE_CACHE_DIR
+#
+'''
+import os
+import sys
+import time
+import zlib
+import pickle
+import hashlib
+import argparse
+
+TAB = '\t'
+CRT = '\n'
+
+ENTRY_SUFFIX = '.pkl.z'
+STATS_FILE = 'cache_stats.txt'
+
+class SampleCache:
+    # Is: a directory of parsed sample files
+    # Has: the cache directory, size limit and key options, and the
+    #       hits and misses of this run, counted by the caller
+    # Does: get/put parsed sample files, LRU eviction, run statistics
+    #
+    def __init__ (self, cacheDir, maxBytes, useHash=False, version=1):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: creates cacheDir if it does not exist
+        # Throws: nothing
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.useHash = useHash
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def entryPath(self, path):
+        # Purpose: builds the cache entry file name for 'path'
+        # Returns: full path of the entry, None if 'path' does not exist
+        # Assumes: nothing
+        # Effects: reads 'path' if useHash is set
+        # Throws: nothing
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        if self.useHash:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(block)
+            key = '%s|%s|%s|%s' % (self.version, path, st.st_size, h.hexdigest())
+        else:
+            key = '%s|%s|%s|%s' % (self.version, path, st.st_size, st.st_mtime_ns)
+
+        return os.path.join(self.cacheDir, hashlib.sha1(key.encode()).hexdigest() + ENTRY_SUFFIX)
+
+    def get(self, entry):
+        # Purpose: looks up a parsed sample file
+        # Returns: the cached value or None
+        # Assumes: 'entry' is from entryPath()
+        # Effects: touches the entry so it is the most recently used
+        # Throws: nothing
+        if entry is None:
+            return None
+
+        try:
+            with open(entry, 'rb') as f:
+                value = pickle.loads(zlib.decompress(f.read()))
+        except (OSError, EOFError, zlib.error, pickle.UnpicklingError):
+            return None
+
+        os.utime(entry)
+        return value
+
+    def put(self, entry, value):
+        # Purpose: stores 'value' as the parsed sample file for 'entry'
+        # Returns: nothing
+        # Assumes: 'entry' is from entryPath()
+        # Effects: writes the entry, atomically, safe with concurrent writers
+        # Throws: nothing
+        if entry is None:
+            return
+
+        tmpEntry = '%s.%s.tmp' % (entry, os.getpid())
+        try:
+            with open(tmpEntry, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1))
+            os.replace(tmpEntry, entry)
+        except OSError as e:
+            print('Cannot write sample cache entry %s: %s' % (entry, e))
+
+    def entries(self):
+        # Purpose: lists the cache entries
+        # Returns: list of (mtime, size, path), least recently used first
+        # Assumes: nothing
+        # Effects: reads the cache directory
+        # Throws: nothing
+        entryList = []
+        for d in os.scandir(self.cacheDir):
+            if d.name.endswith(ENTRY_SUFFIX):
+                st = d.stat()
+                entryList.append((st.st_mtime, st.st_size, d.path))
+        entryList.sort()
+        return entryList
+
+    def evict(self):
+        # Purpose: removes least recently used entries until the cache is
+        #       within maxBytes
+        # Returns: number of entries removed
+        # Assumes: nothing
+        # Effects: removes files from the cache directory
+        # Throws: nothing
+        entryList = self.entries()
+        total = sum([e[1] for e in entryList])
+        removed = 0
+        for (mtime, size, path) in entryList:
+            if total <= self.maxBytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def writeStats(self):
+        # Purpose: appends this run's hits and misses to the stats file
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: writes to the cache directory
+        # Throws: nothing
+        with open(os.path.join(self.cacheDir, STATS_FILE), 'a') as f:
+            f.write('%s%s%s%s%s%s' % (time.strftime('%Y-%m-%d %H:%M:%S'), TAB, self.hits, TAB, self.misses, CRT))
+
+# end class SampleCache -----------------------------------------
+
+#
+# Purpose: prints the hit rate of each run and the size of the cache
+# Returns: 0
+# Assumes: Nothing
+# Effects: writes to stdout
+# Throws: Nothing
+#
+
+def report(cache):
+
+    totalHits = 0
+    totalMisses = 0
+
+    print('run%shits%smisses%shit rate' % (TAB, TAB, TAB))
+    statsFile = os.path.join(cache.cacheDir, STATS_FILE)
+    if os.path.exists(statsFile):
+        for line in open(statsFile, 'r'):
+            (runDate, hits, misses) = str.split(line[:-1], TAB)
+            hits = int(hits)
+            misses = int(misses)
+            totalHits += hits
+            totalMisses += misses
+            print('%s%s%s%s%s%s%s' % (runDate, TAB, hits, TAB, misses, TAB, rate(hits, misses)))
+
+    print('all runs%s%s%s%s%s%s' % (TAB, totalHits, TAB, totalMisses, TAB, rate(totalHits, totalMisses)))
+
+    entryList = cache.entries()
+    size = sum([e[1] for e in entryList])
+    print('entries: %s size: %.1f MB limit: %.1f MB' % (len(entryList), size / 1048576.0, cache.maxBytes / 1048576.0))
+
+    return 0
+
+def rate(hits, misses):
+
+    if hits + misses == 0:
+        return '-'
+    return '%.1f%%' % (100.0 * hits / (hits + misses))
+
+#
+# main
+#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='GEO sample file parse cache')
+    parser.add_argument('--report', dest='report', action='store_true',
+        help='print the hit rate of each run and the cache size')
+    parser.add_argument('--clear', dest='clear', action='store_true',
+        help='remove all cache entries')
+    args = parser.parse_args()
+
+    cache = SampleCache(os.environ['SAMPLE_CACHE_DIR'],
+        int(os.getenv('SAMPLE_CACHE_MAX_MB', '2048')) * 1048576)
+
+    if args.clear:
+        for (mtime, size, path) in cache.entries():
+            os.remove(path)
+
+    if args.report or not args.clear:
+        report(cache)
+
+    sys.exit(0)
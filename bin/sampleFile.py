@@ -0,0 +1,248 @@
+'''
+#
+# sampleFile.py
+#
+# Opens the GEO sample files (family.xml) read by geo_htload.py, plain or
+# compressed as the mirror keeps them:
+#       <GSE>_family.xml        plain
+#       <GSE>_family.xml.gz     gzip
+#       <GSE>_family.xml.zst    zstandard, needs the zstandard module
+#       <GSE>_family.xml.tgz    the GEO family tarball as downloaded; only
+#                               its <GSE>_family.xml member is read
+#
+# findSampleFile() returns the first of these that exists, in that order.
+# The compressed files are decompressed as they are read, nothing is
+# written to disk. They cannot be mapped or read at an offset, so
+# geo_htload.py only splits plain files across its workers.
+#
+# Usage:
+#       sampleFile.py --benchmark [file ...]
+#
+#       --benchmark  parse throughput and disk usage of the MINiML
+#                    (family.xml) files given, or of the GEO_DOWNLOADS
+#                    family files if none are, plain and compressed in
+#                    each format
+#
+'''
+import io
+import os
+import sys
+import glob
+import gzip
+import time
+import shutil
+import tarfile
+import argparse
+import tempfile
+import xml.etree.ElementTree as ET
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# the compressed forms of a sample file, in the order they are looked for
+# after the plain file
+COMPRESSED_SUFFIXES = ['.gz', '.zst', '.tgz']
+
+# bytes read from a compressed file at a time
+READ_BYTES = 1048576
+
+class SampleFileStream(io.RawIOBase):
+    # Is: the decompressed bytes of a compressed sample file
+    # Has: the decompressing file object, the files to close with it
+    # Does: readinto(), close(); used through io.BufferedReader
+    #
+    def __init__ (self, fp, closeList):
+        # Purpose: constructor
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: nothing
+        # Throws: nothing
+        self.fp = fp
+        self.closeList = closeList
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        # Purpose: reads decompressed bytes into 'b'
+        # Returns: number of bytes read, 0 at the end of the file
+        # Assumes: nothing
+        # Effects: reads the compressed file
+        # Throws: IOError, EOFError, zlib.error if the file is bad
+        data = self.fp.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        # Purpose: closes the decompressing file object and its files
+        # Returns: nothing
+        # Assumes: nothing
+        # Effects: closes files
+        # Throws: nothing
+        if not self.closed:
+            for fp in [self.fp] + self.closeList:
+                fp.close()
+        io.RawIOBase.close(self)
+
+# end class SampleFileStream -----------------------------------------
+
+#
+# Purpose: finds the sample file of plain path 'samplePath', plain or
+#       compressed
+# Returns: path of the first that exists, None if none do
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
+
+def findSampleFile(samplePath):
+
+    for path in [samplePath] + [samplePath + suffix for suffix in COMPRESSED_SUFFIXES]:
+        if os.path.exists(path):
+            return path
+    return None
+
+#
+# Purpose: determines if 'path' is a compressed sample file
+# Returns: True if it is
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
+
+def isCompressed(path):
+
+    return os.path.splitext(path)[1] in COMPRESSED_SUFFIXES
+
+#
+# Purpose: opens a sample file found by findSampleFile() for reading
+# Returns: binary file object of the decompressed bytes
+# Assumes: Nothing
+# Effects: opens the file
+# Throws: IOError if the file cannot be read, if it is .zst and there
+#       is no zstandard module, or if a .tgz has no family file;
+#       tarfile.TarError
+#
+
+def openSampleFile(path):
+
+    suffix = os.path.splitext(path)[1]
+
+    if suffix == '.gz':
+        return gzip.open(path, 'rb')
+
+    if suffix == '.zst':
+        if zstandard is None:
+            raise IOError('the zstandard module is needed to read %s' % path)
+        fp = open(path, 'rb')
+        return io.BufferedReader(SampleFileStream( \
+            zstandard.ZstdDecompressor().stream_reader(fp), [fp]), READ_BYTES)
+
+    if suffix == '.tgz':
+        # the family file member, <GSE>_family.xml
+        member = os.path.basename(path)[:-len(suffix)]
+        tar = tarfile.open(path, 'r|gz')
+        for info in tar:
+            if info.isfile() and os.path.basename(info.name) == member:
+                return io.BufferedReader(SampleFileStream( \
+                    tar.extractfile(info), [tar]), READ_BYTES)
+        tar.close()
+        raise IOError('%s not in %s' % (member, path))
+
+    return open(path, 'rb')
+
+#
+# Purpose: opens a sample file found by findSampleFile() for reading as
+#       text, invalid utf-8 replaced as geo_htload.py has always read them
+# Returns: text file object
+# Assumes: Nothing
+# Effects: opens the file
+# Throws: see openSampleFile()
+#
+
+def openSampleText(path):
+
+    if not isCompressed(path):
+        return open(path, encoding='utf-8', errors='replace')
+
+    return io.TextIOWrapper(openSampleFile(path), encoding='utf-8', errors='replace')
+
+#
+# Purpose: times the parse of each file plain and compressed, and totals
+#       their sizes on disk
+# Returns: nothing
+# Assumes: nothing
+# Effects: writes the compressed files to a temporary directory, writes
+#       to stdout
+# Throws: nothing
+#
+
+def benchmark(fileList):
+
+    if not fileList:
+        fileList = sorted(glob.glob('%s/*_family.xml' % os.getenv('GEO_DOWNLOADS', '.')))
+    print('%s files' % len(fileList))
+
+    tmpDir = tempfile.mkdtemp()
+    suffixList = [''] + COMPRESSED_SUFFIXES
+    if zstandard is None:
+        suffixList.remove('.zst')
+        print('no zstandard module, .zst skipped')
+
+    pathDict = {}   # suffix: list of paths
+    for suffix in suffixList:
+        pathDict[suffix] = []
+    for fileName in fileList:
+        plainPath = '%s/%s' % (tmpDir, os.path.basename(fileName))
+        shutil.copyfile(fileName, plainPath)
+        for suffix in suffixList:
+            path = plainPath + suffix
+            if suffix == '.gz':
+                with open(plainPath, 'rb') as fin, gzip.open(path, 'wb', 6) as fout:
+                    shutil.copyfileobj(fin, fout, READ_BYTES)
+            elif suffix == '.zst':
+                with open(plainPath, 'rb') as fin, open(path, 'wb') as fout:
+                    zstandard.ZstdCompressor(level=3).copy_stream(fin, fout)
+            elif suffix == '.tgz':
+                with tarfile.open(path, 'w:gz') as tar:
+                    tar.add(plainPath, os.path.basename(plainPath))
+            pathDict[suffix].append(path)
+
+    plainBytes = sum([os.path.getsize(path) for path in pathDict['']])
+    for suffix in suffixList:
+        diskBytes = sum([os.path.getsize(path) for path in pathDict[suffix]])
+        samples = 0
+        startTime = time.time()
+        for path in pathDict[suffix]:
+            fp = openSampleText(path)
+            for event, elem in ET.iterparse(fp):
+                if elem.tag == '{http://www.ncbi.nlm.nih.gov/geo/info/MINiML}Sample':
+                    samples += 1
+                    elem.clear()
+            fp.close()
+        seconds = time.time() - startTime
+        print('%-14s %8.1f MB on disk (%3.0f%%), %6.1f s, %6.1f plain MB/s, %8.0f samples/s' % \
+            ('family.xml' + suffix, diskBytes / 1048576.0, 100.0 * diskBytes / plainBytes, \
+            seconds, plainBytes / 1048576.0 / seconds, samples / seconds))
+
+    shutil.rmtree(tmpDir)
+
+#
+# main
+#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='plain and compressed sample files')
+    parser.add_argument('--benchmark', action='store_true',
+        help='parse throughput and disk usage, plain and compressed')
+    parser.add_argument('fileList', nargs='*', metavar='file',
+        help='MINiML (family.xml) files of the benchmark')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.fileList)
+
+    sys.exit(0)
@@ -0,0 +1,122 @@
+'''
+#
+# test_textNormalize.py
+#
+# Unit tests of the text cleanup functions in textNormalize.py
+#
+# Usage:
+#       python3 -m unittest test_textNormalize    (from bin)
+#       python3 -m pytest bin/test_textNormalize.py
+#
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import textNormalize
+
+class FlattenTest(unittest.TestCase):
+    # Is: tests of flatten()
+    # Has: nothing
+    # Does: checks stripping and the tab and newline replacement
+    #
+
+    def test_ascii(self):
+        self.assertEqual(textNormalize.flatten('C57BL/6J'), 'C57BL/6J')
+
+    def test_tab_newline(self):
+        self.assertEqual(textNormalize.flatten('  wild\ttype\nliver \n'), 'wild type liver')
+
+    def test_non_ascii_kept(self):
+        self.assertEqual(textNormalize.flatten(' 10 µg/ml\t'), '10 µg/ml')
+
+    def test_empty(self):
+        self.assertEqual(textNormalize.flatten(''), '')
+        self.assertEqual(textNormalize.flatten(' \t\n'), '')
+
+    def test_none(self):
+        self.assertRaises(AttributeError, textNormalize.flatten, None)
+
+# end class FlattenTest -----------------------------------------
+
+class RemoveNonAsciiTest(unittest.TestCase):
+    # Is: tests of removeNonAscii()
+    # Has: nothing
+    # Does: checks flattening and the removal of non-ascii characters
+    #
+
+    def test_ascii(self):
+        self.assertEqual(textNormalize.removeNonAscii('E14.5'), 'E14.5')
+
+    def test_non_ascii(self):
+        self.assertEqual(textNormalize.removeNonAscii('Müller glia'), 'Mller glia')
+        self.assertEqual(textNormalize.removeNonAscii('37 °C — 1h'), '37 C  1h')
+        self.assertEqual(textNormalize.removeNonAscii('emoji \U0001f42d mouse'), 'emoji  mouse')
+
+    def test_tab_newline(self):
+        self.assertEqual(textNormalize.removeNonAscii('\tmulti\nline  '), 'multi line')
+
+    def test_empty(self):
+        self.assertEqual(textNormalize.removeNonAscii(''), '')
+        self.assertEqual(textNormalize.removeNonAscii('—'), '')
+
+# end class RemoveNonAsciiTest -----------------------------------------
+
+class ReplaceNonAsciiTest(unittest.TestCase):
+    # Is: tests of replaceNonAscii()
+    # Has: nothing
+    # Does: checks each non-ascii character becomes one space
+    #
+
+    def test_ascii(self):
+        self.assertEqual(textNormalize.replaceNonAscii('lot #42?'), 'lot #42?')
+
+    def test_non_ascii(self):
+        self.assertEqual(textNormalize.replaceNonAscii('wild‐type'), 'wild type')
+        self.assertEqual(textNormalize.replaceNonAscii('　a '), ' a ')
+        self.assertEqual(textNormalize.replaceNonAscii('emoji \U0001f42d'), 'emoji  ')
+
+    def test_tab_newline(self):
+        # tabs and newlines are ascii, they are kept
+        self.assertEqual(textNormalize.replaceNonAscii('\taµ\n'), '\ta \n')
+
+    def test_empty(self):
+        self.assertEqual(textNormalize.replaceNonAscii(''), '')
+
+# end class ReplaceNonAsciiTest -----------------------------------------
+
+class EscapeKeyValueTest(unittest.TestCase):
+    # Is: tests of escapeKeyValue()
+    # Has: nothing
+    # Does: checks the escapes and the non-ascii replacement
+    #
+
+    def test_ascii(self):
+        self.assertEqual(textNormalize.escapeKeyValue('liver'), 'liver')
+
+    def test_escapes(self):
+        self.assertEqual(textNormalize.escapeKeyValue('a\\b'), 'a\\\\b')
+        self.assertEqual(textNormalize.escapeKeyValue('lot #42'), 'lot \\#42')
+        self.assertEqual(textNormalize.escapeKeyValue('treated?'), 'treated\\?')
+        self.assertEqual(textNormalize.escapeKeyValue('\\#?'), '\\\\\\#\\?')
+
+    def test_tab_newline(self):
+        # newlines are escaped, tabs are left to flatten()
+        self.assertEqual(textNormalize.escapeKeyValue('multi\nline'), 'multi\\nline')
+        self.assertEqual(textNormalize.escapeKeyValue('a\tb'), 'a\tb')
+
+    def test_non_ascii(self):
+        self.assertEqual(textNormalize.escapeKeyValue('E14.5 — E18.5'), 'E14.5 -- E18.5')
+        self.assertEqual(textNormalize.escapeKeyValue('10 µg/ml'), '10 ?g/ml')
+        # the '?' of a replaced character is not escaped
+        self.assertEqual(textNormalize.escapeKeyValue('µ?'), '?\\?')
+
+    def test_empty(self):
+        self.assertEqual(textNormalize.escapeKeyValue(''), '')
+
+# end class EscapeKeyValueTest -----------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+'''
+#
+# textNormalize.py
+#
+# Text cleanup of the values written by geo_htload.py and makePredicted.py
+#
+#       flatten()          strip, tabs and newlines to spaces
+#       removeNonAscii()   flatten(), non-ascii characters removed
+#       escapeKeyValue()   MGI_KeyValue key or value: \ # ? and newline
+#                          escaped, em-dash to '--', other non-ascii
+#                          characters to '?'
+#       replaceNonAscii()  non-ascii characters to spaces
+#
+# Most text is already ascii; each function returns it after the cheap
+# steps, the non-ascii characters are removed or replaced by the codecs or
+# a regular expression rather than character by character. The ascii
+# mappings are str.replace calls: on the short characteristic values a
+# str.translate table is several times slower.
+#
+# Usage:
+#       textNormalize.py --benchmark [file ...]
+#
+#       --benchmark  values per second of each function and of the code it
+#                    replaces, over the Characteristics, Description and
+#                    Title values of the MINiML (family.xml) files given,
+#                    or a small built in corpus if none are. Exits 1 if
+#                    any output differs from the replaced code.
+#
+'''
+import re
+import sys
+import time
+import argparse
+import xml.etree.ElementTree as ET
+
+TAB = '\t'
+CRT = '\n'
+
+EM_DASH = '\u2014'
+
+nonAsciiRe = re.compile('[^\x00-\x7f]')
+
+#
+# Purpose: strips 'text' and replaces its tabs and newlines with spaces
+# Returns: str
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: AttributeError if 'text' is None
+#
+
+def flatten(text):
+
+    return text.strip().replace(TAB, ' ').replace(CRT, ' ')
+
+#
+# Purpose: removes all non-ascii characters from 'text'
+#          also remove embedded newline and line feed
+# Returns: 'text' with ascii chars removed
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: AttributeError if 'text' is None
+#
+
+def removeNonAscii(text):
+
+    text = text.strip().replace(TAB, ' ').replace(CRT, ' ')
+    if text.isascii():
+        return text
+    return text.encode('ascii', 'ignore').decode('ascii')
+
+#
+# Purpose: escapes a MGI_KeyValue key or value for the bcp file
+# Returns: str, ascii
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
+
+def escapeKeyValue(text):
+
+    text = text.replace('\\', '\\\\').replace('#', '\\#').replace('?', '\\?').replace(CRT, '\\n')
+    if text.isascii():
+        return text
+    # 'replace' replaces with '?'
+    return text.replace(EM_DASH, '--').encode('ascii', 'replace').decode('ascii')
+
+#
+# Purpose: replaces each non-ascii character of 'text' with a space
+# Returns: str, ascii
+# Assumes: Nothing
+# Effects: Nothing
+# Throws: Nothing
+#
+
+def replaceNonAscii(text):
+
+    if text.isascii():
+        return text
+    return nonAsciiRe.sub(' ', text)
+
+#
+# Purpose: reads the benchmark values from MINiML files
+# Returns: list of str
+# Assumes: Nothing
+# Effects: reads the files
+# Throws: ET.ParseError, IOError
+#
+
+def readCorpus(fileList):
+
+    textList = []
+    for fileName in fileList:
+        for event, elem in ET.iterparse(fileName):
+            tag = elem.tag.split('}')[-1]
+            if tag in ('Characteristics', 'Description', 'Title') and elem.text:
+                textList.append(elem.text)
+            elem.clear()
+    return textList
+
+#
+# Purpose: times each function against the code it replaces and checks
+#       their outputs are the same
+# Returns: 0 if the outputs are the same, else 1
+# Assumes: Nothing
+# Effects: writes to stdout
+# Throws: Nothing
+#
+
+def benchmark(fileList):
+
+    # the code replaced, as it was in geo_htload.py and utilsLib
+    def oldFlatten(text):
+        return ((str.strip(text)).replace(TAB, ' ')).replace(CRT, ' ')
+
+    def oldRemoveNonAscii(text):
+        text = ((str.strip(text)).replace(TAB, ' ')).replace(CRT, ' ')
+        newText = ''
+        for c in text:
+            if ord(c) < 128:
+                newText += c
+        return newText
+
+    def oldEscapeKeyValue(text):
+        text = text.replace('\\', '\\\\')
+        text = text.replace('#', '\\#')
+        text = text.replace('?', '\\?')
+        text = text.replace('\n', '\\n')
+        text = text.replace(b'\xe2\x80\x94'.decode('utf-8'), '--')
+        return text.encode('ascii', 'replace').decode()
+
+    def oldReplaceNonAscii(text):
+        return ''.join([c if ord(c) < 128 else ' ' for c in text])
+
+    # the values with the characters each function handles
+    builtinList = ['C57BL/6J', 'liver', 'E14.5', '  wild type\t', 'multi\nline',
+        '10 \u00b5g/ml', '37 \u00b0C', 'E14.5 \u2014 E18.5', 'wild\u2010type',
+        'M\u00fcller glia', 'lot #42', 'treated?', 'a\\b', '\\#?\n',
+        '\u3000 ideographic space \u00a0', '\u2014', '-', '', 'GSM\ud800',
+        'emoji \U0001f42d mouse']
+
+    if fileList:
+        textList = readCorpus(fileList)
+    else:
+        textList = builtinList * 5000
+    nonAscii = len([t for t in textList if not t.isascii()])
+    print('%s values, %s with non-ascii characters' % (len(textList), nonAscii))
+
+    # escapeKeyValue() is called with the flattened values
+    flatList = [oldFlatten(t) for t in textList + builtinList]
+
+    rc = 0
+    for (name, old, new, valueList) in (
+            ('flatten', oldFlatten, flatten, textList),
+            ('removeNonAscii', oldRemoveNonAscii, removeNonAscii, textList),
+            ('escapeKeyValue', oldEscapeKeyValue, escapeKeyValue, flatList),
+            ('replaceNonAscii', oldReplaceNonAscii, replaceNonAscii, textList)):
+
+        if [old(t) for t in valueList + builtinList] != [new(t) for t in valueList + builtinList]:
+            print('%s: output differs' % name)
+            rc = 1
+
+        startTime = time.time()
+        for t in valueList:
+            old(t)
+        oldTime = time.time() - startTime
+
+        startTime = time.time()
+        for t in valueList:
+            new(t)
+        newTime = time.time() - startTime
+
+        print('%s: %.0f values/s before, %.0f values/s after' % \
+            (name, len(valueList) / oldTime, len(valueList) / newTime))
+
+    return rc
+
+#
+# main
+#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='text cleanup of the loaded values')
+    parser.add_argument('--benchmark', action='store_true',
+        help='values per second before and after, checks the outputs are the same')
+    parser.add_argument('fileList', nargs='*', metavar='file',
+        help='MINiML (family.xml) files of the benchmark values')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        sys.exit(benchmark(args.fileList))
+
+    sys.exit(0)